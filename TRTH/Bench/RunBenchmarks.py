@@ -0,0 +1,387 @@
+"""
+Code for "How Is Earnings News Transmitted to Stock Prices?" by
+Vincent Grégoire and Charles Martineau.
+
+Python 2 and 3
+
+Benchmarks of the processing stages on synthetic TAS data (see
+SyntheticTAS.py). The data is generated once in the benchmark directory
+(again if the settings change), with the inputs of each stage prepared from
+it by the stages before. Each stage then runs in its own process, so that
+its peak memory is its own, and is timed on repeat runs (the fastest one is
+reported):
+
+- read_raw: reading and verifying the raw files, split in trades and quotes
+  (ExtractTrades.py and ExtractQuotes.py).
+- classify: ClassifyTrades.process_classify_chunk on the trades of each day.
+- clean_quotes: ExtractQuotesAroundEarnings.clean_chunk on the quotes of each
+  day.
+- compact_quotes: QuoteRuns.compact_raw_quotes on the quotes of each day.
+- write_sorted: writing the classified trades of each day sorted by RIC with
+  their index (AlignDates.py).
+- resample_quotes, resample_trades and after_news: the process_events
+  functions of ExtractQuotesAfterEarningsResample.py,
+  ExtractTradesAfterEarningsResample.py and ExtractTradesAfterNewsBeforeOpen.py
+  on the event files.
+- spreads: TradeSigning.trade_spreads on the trades and quotes of all events.
+
+Rows are the input rows of the stage, and MB the size of its input: the
+files read, or the memory of the dataframes for the stages working in
+memory. Results are compared to a baseline file (Stage, RowsPerSec,
+PeakRSSMB) and can be saved as the new baseline:
+
+    python RunBenchmarks.py --stages classify clean_quotes --save
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import multiprocessing as mp
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+_root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+for d in ['Common', 'Trades', 'Quotes', 'TAS', 'Bench']:
+    sys.path.append(os.path.join(_root, d))
+
+import ClassifyTrades
+import ExtractQuotesAroundEarnings
+import ExtractQuotesAfterEarningsResample
+import ExtractTradesAfterEarningsResample
+import ExtractTradesAfterNewsBeforeOpen
+from Qualifiers import trade_qualifiers, quote_qualifiers
+from QuoteRuns import compact_raw_quotes
+from Metrics import peak_rss
+from RawFiles import read_verified_csv
+from TickFiles import write_ticks, write_sorted_ticks, read_ticks
+from TradeSigning import mask_empty_quotes, trade_spreads
+from TradingCalendar import event_windows
+from SyntheticTAS import make_tas, tas_cols
+
+
+bench_dir = os.path.join(tempfile.gettempdir(), 'TRTH_Bench')
+baseline_fn = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           'baselines.csv')
+
+exch = 'NAQ'
+start = datetime(2012, 1, 3)
+end = datetime(2012, 1, 10)
+
+# Stages slower than this share of their baseline are flagged.
+tolerance = 0.9
+
+str_cols = ['Ex/Cntrb.ID', 'Exch Time', 'Trd/Qte Date', 'Quote Time']
+trade_cols = ['#RIC', 'Date[G]', 'Time[G]', 'GMT Offset', 'Ex/Cntrb.ID',
+              'Price', 'Volume', 'Market VWAP', 'Qualifiers', 'Seq. No.',
+              'Exch Time', 'Trd/Qte Date']
+quote_cols = ['#RIC', 'Date[G]', 'Time[G]', 'GMT Offset', 'Buyer ID',
+              'Bid Price', 'Bid Size', 'Seller ID', 'Ask Price', 'Ask Size',
+              'Qualifiers', 'Quote Time']
+
+
+def _path(*names):
+    return os.path.join(bench_dir, *names)
+
+
+def _raw_files():
+    out = []
+    for dirpath, dirnames, fns in os.walk(_path('raw')):
+        out += [os.path.join(dirpath, fn) for fn in fns if fn.endswith('.gz')]
+    return sorted(out)
+
+
+def _file_date(fn):
+    return datetime.strptime(os.path.basename(fn)[4:14], '%Y-%m-%d')
+
+
+def _mb(dfs):
+    return sum(df.memory_usage(index=True, deep=True).sum()
+               for df in dfs) / 1e6
+
+
+def _events():
+    events = pd.read_csv(_path('raw', 'events.csv'),
+                         parse_dates=['EA_Time', 'EA_Timestamp'])
+    return [(row.PERMNO, row.EA_Time.to_pydatetime(),
+             row.EA_Timestamp.to_pydatetime(), row[3], row.Exchange)
+            for row in events.itertuples(index=False)]
+
+
+# Name of an event file, as read by the resampling scripts.
+def _event_fn(kind, permno, date):
+    return _path(kind, exch, str(date.year), exch + '-' + kind + '-' +
+                 date.strftime('%Y-%m-%d') + '_' + str(permno) + '.csv')
+
+
+def read_raw(fn):
+    trades = []
+    quotes = []
+    for chunk in read_verified_csv(fn, None, chunksize='auto',
+                                   dtype=dict((c, object) for c in str_cols)):
+        trades.append(chunk.loc[chunk.Type == 'Trade', trade_cols])
+        quotes.append(chunk.loc[chunk.Type == 'Quote', quote_cols])
+    return pd.concat(trades), pd.concat(quotes)
+
+
+# Generates the data (if the settings changed) and the inputs of the stages.
+def prepare(settings):
+    settings_fn = _path('settings.json')
+    if os.path.isfile(settings_fn):
+        with open(settings_fn) as f:
+            if json.load(f) == settings:
+                return
+    for d in ['raw', 'inputs', 'TradesAroundEvent', 'QuotesAroundEvent']:
+        if os.path.isdir(_path(d)):
+            shutil.rmtree(_path(d))
+        os.makedirs(_path(d))
+
+    sys.stderr.write('Generating the synthetic data in ' + bench_dir + '\n')
+    make_tas(_path('raw'), start, end, exch, **settings)
+
+    days = {}
+    for fn in _raw_files():
+        df_trades, df_quotes = read_raw(fn)
+        date = _file_date(fn)
+        prev = days.get(date, ([], []))
+        days[date] = (prev[0] + [df_trades], prev[1] + [df_quotes])
+    trades = [(date, pd.concat(x[0])) for date, x in sorted(days.items())]
+    quotes = [(date, pd.concat(x[1])) for date, x in sorted(days.items())]
+    pd.to_pickle(trades, _path('inputs', 'trades.pkl'))
+    pd.to_pickle(quotes, _path('inputs', 'quotes.pkl'))
+
+    parsed = [(date, ClassifyTrades.process_classify_chunk(exch, date,
+                                                           df)[0])
+              for date, df in trades]
+    pd.to_pickle(parsed, _path('inputs', 'parsed.pkl'))
+    df_parsed = pd.concat([df for date, df in parsed])
+    df_clean = pd.concat([ExtractQuotesAroundEarnings.clean_chunk(df.copy())
+                          for date, df in quotes])
+
+    # Event files, over the windows of the extraction scripts
+    for permno, date, ea_ts, ric, exch_ in _events():
+        for kind, df, after, qualifiers in [
+                ('TradesAroundEvent', df_parsed, 1, trade_qualifiers),
+                ('QuotesAroundEvent', df_clean, 2, quote_qualifiers)]:
+            first, last = event_windows(date, date, 1, after)
+            sel = ((df['#RIC'] == ric) & (df['Date'] >= first) &
+                   (df['Date'] <= last))
+            fn = _event_fn(kind, permno, date)
+            if not os.path.isdir(os.path.dirname(fn)):
+                os.makedirs(os.path.dirname(fn))
+            write_ticks(df[sel], fn, 'csv', 'gzip', 1, qualifiers)
+
+    with open(settings_fn, 'w') as f:
+        json.dump(settings, f)
+
+
+def _event_files(kind):
+    return [fn + '.gz' for fn in (_event_fn(kind, e[0], e[1])
+                                  for e in _events())]
+
+
+def _event_rows(kind):
+    return sum(len(read_ticks(fn[:-3])) for fn in _event_files(kind))
+
+
+def _file_mb(fns):
+    return sum(os.path.getsize(fn) for fn in fns) / 1e6
+
+
+# Each stage returns (run, rows, MB): run() runs the stage once.
+
+def stage_read_raw():
+    fns = _raw_files()
+
+    def run():
+        for fn in fns:
+            read_raw(fn)
+    rows = sum(len(df) for date, df in pd.read_pickle(
+        _path('inputs', 'trades.pkl')) + pd.read_pickle(
+        _path('inputs', 'quotes.pkl')))
+    return run, rows, _file_mb(fns)
+
+
+def stage_classify():
+    days = pd.read_pickle(_path('inputs', 'trades.pkl'))
+
+    def run():
+        for date, df in days:
+            ClassifyTrades.process_classify_chunk(exch, date, df)
+    return run, sum(len(df) for date, df in days), _mb([df for d, df in days])
+
+
+def stage_clean_quotes():
+    days = pd.read_pickle(_path('inputs', 'quotes.pkl'))
+
+    def run():
+        for date, df in days:
+            ExtractQuotesAroundEarnings.clean_chunk(df.copy())
+    return run, sum(len(df) for date, df in days), _mb([df for d, df in days])
+
+
+def stage_compact_quotes():
+    days = pd.read_pickle(_path('inputs', 'quotes.pkl'))
+
+    def run():
+        for date, df in days:
+            compact_raw_quotes(df)
+    return run, sum(len(df) for date, df in days), _mb([df for d, df in days])
+
+
+def stage_write_sorted():
+    days = pd.read_pickle(_path('inputs', 'parsed.pkl'))
+    fn = _path('inputs', 'sorted')
+
+    def run():
+        for date, df in days:
+            write_sorted_ticks(df, fn, 'csv', 'gzip', 1, trade_qualifiers)
+    return run, sum(len(df) for date, df in days), _mb([df for d, df in days])
+
+
+def stage_resample_quotes():
+    module = ExtractQuotesAfterEarningsResample
+    module.quotes_dir = _path('QuotesAroundEvent') + os.sep
+    events = _events()
+    return (lambda: module.process_events(events),
+            _event_rows('QuotesAroundEvent'),
+            _file_mb(_event_files('QuotesAroundEvent')))
+
+
+def stage_resample_trades():
+    module = ExtractTradesAfterEarningsResample
+    module.trade_dir = _path('TradesAroundEvent') + os.sep
+    events = _events()
+    return (lambda: module.process_events(events),
+            _event_rows('TradesAroundEvent'),
+            _file_mb(_event_files('TradesAroundEvent')))
+
+
+def stage_after_news():
+    module = ExtractTradesAfterNewsBeforeOpen
+    module.trades_dir = _path('TradesAroundEvent') + os.sep
+    events = _events()
+    return (lambda: module.process_events(events),
+            _event_rows('TradesAroundEvent'),
+            _file_mb(_event_files('TradesAroundEvent')))
+
+
+def stage_spreads():
+    df_trades = pd.concat([
+        read_ticks(fn[:-3], columns=['#RIC', 'Timestamp', 'Price',
+                                     'Volume'])
+        for fn in _event_files('TradesAroundEvent')], ignore_index=True)
+    df_quotes = pd.concat([
+        read_ticks(fn[:-3], columns=['#RIC', 'Timestamp', 'Bid Price',
+                                     'Bid Size', 'Ask Price', 'Ask Size',
+                                     'NoQuote'])
+        for fn in _event_files('QuotesAroundEvent')], ignore_index=True)
+    df_quotes = mask_empty_quotes(df_quotes)
+    return (lambda: trade_spreads(df_trades, df_quotes),
+            len(df_trades) + len(df_quotes), _mb([df_trades, df_quotes]))
+
+
+stages = ['read_raw', 'classify', 'clean_quotes', 'compact_quotes',
+          'write_sorted', 'resample_quotes', 'resample_trades',
+          'after_news', 'spreads']
+
+
+# Runs in the process of the stage.
+def _run_stage(name, directory, repeat, results):
+    global bench_dir
+    bench_dir = directory
+    try:
+        run, rows, mb = globals()['stage_' + name]()
+        times = []
+        for i in range(repeat):
+            t = time.time()
+            run()
+            times.append(time.time() - t)
+        peak = peak_rss()
+        seconds = min(times)
+        results.put((name, None, rows, mb, seconds, rows / seconds,
+                     mb / seconds, None if peak is None else peak / 1e6))
+    except Exception:
+        import traceback
+        results.put((name, traceback.format_exc()))
+
+
+def run_stage(name, repeat=3):
+    results = mp.Queue()
+    p = mp.Process(target=_run_stage, args=(name, bench_dir, repeat,
+                                            results))
+    p.start()
+    result = results.get()
+    p.join()
+    if result[1] is not None:
+        raise RuntimeError('Stage ' + name + ' failed:\n' + result[1])
+    return (result[0],) + result[2:]
+
+
+# Adds the baseline and the ratio to it of the speed and peak memory.
+def compare(df, baseline):
+    base = baseline.set_index('Stage')
+    df['BaseRowsPerSec'] = df['Stage'].map(base['RowsPerSec'])
+    df['Speed'] = df['RowsPerSec'] / df['BaseRowsPerSec']
+    df['BasePeakRSSMB'] = df['Stage'].map(base['PeakRSSMB'])
+    df['Memory'] = df['PeakRSSMB'] / df['BasePeakRSSMB']
+    df['Flag'] = np.where(df['Speed'] < tolerance, 'SLOWER', '')
+    return df
+
+
+def main(argv=None):
+    global bench_dir
+    parser = argparse.ArgumentParser(description='Benchmarks of the TRTH '
+                                     'processing stages on synthetic data.')
+    parser.add_argument('--dir', default=bench_dir)
+    parser.add_argument('--stages', nargs='+', default=stages,
+                        choices=stages)
+    parser.add_argument('--rics', type=int, default=20)
+    parser.add_argument('--trades', type=int, default=2000,
+                        help='trades per RIC and day')
+    parser.add_argument('--quotes', type=int, default=10000,
+                        help='quotes per RIC and day')
+    parser.add_argument('--after-hours', type=float, default=0.1)
+    parser.add_argument('--late', type=float, default=0.01)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--baseline', default=baseline_fn)
+    parser.add_argument('--save', action='store_true',
+                        help='save the results as the baseline')
+    args = parser.parse_args(argv)
+
+    bench_dir = args.dir
+    if not os.path.isdir(bench_dir):
+        os.makedirs(bench_dir)
+    prepare({'rics': args.rics, 'trades': args.trades,
+             'quotes': args.quotes, 'after_hours': args.after_hours,
+             'late': args.late})
+
+    rows = []
+    for name in args.stages:
+        rows.append(run_stage(name, args.repeat))
+        sys.stderr.write('%s: %.0f rows/s\n' % (name, rows[-1][4]))
+    df = pd.DataFrame(rows, columns=['Stage', 'Rows', 'MB', 'Seconds',
+                                     'RowsPerSec', 'MBPerSec', 'PeakRSSMB'])
+    if os.path.isfile(args.baseline):
+        df = compare(df, pd.read_csv(args.baseline))
+    df.to_csv(_path('results.csv'), index=False)
+    print(df.to_string(index=False, float_format=lambda x: '%.3g' % x))
+
+    if args.save:
+        cols = ['Stage', 'Rows', 'MB', 'Seconds', 'RowsPerSec', 'MBPerSec',
+                'PeakRSSMB']
+        if os.path.isfile(args.baseline):
+            # Stages not run keep their baseline.
+            old = pd.read_csv(args.baseline)
+            df = pd.concat([old[~old['Stage'].isin(df['Stage'])], df[cols]])
+        df[cols].to_csv(args.baseline, index=False)
+    return df
+
+
+if __name__ == '__main__':
+    main()
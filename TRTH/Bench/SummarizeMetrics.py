@@ -0,0 +1,149 @@
+"""
+Code for "How Is Earnings News Transmitted to Stock Prices?" by
+Vincent Grégoire and Charles Martineau.
+
+Python 2 and 3
+
+Summary of the metrics logs written by the processing stages (see
+Common/Metrics.py). The records of all the workers (and of several logs) are
+put together, and two tables are printed:
+
+- The phases ranked by their own time (self_wall, without the phases inside
+  them) summed over all tasks, with their share of the time of their stage,
+  their CPU time, rows and rows per second. The "(other)" phase of a stage is
+  the time of its tasks outside any phase or nested task.
+- The slowest tasks (one exchange-day, exchange-month or event), with their
+  CPU time, bytes read, throughput and peak memory during the task (or the
+  peak of their worker so far, worker_peak_rss, when the peak of the task
+  could not be measured, see Metrics.py).
+
+    python SummarizeMetrics.py metrics.jsonl --top 20
+"""
+
+import sys
+import json
+import argparse
+
+import pandas as pd
+
+
+def read_logs(fnames):
+    records = []
+    for fn in fnames:
+        with open(fn) as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    records.append(json.loads(line))
+    return records
+
+
+# Tasks (one row per record) and phases (one row per phase of each record).
+def to_frames(records):
+    tasks = []
+    phases = []
+    for k, r in enumerate(records):
+        counters = r.get('counters', {})
+        tasks.append({'id': k, 'stage': r['stage'], 'task': r['task'],
+                      'pid': r['pid'], 'parent': r.get('parent'),
+                      'wall': r['wall'], 'cpu': r['cpu'], 'ok': r['ok'],
+                      'peak_rss': r.get('peak_rss'),
+                      'worker_peak_rss': r.get('worker_peak_rss'),
+                      'bytes': counters.get('compressed_bytes',
+                                            counters.get('input_bytes', 0))})
+        for name, p in r.get('phases', {}).items():
+            row = dict(p)
+            row.update({'id': k, 'stage': r['stage'], 'phase': name})
+            phases.append(row)
+    tasks = pd.DataFrame(tasks, columns=['id', 'stage', 'task', 'pid',
+                                         'parent', 'wall', 'cpu', 'ok',
+                                         'peak_rss', 'worker_peak_rss',
+                                         'bytes'])
+    phases = pd.DataFrame(phases, columns=['id', 'stage', 'phase', 'calls',
+                                           'wall', 'cpu', 'self_wall',
+                                           'self_cpu', 'rows_in', 'rows_out'])
+    return tasks, phases
+
+
+# Time of each task outside its phases and nested tasks, as "(other)" phases.
+def other_phases(tasks, phases):
+    own = phases.groupby('id')[['self_wall', 'self_cpu']].sum()
+    # Records are written as tasks end, so the outer task of a nested task is
+    # the next record of its process with the parent name.
+    nested = tasks[tasks['parent'].notnull()]
+    inner = pd.DataFrame(0.0, index=tasks['id'], columns=['wall', 'cpu'])
+    for r in nested.itertuples():
+        outer = tasks[(tasks['pid'] == r.pid) & (tasks['task'] == r.parent) &
+                      (tasks['id'] > r.id)]
+        if len(outer) > 0:
+            inner.loc[outer['id'].iloc[0], 'wall'] += r.wall
+            inner.loc[outer['id'].iloc[0], 'cpu'] += r.cpu
+    t = tasks.set_index('id')
+    other = pd.DataFrame({
+        'id': t.index, 'stage': t['stage'], 'phase': '(other)', 'calls': 1,
+        'self_wall': t['wall'] - own['self_wall'].reindex(t.index).fillna(0)
+        - inner['wall'],
+        'self_cpu': t['cpu'] - own['self_cpu'].reindex(t.index).fillna(0)
+        - inner['cpu'],
+        'rows_in': 0, 'rows_out': 0})
+    other['wall'] = other['self_wall']
+    other['cpu'] = other['self_cpu']
+    return other.reset_index(drop=True)
+
+
+def rank_phases(tasks, phases):
+    df = pd.concat([phases, other_phases(tasks, phases)], ignore_index=True,
+                   sort=False)
+    out = df.groupby(['stage', 'phase'])[['calls', 'self_wall', 'self_cpu',
+                                          'wall', 'rows_in',
+                                          'rows_out']].sum().reset_index()
+    # Time of the stage, nested tasks counted once.
+    stage_wall = tasks[tasks['parent'].isnull()].groupby('stage')['wall'].sum()
+    stage_wall = stage_wall.reindex(out['stage'].unique())
+    stage_wall = stage_wall.fillna(tasks.groupby('stage')['wall'].sum())
+    out['share'] = out['self_wall'] / out['stage'].map(stage_wall)
+    out['rows_per_sec'] = out['rows_in'] / out['wall'].where(out['wall'] > 0)
+    return out.sort_values('self_wall', ascending=False)
+
+
+def slowest_tasks(tasks, top):
+    df = tasks.sort_values('wall', ascending=False).head(top).copy()
+    df['MB'] = df['bytes'] / 1e6
+    df['MB_per_sec'] = df['MB'] / df['wall'].where(df['wall'] > 0)
+    cols = ['stage', 'task', 'wall', 'cpu', 'MB', 'MB_per_sec']
+    for c in ['peak_rss', 'worker_peak_rss']:
+        if df[c].notnull().any():
+            df[c + '_MB'] = df[c].astype(float) / 1e6
+            cols.append(c + '_MB')
+    return df[cols + ['ok']]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Ranks the phases and tasks '
+                                     'of metrics logs.')
+    parser.add_argument('logs', nargs='+')
+    parser.add_argument('--top', type=int, default=20)
+    parser.add_argument('--stage', default=None,
+                        help='only the stages containing this name')
+    args = parser.parse_args(argv)
+
+    tasks, phases = to_frames(read_logs(args.logs))
+    if args.stage is not None:
+        phases = phases[phases['stage'].str.contains(args.stage, regex=False)]
+        tasks = tasks[tasks['stage'].str.contains(args.stage, regex=False)]
+    if len(tasks) == 0:
+        sys.stderr.write('No tasks in the logs.\n')
+        return
+
+    fmt = lambda x: '%.3g' % x
+    print('Hot phases (own time, without the phases inside them):')
+    print(rank_phases(tasks, phases).head(args.top).to_string(
+        index=False, float_format=fmt))
+    print('')
+    print('Slowest tasks:')
+    print(slowest_tasks(tasks, args.top).to_string(index=False,
+                                                   float_format=fmt))
+
+
+if __name__ == '__main__':
+    main()
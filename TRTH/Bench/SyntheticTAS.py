@@ -0,0 +1,330 @@
+"""
+Code for "How Is Earnings News Transmitted to Stock Prices?" by
+Vincent Grégoire and Charles Martineau.
+
+Python 2 and 3
+
+Synthetic raw TRTH TAS files, for benchmarks and for trying changes to the
+processing stages without the licensed data. The files have the layout of
+the raw files (exch/TAS/yyyy/mm/exch-yyyy-mm-dd-TAS-Data-k.csv.gz with their
+.md5sum file), the TAS columns in their raw formats (dates as 03-JAN-2012,
+GMT times, GMT offset of the day) and rows of several types.
+
+Each RIC has trades and NBBO quotes on each trading day, with a share of
+them in the extended trading hours (4:00 to 9:30 and 16:00 to 20:00). Files
+are split by GMT date, as the raw files are, so the after-hours ticks past
+midnight GMT are in the file of the next day. A share of the trades is
+reported late: they are in the file of the next trading day, with the
+exchange time and trade date of the day they were executed and an out of
+sequence condition. Trade and quote qualifiers use the TRTH vocabularies
+decoded by Common/Qualifiers.py ([LSTSALCOND], [GV3_TEXT], [IRGCOND],
+[CTS_QUAL], [PRC_QL_CD] and [PRC_QL3]).
+
+Run as a script, it writes a small sample tree:
+
+    python SyntheticTAS.py outdir
+"""
+
+import os
+import sys
+import gzip
+import hashlib
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', 'Common'))
+from TradingCalendar import trading_days
+
+
+tas_cols = ['#RIC', 'Date[G]', 'Time[G]', 'GMT Offset', 'Type',
+            'Ex/Cntrb.ID', 'Price', 'Volume', 'Market VWAP',
+            'Buyer ID', 'Bid Price', 'Bid Size', 'Seller ID', 'Ask Price',
+            'Ask Size', 'Qualifiers', 'Seq. No.', 'Exch Time',
+            'Trd/Qte Date', 'Quote Time']
+
+venues = ['NAS', 'NYS', 'ADF', 'BAT', 'ARC', 'THM', 'PSE', 'BOS']
+
+# Sale conditions of the trades, by session. Odd lots also get the
+# ODT[IRGCOND] qualifier.
+regular_conditions = [('@   [LSTSALCOND]', 0.75),
+                      ('@F  [LSTSALCOND]', 0.15),
+                      ('@  I[LSTSALCOND];ODT[IRGCOND]', 0.05),
+                      ('@ W [LSTSALCOND]', 0.02),
+                      ('@ 4 [LSTSALCOND]', 0.01),
+                      ('@ P [LSTSALCOND]', 0.01),
+                      ('@ N [LSTSALCOND]', 0.01)]
+extended_conditions = [
+    ('@ T [GV3_TEXT];@ T [LSTSALCOND]', 0.8),
+    ('@FT [GV3_TEXT];@FT [LSTSALCOND]', 0.1),
+    ('@ TI[GV3_TEXT];@ TI[LSTSALCOND];ODT[IRGCOND]', 0.1)]
+open_condition = '@O X[LSTSALCOND];O [CTS_QUAL]'
+close_condition = '@6 X[LSTSALCOND]'
+late_conditions = [('@  Z[LSTSALCOND]', 0.5), ('@ TU[LSTSALCOND]', 0.5)]
+
+# Price qualifiers of the quotes (missing for most of them).
+quote_conditions = [(None, 0.6), ('R[PRC_QL_CD]', 0.3),
+                    ('NQ [PRC_QL3]', 0.05), ('OQ[PRC_QL_CD]', 0.025),
+                    ('CQ[PRC_QL_CD]', 0.025)]
+
+months = ['JAN', 'FEB', 'MAR', 'APR', 'MAY', 'JUN', 'JUL', 'AUG', 'SEP',
+          'OCT', 'NOV', 'DEC']
+
+NS_MS = 1000000
+NS_HOUR = 3600 * 1000 * NS_MS
+
+
+# GMT offset of New York: -4 from the second Sunday of March to the first
+# Sunday of November, -5 otherwise.
+def gmt_offset(date):
+    march = datetime(date.year, 3, 8)
+    start = march + timedelta(days=(6 - march.weekday()) % 7)
+    november = datetime(date.year, 11, 1)
+    end = november + timedelta(days=(6 - november.weekday()) % 7)
+    day = datetime(date.year, date.month, date.day)
+    return -4 if start <= day < end else -5
+
+
+def _choice(rng, vocabulary, n):
+    values = [x[0] for x in vocabulary]
+    p = np.array([x[1] for x in vocabulary], dtype=np.float64)
+    idx = rng.choice(len(values), n, p=p / p.sum())
+    return np.array(values, dtype=object)[idx]
+
+
+def _two(x):
+    return np.char.zfill(x.astype(str), 2)
+
+
+# TRTH time strings (HH:MM:SS.mmm) of times in ns since midnight.
+def format_times(ns):
+    ms = np.asarray(ns, dtype=np.int64) // NS_MS
+    out = np.char.add(_two(ms // 3600000), ':')
+    out = np.char.add(out, _two(ms // 60000 % 60))
+    out = np.char.add(np.char.add(out, ':'), _two(ms // 1000 % 60))
+    out = np.char.add(np.char.add(out, '.'),
+                      np.char.zfill((ms % 1000).astype(str), 3))
+    return out.astype(object)
+
+
+# TRTH date strings (03-JAN-2012) of dates in ns since the epoch.
+def format_dates(ns):
+    days, codes = np.unique(np.asarray(ns, dtype=np.int64) // (24 * NS_HOUR),
+                            return_inverse=True)
+    names = []
+    for d in days:
+        d = datetime(1970, 1, 1) + timedelta(days=int(d))
+        names.append('%02d-%s-%d' % (d.day, months[d.month - 1], d.year))
+    return np.array(names, dtype=object)[codes]
+
+
+# Local times (ns since midnight) of n ticks of one day, with a share of
+# them in the extended trading hours.
+def _session_times(rng, n, after_hours):
+    extended = rng.random_sample(n) < after_hours
+    pre = rng.random_sample(n) < 0.4
+    regular = rng.uniform(9.5, 16, n)
+    ext = np.where(pre, rng.uniform(4, 9.5, n), rng.uniform(16, 20, n))
+    hours = np.where(extended, ext, regular)
+    return np.sort((hours * NS_HOUR).astype(np.int64))
+
+
+def _day_trades(rng, ric, day, n, after_hours, price):
+    offset = gmt_offset(day)
+    local = _session_times(rng, n, after_hours)
+    hours = local / float(NS_HOUR)
+    extended = (hours < 9.5) | (hours >= 16)
+    cond = np.where(extended, _choice(rng, extended_conditions, n),
+                    _choice(rng, regular_conditions, n))
+    regular = np.flatnonzero(~extended)
+    if len(regular) > 1:
+        cond[regular[0]] = open_condition
+        cond[regular[-1]] = close_condition
+
+    odd = pd.Series(cond).str.contains('ODT', regex=False).values
+    volume = np.where(odd, rng.randint(1, 100, n),
+                      100 * rng.randint(1, 20, n)).astype(np.float64)
+    # Some trades without volume, which are dropped by ClassifyTrades.py
+    volume[rng.random_sample(n) < 0.002] = 0.0
+    steps = rng.normal(0, 0.0005, n) * (1 + 2 * extended)
+    prices = np.round(price * np.exp(np.cumsum(steps)), 2)
+
+    executed = pd.Timestamp(day).value + local - offset * NS_HOUR
+    reported = executed + rng.randint(0, 500, n) * NS_MS
+    return pd.DataFrame({'#RIC': ric, 'Executed': executed,
+                         'Reported': reported,
+                         'GMT Offset': offset, 'Type': 'Trade',
+                         'Ex/Cntrb.ID': rng.choice(venues, n),
+                         'Price': prices, 'Volume': volume,
+                         'Qualifiers': cond})
+
+
+def _day_quotes(rng, ric, day, n, after_hours, price, repeat):
+    offset = gmt_offset(day)
+    local = _session_times(rng, n, after_hours)
+    hours = local / float(NS_HOUR)
+    extended = (hours < 9.5) | (hours >= 16)
+
+    # Book states change at a share of the updates only, and are otherwise
+    # repeated with a new timestamp.
+    state = np.cumsum(rng.random_sample(n) >= repeat)
+    mid = price * np.exp(np.cumsum(rng.normal(0, 0.0005, state[-1] + 1)))
+    half = 0.01 * (1 + rng.randint(0, 3, state[-1] + 1))
+    mid = mid[state]
+    half = half[state] * (1 + 4 * extended)
+    bid = np.round(mid - half, 2)
+    ask = np.round(mid + half, 2)
+    bid_size = rng.randint(1, 20, state[-1] + 1)[state].astype(np.float64)
+    ask_size = rng.randint(1, 20, state[-1] + 1)[state].astype(np.float64)
+    # Empty sides, more frequent in the extended trading hours
+    p_empty = 0.02 + 0.1 * extended
+    empty_bid = rng.random_sample(state[-1] + 1)[state] < p_empty
+    empty_ask = rng.random_sample(state[-1] + 1)[state] < p_empty
+    bid[empty_bid] = 0.0
+    bid_size[empty_bid] = 0.0
+    ask[empty_ask] = 0.0
+    ask_size[empty_ask] = 0.0
+    cond = _choice(rng, quote_conditions, state[-1] + 1)[state]
+
+    executed = pd.Timestamp(day).value + local - offset * NS_HOUR
+    return pd.DataFrame({'#RIC': ric, 'Executed': executed,
+                         'Reported': executed + rng.randint(0, 50, n) * NS_MS,
+                         'GMT Offset': offset, 'Type': 'Quote',
+                         'Bid Price': bid, 'Bid Size': bid_size,
+                         'Ask Price': ask, 'Ask Size': ask_size,
+                         'Qualifiers': cond})
+
+
+# Raw TAS rows in the TRTH formats, from the executed and reported times
+# (ns since the epoch, GMT).
+def _tas_rows(df, rng):
+    n = len(df)
+    reported = df['Reported'].values
+    executed = df['Executed'].values
+    day = 24 * NS_HOUR
+    out = pd.DataFrame({'#RIC': df['#RIC'].values,
+                        'Date[G]': format_dates(reported),
+                        'Time[G]': format_times(reported % day)})
+    for c in tas_cols[3:]:
+        if c in df.columns:
+            out[c] = df[c].values
+        elif c not in ('Exch Time', 'Trd/Qte Date', 'Quote Time'):
+            out[c] = np.nan
+    trade = (df['Type'] == 'Trade').values
+    quote = (df['Type'] == 'Quote').values
+
+    # Missing exchange times, trade dates and quote times
+    exch_time = np.where(trade & (rng.random_sample(n) > 0.01),
+                         format_times(executed % day), None)
+    trade_date = np.where(trade & (rng.random_sample(n) > 0.01),
+                          format_dates(executed), None)
+    quote_time = np.where(quote & (rng.random_sample(n) > 0.05),
+                          format_times(executed % day), None)
+    out['Exch Time'] = exch_time
+    out['Trd/Qte Date'] = trade_date
+    out['Quote Time'] = quote_time
+    return out[tas_cols]
+
+
+# Writes the raw TAS files of one exchange for the trading days from start
+# to end (and the GMT days that follow them). rics is the number of RICs (or
+# the list of RICs), trades and quotes the number of trades and quotes per
+# RIC and day, after_hours the share of the ticks in the extended trading
+# hours, late the share of the trades reported the next trading day, repeat
+# the share of the quotes repeating the previous book state, duplicates the
+# share of the trades sent twice with the same sequence number, and files
+# the number of files per day. Also writes the list of the RICs (#RIC) and a
+# table of one event per RIC (PERMNO, EA_Time, EA_Timestamp, #RIC,
+# Exchange) in root. Returns the list of raw files.
+def make_tas(root, start, end, exch='NAQ', rics=20, trades=2000,
+             quotes=10000, after_hours=0.1, late=0.01, repeat=0.5,
+             duplicates=0.001, files=2, seed=0):
+    rng = np.random.RandomState(seed)
+    if not isinstance(rics, (list, tuple)):
+        rics = ['R%03d.O' % i for i in range(rics)]
+    days = trading_days[(trading_days >= np.datetime64(start, 'D')) &
+                        (trading_days <= np.datetime64(end, 'D'))]
+    days = [pd.Timestamp(d).to_pydatetime() for d in days]
+    prices = dict((ric, rng.uniform(10, 200)) for ric in rics)
+
+    dfs = []
+    for i, day in enumerate(days):
+        for ric in rics:
+            df_trades = _day_trades(rng, ric, day, trades, after_hours,
+                                    prices[ric])
+            prices[ric] = df_trades['Price'].iloc[-1]
+            # Late trades are reported in the first hours of the next
+            # trading day, with an out of sequence condition.
+            is_late = rng.random_sample(len(df_trades)) < late
+            if i + 1 < len(days) and is_late.any():
+                nxt = days[i + 1]
+                k = is_late.sum()
+                df_trades.loc[is_late, 'Reported'] = (
+                    pd.Timestamp(nxt).value +
+                    (rng.uniform(4, 9.5, k) * NS_HOUR).astype(np.int64) -
+                    gmt_offset(nxt) * NS_HOUR)
+                df_trades.loc[is_late, 'GMT Offset'] = gmt_offset(nxt)
+                df_trades.loc[is_late, 'Qualifiers'] = _choice(
+                    rng, late_conditions, k)
+            df_quotes = _day_quotes(rng, ric, day, quotes, after_hours,
+                                    prices[ric], repeat)
+            dfs.extend([df_trades, df_quotes])
+    df = pd.concat(dfs, ignore_index=True)
+
+    # Sequence numbers per RIC in order of report, and trades sent twice
+    df = df.sort_values(['#RIC', 'Reported'], kind='mergesort')
+    df['Seq. No.'] = df.groupby('#RIC').cumcount() + 1
+    dup = df[(df['Type'] == 'Trade').values &
+             (rng.random_sample(len(df)) < duplicates)]
+    df = pd.concat([df, dup]).sort_values(['#RIC', 'Reported'],
+                                          kind='mergesort')
+    # A few rows of other types, which the stages skip
+    other = rng.random_sample(len(df)) < 0.001
+    df.loc[other, 'Type'] = 'Correction'
+
+    out = _tas_rows(df, rng)
+    gmt_day = df['Reported'].values // (24 * NS_HOUR)
+    fns = []
+    for d in np.unique(gmt_day):
+        date = datetime(1970, 1, 1) + timedelta(days=int(d))
+        mdir = os.path.join(root, exch, 'TAS', str(date.year),
+                            str(date.month).zfill(2))
+        if not os.path.isdir(mdir):
+            os.makedirs(mdir)
+        rows = out[gmt_day == d]
+        for k, part in enumerate(np.array_split(np.arange(len(rows)), files)):
+            fn = os.path.join(mdir, '%s-%s-TAS-Data-%d.csv.gz' %
+                              (exch, date.strftime('%Y-%m-%d'), k))
+            with gzip.open(fn, 'wb', compresslevel=6) as f:
+                data = rows.iloc[part].to_csv(index=False)
+                f.write(data.encode('utf-8'))
+            with open(fn, 'rb') as f:
+                md5 = hashlib.md5(f.read()).hexdigest()
+            with open(fn + '.md5sum', 'w') as f:
+                f.write(md5 + '  ' + os.path.basename(fn) + '\n')
+            fns.append(fn)
+
+    pd.DataFrame({'#RIC': rics}).to_csv(os.path.join(root, 'rics.csv'),
+                                        index=False)
+    # Announcements after the close or before the open, on days that have a
+    # trading day before and after them.
+    inner = days[1:-1] or days
+    ea_days = [inner[rng.randint(len(inner))] for ric in rics]
+    ea_times = [day + (timedelta(hours=16, minutes=5)
+                       if rng.random_sample() < 0.7 else timedelta(hours=7))
+                for day in ea_days]
+    pd.DataFrame({'PERMNO': 10000 + np.arange(len(rics)),
+                  'EA_Time': ea_days, 'EA_Timestamp': ea_times,
+                  '#RIC': rics, 'Exchange': exch},
+                 columns=['PERMNO', 'EA_Time', 'EA_Timestamp', '#RIC',
+                          'Exchange']).to_csv(
+        os.path.join(root, 'events.csv'), index=False)
+    return fns
+
+
+if __name__ == '__main__':
+    outdir = sys.argv[1] if len(sys.argv) > 1 else 'SyntheticTAS'
+    for fn in make_tas(outdir, datetime(2012, 1, 3), datetime(2012, 1, 6)):
+        print(fn)
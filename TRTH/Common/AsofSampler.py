@@ -0,0 +1,148 @@
+"""
+Code for "How Is Earnings News Transmitted to Stock Prices?" by
+Vincent Grégoire and Charles Martineau.
+
+Python 2 and 3
+
+As-of sampling of tick data on several event-time grids at once. A grid is
+an (anchor, step, first, last) tuple, for the times anchor + k * step with k
+from first to last. The sample at each time is the last tick at or before
+it, as with pd.merge_asof. The times of all the grids are located in the
+sorted tick timestamps with a single searchsorted, and the columns are then
+taken for every grid from the same positions.
+
+The ticks of many events can also be sampled at once, each event on its own
+grid, into an (event x offset x column) panel. The as-of join is done for all
+events in one searchsorted, keyed by event and time. The same grouped as-of
+join (grouped_asof) also finds the quote prevailing at each trade of several
+RICs.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def _ns(x, unit):
+    return np.asarray(x, dtype=unit).view(np.int64)
+
+
+# Times of a grid in int64 nanoseconds, and the step offsets k.
+def grid_times(anchor, step, first, last):
+    offsets = np.arange(first, last + 1, dtype=np.int64)
+    anchor_ns = _ns(np.datetime64(pd.Timestamp(anchor)), 'M8[ns]')
+    step_ns = _ns(np.timedelta64(pd.Timedelta(step)), 'm8[ns]')
+    return anchor_ns + offsets * step_ns, offsets
+
+
+# Position of the last tick at or before each time of each grid (-1 if there
+# is none), with the times and offsets of the grid. ts must be sorted.
+def asof_positions(ts, grids):
+    ts_ns = _ns(ts, 'M8[ns]')
+    times = [grid_times(*grid) for grid in grids]
+    pos = np.searchsorted(ts_ns, np.concatenate([t for t, k in times]),
+                          side='right') - 1
+    bounds = np.cumsum([0] + [len(k) for t, k in times])
+    return [(pos[bounds[i]:bounds[i + 1]],) + times[i]
+            for i in range(len(grids))]
+
+
+# Samples the columns of df, sorted on its ts column, on each of the grids.
+# Returns one dataframe per grid, with the step offsets in the Offset column
+# and the grid times in ts. Times before the first tick get missing values
+# (the columns are then float, as with pd.merge_asof).
+def sample_asof(df, grids, columns, ts='Timestamp'):
+    positions = asof_positions(df[ts], grids)
+    values = [(c, np.asarray(df[c])) for c in columns]
+    out = []
+    for pos, times, offsets in positions:
+        sampled = pd.DataFrame({'Offset': offsets})
+        sampled[ts] = times.view('M8[ns]')
+        missing = pos < 0
+        for c, v in values:
+            if missing.any():
+                col = np.full(len(pos), np.nan)
+                col[~missing] = v[pos[~missing]]
+            else:
+                col = v[pos]
+            sampled[c] = col
+        out.append(sampled)
+    return out
+
+
+# Position of the last tick at or before each query time (strictly before
+# with strict) in the same group, or -1 if there is none. Groups are integer
+# codes, and the ticks must be sorted by group then time. Times are replaced
+# by their rank among all tick and query times, so that (group, time) fits in
+# one int64 key, sorted as the ticks are, and all queries are located with a
+# single searchsorted.
+def grouped_asof(t_group, t_time, q_group, q_time, strict=False):
+    t_group = np.asarray(t_group, dtype=np.int64)
+    q_group = np.asarray(q_group, dtype=np.int64)
+    t_time = _ns(t_time, 'M8[ns]')
+    q_time = _ns(q_time, 'M8[ns]')
+    if len(t_time) == 0 or len(q_time) == 0:
+        return np.full(len(q_time), -1, dtype=np.int64)
+
+    rank = np.unique(np.concatenate([t_time, q_time]),
+                     return_inverse=True)[1].ravel()
+    width = rank.max() + 1
+    t_key = t_group * width + rank[:len(t_time)]
+    q_key = q_group * width + rank[len(t_time):]
+
+    pos = np.searchsorted(t_key, q_key,
+                          side='left' if strict else 'right') - 1
+    found = pos >= 0
+    found[found] = t_group[pos[found]] == q_group[found]
+    return np.where(found, pos, -1)
+
+
+# Samples the ticks of many events at once, each on its own grid. ticks holds
+# the ticks of all the events, sorted by event then ts, with the number of
+# the event (0 to n - 1) of each tick in event_col. Event i is sampled at
+# anchors[i] + k * step for k from first[i] to last[i] (first and last can
+# also be the same for all events). With a tolerance, ticks older than the
+# tolerance are not used, as with pd.merge_asof. Returns the offsets k of the
+# panel and the (event x offset x column) float array, with missing values
+# where there is no tick and outside the grid of each event. If fname is
+# given, the array is a memory-mapped .npy file.
+def sample_panel(ticks, anchors, step, first, last, columns, ts='Timestamp',
+                 event_col='Event', tolerance=None, fname=None):
+    anchor_ns = _ns(pd.to_datetime(list(anchors)), 'M8[ns]')
+    n = len(anchor_ns)
+    first = np.asarray(first, dtype=np.int64)
+    last = np.asarray(last, dtype=np.int64)
+    lo = first.min() if first.size > 0 else 0
+    hi = last.max() if last.size > 0 else -1
+    first = np.zeros(n, dtype=np.int64) + first
+    last = np.zeros(n, dtype=np.int64) + last
+    shape = (n, max(hi - lo + 1, 0), len(columns))
+    if fname is None:
+        panel = np.full(shape, np.nan)
+    else:
+        panel = np.lib.format.open_memmap(fname, mode='w+',
+                                          dtype=np.float64, shape=shape)
+        panel[:] = np.nan
+    if n == 0:
+        return np.arange(lo, hi + 1), panel
+
+    # Grid times of all events
+    counts = np.maximum(last - first + 1, 0)
+    q_event = np.repeat(np.arange(n), counts)
+    starts = np.cumsum(counts) - counts
+    k = (np.arange(counts.sum()) - np.repeat(starts, counts) +
+         np.repeat(first, counts))
+    step_ns = _ns(np.timedelta64(pd.Timedelta(step)), 'm8[ns]')
+    q_time = anchor_ns[q_event] + k * step_ns
+
+    t_time = _ns(ticks[ts], 'M8[ns]')
+    pos = grouped_asof(ticks[event_col], t_time, q_event,
+                       q_time.view('M8[ns]'))
+    found = pos >= 0
+    if tolerance is not None:
+        tol_ns = _ns(np.timedelta64(pd.Timedelta(tolerance)), 'm8[ns]')
+        found[found] = q_time[found] - t_time[pos[found]] <= tol_ns
+
+    for j, c in enumerate(columns):
+        v = np.asarray(ticks[c], dtype=np.float64)
+        panel[q_event[found], k[found] - lo, j] = v[pos[found]]
+    return np.arange(lo, hi + 1), panel
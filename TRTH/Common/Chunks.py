@@ -0,0 +1,76 @@
+"""
+Code for "How Is Earnings News Transmitted to Stock Prices?" by
+Vincent Grégoire and Charles Martineau.
+
+Python 2 and 3
+
+Chunk sizes set from a memory budget instead of a number of rows. Readers
+given chunksize='auto' read a small first chunk, measure its size in memory
+per row (strings included), and size the next chunk so that it takes about
+chunk_memory bytes once parsed. Each chunk is measured again, so the chunks
+follow the columns read and the content of the file (heavy days, long
+qualifier strings) rather than a fixed number of rows.
+
+The budget is per worker process: Scheduler.run_tasks sets it in its workers
+from the memory available to each of them.
+"""
+
+# Memory of one parsed chunk, in bytes, unless set by the scheduler.
+chunk_memory = 256 * 2 ** 20
+
+# A chunk is copied a few times while it is processed (filtering, parsing of
+# the times, conversions), so it gets this share of the memory of a worker.
+chunk_share = 0.25
+
+first_rows = 10000
+min_rows = 1000
+
+
+# Sets the chunk budget of this process from the memory of the worker.
+def set_worker_memory(memory):
+    global chunk_memory
+    if memory is not None:
+        chunk_memory = int(memory * chunk_share)
+
+
+def row_bytes(df):
+    if len(df) == 0:
+        return 0.0
+    return float(df.memory_usage(index=True, deep=True).sum()) / len(df)
+
+
+# Number of rows of a chunk of memory bytes (chunk_memory by default), with
+# rows like those of df.
+def chunk_rows(df, memory=None):
+    if memory is None:
+        memory = chunk_memory
+    size = row_bytes(df)
+    if size <= 0:
+        return first_rows
+    return max(min_rows, int(memory / size))
+
+
+# Iterates over the chunks of a pandas csv reader (pd.read_csv with
+# iterator=True), each sized from the previous one.
+def csv_chunks(reader, memory=None):
+    rows = first_rows
+    try:
+        while True:
+            try:
+                chunk = reader.get_chunk(rows)
+            except StopIteration:
+                return
+            rows = chunk_rows(chunk, memory)
+            yield chunk
+    finally:
+        reader.close()
+
+
+# Calls read (pd.read_csv or a function taking the same arguments). With
+# chunksize='auto', returns an iterator over chunks sized to the budget.
+def read_chunks(read, *args, **kwargs):
+    if kwargs.get('chunksize') != 'auto':
+        return read(*args, **kwargs)
+    del kwargs['chunksize']
+    kwargs['iterator'] = True
+    return csv_chunks(read(*args, **kwargs))
@@ -0,0 +1,300 @@
+"""
+Code for "How Is Earnings News Transmitted to Stock Prices?" by
+Vincent Grégoire and Charles Martineau.
+
+Python 2 and 3
+
+Compressed csv outputs. CSVSink compresses dataframes as they are written,
+instead of writing an uncompressed csv file and compressing it afterwards.
+The codec is chosen per output: gzip for archival files, or zstd and lz4
+(optional packages) for faster intermediate files. With several threads,
+gzip and lz4 outputs are compressed in independent blocks (concatenated gzip
+members or lz4 frames, which are valid files for any reader), and zstd uses
+its own multi-threaded compression.
+
+read_csv and find_csv read back the outputs whatever their codec.
+"""
+
+import os
+import gzip
+import zlib
+from multiprocessing.pool import ThreadPool
+
+import pandas as pd
+
+from Chunks import read_chunks
+from Metrics import phase, count, timed_iter
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+
+# Uncompressed bytes compressed at once (one block per thread).
+block_size = 4 * 1024 * 1024
+
+# Rows converted to text at once.
+rows_per_block = 100000
+
+
+class _GzipCodec(object):
+    ext = '.gz'
+    native_threads = False
+    default_level = 6
+
+    def stream(self, level, threads):
+        return zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def finish(self, stream):
+        return stream.flush()
+
+    def compress(self, data, level):
+        c = zlib.compressobj(level, zlib.DEFLATED, 31)
+        return c.compress(data) + c.flush()
+
+    def open(self, fname):
+        return gzip.open(fname, 'rb')
+
+
+class _ZstdCodec(object):
+    ext = '.zst'
+    native_threads = True
+    default_level = 3
+
+    def stream(self, level, threads):
+        cctx = zstandard.ZstdCompressor(level=level,
+                                        threads=threads if threads > 1 else 0)
+        return cctx.compressobj()
+
+    def finish(self, stream):
+        return stream.flush()
+
+    def compress(self, data, level):
+        return zstandard.ZstdCompressor(level=level).compress(data)
+
+    def open(self, fname):
+        f = fname if hasattr(fname, 'read') else open(fname, 'rb')
+        return zstandard.ZstdDecompressor().stream_reader(
+            f, read_across_frames=True)
+
+
+class _LZ4Stream(object):
+
+    def __init__(self, level):
+        self.c = lz4_frame.LZ4FrameCompressor(compression_level=level)
+        self.started = False
+
+    def compress(self, data):
+        if not self.started:
+            self.started = True
+            return self.c.begin() + self.c.compress(data)
+        return self.c.compress(data)
+
+    def flush(self):
+        if not self.started:
+            return self.c.begin() + self.c.flush()
+        return self.c.flush()
+
+
+class _LZ4Codec(object):
+    ext = '.lz4'
+    native_threads = False
+    default_level = 0
+
+    def stream(self, level, threads):
+        return _LZ4Stream(level)
+
+    def finish(self, stream):
+        return stream.flush()
+
+    def compress(self, data, level):
+        return lz4_frame.compress(data, compression_level=level)
+
+    def open(self, fname):
+        return lz4_frame.open(fname, 'rb')
+
+
+# The open method of each codec takes a file name or a binary file object.
+codecs = {'gzip': _GzipCodec(), 'zstd': _ZstdCodec(), 'lz4': _LZ4Codec()}
+
+
+def get_codec(codec):
+    if codec not in codecs:
+        raise ValueError('Unknown codec: ' + str(codec))
+    if codec == 'zstd' and zstandard is None:
+        raise ImportError('The zstandard package is required for zstd outputs.')
+    if codec == 'lz4' and lz4_frame is None:
+        raise ImportError('The lz4 package is required for lz4 outputs.')
+    return codecs[codec]
+
+
+# Writes dataframes to a compressed csv file. fname is the name of the csv
+# file; the codec extension is added to it. The file is created when the
+# first dataframe is written, with the header.
+class CSVSink(object):
+
+    def __init__(self, fname, codec='gzip', threads=1, level=None):
+        self.codec = get_codec(codec)
+        self.fname = fname + self.codec.ext
+        self.level = self.codec.default_level if level is None else level
+        self.threads = threads
+        self.pool = None
+        if threads > 1 and not self.codec.native_threads:
+            self.pool = ThreadPool(threads)
+
+        self.f = None
+        self.header = True
+        self.stream = None
+        self.buf = []
+        self.buf_size = 0
+        self.pending = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def append(self, df, index=False):
+        if self.f is None:
+            self.f = open(self.fname, 'wb')
+        for start in range(0, max(len(df), 1), rows_per_block):
+            part = df.iloc[start:start + rows_per_block]
+            with phase('format_csv', part):
+                s = part.to_csv(None, header=self.header, index=index)
+                if not isinstance(s, bytes):
+                    s = s.encode('utf-8')
+            self.header = False
+            self.buf.append(s)
+            self.buf_size += len(s)
+            if self.buf_size >= block_size:
+                self._flush_buffer()
+
+    def _flush_buffer(self):
+        if self.buf_size == 0:
+            return
+        data = b''.join(self.buf)
+        self.buf = []
+        self.buf_size = 0
+        if self.pool is None:
+            if self.stream is None:
+                self.stream = self.codec.stream(self.level, self.threads)
+            self._write(self.stream.compress, data)
+        else:
+            self.pending.append(data)
+            if len(self.pending) >= self.threads:
+                self._compress_pending()
+
+    def _compress_pending(self):
+        level = self.level
+        codec = self.codec
+        with phase('compress'):
+            blocks = self.pool.map(lambda data: codec.compress(data, level),
+                                   self.pending)
+            for block in blocks:
+                self.f.write(block)
+                count('output_bytes', len(block))
+        self.pending = []
+
+    # Writes compress(arg), timed as the compress phase.
+    def _write(self, compress, arg):
+        with phase('compress'):
+            block = compress(arg)
+            self.f.write(block)
+        count('output_bytes', len(block))
+
+    # Compresses everything written so far, so that the file ends at the end
+    # of a complete gzip member or zstd/lz4 frame.
+    def _end_member(self):
+        self._flush_buffer()
+        if self.pending:
+            self._compress_pending()
+        if self.stream is not None:
+            self._write(self.codec.finish, self.stream)
+            self.stream = None
+
+    # Position to roll back to if what is written next must be discarded.
+    def mark(self):
+        if self.f is None:
+            return (None, self.header)
+        self._end_member()
+        self.f.flush()
+        return (self.f.tell(), self.header)
+
+    def rollback(self, mark):
+        self.buf = []
+        self.buf_size = 0
+        self.pending = []
+        self.stream = None
+        self.header = mark[1]
+        if mark[0] is None:
+            if self.f is not None:
+                self.f.close()
+                self.f = None
+                os.remove(self.fname)
+        else:
+            self.f.seek(mark[0])
+            self.f.truncate()
+
+    def close(self):
+        if self.f is not None and not self.f.closed:
+            self._end_member()
+            self.f.close()
+        if self.pool is not None:
+            self.pool.close()
+            self.pool = None
+
+
+# Writes one dataframe to a compressed csv file.
+def write_csv(df, fname, codec='gzip', threads=1, index=False):
+    with CSVSink(fname, codec, threads) as sink:
+        sink.append(df, index=index)
+
+
+# Returns the name of the codec of a compressed file, from its extension.
+def file_codec(fname):
+    for codec in ['gzip', 'zstd', 'lz4']:
+        if fname.endswith(codecs[codec].ext):
+            return codec
+    return None
+
+
+# Returns the compressed file for the csv file fname (whatever the codec),
+# or None if there is none.
+def find_csv(fname):
+    for codec in ['gzip', 'zstd', 'lz4']:
+        fn = fname + codecs[codec].ext
+        if os.path.isfile(fn):
+            return fn
+    return None
+
+
+# Reads a compressed csv file, given the name of the csv file (whatever the
+# codec) or of the compressed file. Extra arguments are passed to pd.read_csv,
+# and chunksize='auto' sizes the chunks to the memory budget (see Chunks.py).
+def read_csv(fname, **kwargs):
+    if kwargs.get('chunksize') == 'auto':
+        return timed_iter(read_chunks(read_csv, fname, **kwargs), 'parse_csv')
+    fn = fname if os.path.isfile(fname) else find_csv(fname)
+    if fn is None:
+        raise IOError('Missing file: ' + fname)
+    count('input_bytes', os.path.getsize(fn))
+    if fn.endswith(codecs['gzip'].ext):
+        return pd.read_csv(fn, **kwargs)
+    for name in ['zstd', 'lz4']:
+        if fn.endswith(codecs[name].ext):
+            f = get_codec(name).open(fn)
+            if kwargs.get('chunksize') or kwargs.get('iterator'):
+                # The file is closed when the reader is garbage collected.
+                return pd.read_csv(f, compression=None, **kwargs)
+            try:
+                return pd.read_csv(f, compression=None, **kwargs)
+            finally:
+                f.close()
+    return pd.read_csv(fn, **kwargs)
@@ -0,0 +1,65 @@
+"""
+Code for "How Is Earnings News Transmitted to Stock Prices?" by
+Vincent Grégoire and Charles Martineau.
+
+Python 2 and 3
+
+Day-major extraction of ticks around events. Instead of reading the daily
+files of each event window separately for every event, the event table is
+inverted into a plan mapping each exchange-day to the RICs needed on that
+day and the events of each RIC. Each daily file is then read once, and its
+rows are routed to every event whose window includes that day. Events are
+written as soon as their last day is read, so only the events in progress
+are kept in memory.
+"""
+
+import pandas as pd
+
+
+# Inverts the event table. events is a list of (permno, date1, date2, ric,
+# exch) tuples and windows(dates1, dates2) gives the first and last days of
+# the windows of all the events at once (see TradingCalendar.event_windows).
+# Returns the sorted list of ((date, exch), {ric: [event ids]}) and the list
+# of the last (date, exch) of each event.
+def plan_events(events, windows):
+    plan = {}
+    last = []
+    starts, ends = windows([e[1] for e in events], [e[2] for e in events])
+    for i, (permno, date1, date2, ric, exch) in enumerate(events):
+        dates = list(pd.date_range(starts[i], ends[i]))
+        for date in dates:
+            rics = plan.setdefault((date, exch), {})
+            rics.setdefault(ric, []).append(i)
+        last.append((dates[-1], exch) if dates else None)
+    return sorted(plan.items(), key=lambda x: x[0]), last
+
+
+# Appends the rows of each RIC of the chunk to the list of dataframes of its
+# events. Events get an empty dataframe when their RIC is not in the chunk.
+def route_chunk(chunk, rics, dfs):
+    groups = chunk.groupby('#RIC', sort=False).indices
+    for ric, ids in rics.items():
+        pos = groups.get(ric)
+        part = chunk.iloc[pos] if pos is not None else chunk.iloc[:0]
+        for i in ids:
+            dfs[i].append(part)
+
+
+# Processes all events. read_day(exch, date, rics) returns an iterator over
+# the chunks of the daily file restricted to the RICs (or None if there is no
+# file), and write_event(event, dfs) writes the output of one event from the
+# list of its dataframes, in date order.
+def process_batch(events, windows, read_day, write_event):
+    plan, last = plan_events(events, windows)
+    done = {}
+    for i, key in enumerate(last):
+        done.setdefault(key, []).append(i)
+
+    dfs = dict((i, []) for i in range(len(events)))
+    for (date, exch), rics in plan:
+        chunks = read_day(exch, date, list(rics))
+        if chunks is not None:
+            for chunk in chunks:
+                route_chunk(chunk, rics, dfs)
+        for i in done.get((date, exch), []):
+            write_event(events[i], dfs.pop(i))
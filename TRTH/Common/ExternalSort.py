@@ -0,0 +1,302 @@
+"""
+Code for "How Is Earnings News Transmitted to Stock Prices?" by
+Vincent Grégoire and Charles Martineau.
+
+Python 2 and 3
+
+External sort of tick files by RIC, time and sequence number, within a
+memory budget. Rows are added by chunk and kept in memory until they take
+more than the budget; they are then sorted and spilled to a temporary file
+as one sorted run, in blocks. The sorted rows are produced by merging the
+runs block by block: at each step, the rows of all the runs before the
+smallest of the last keys of the blocks in memory (of the runs with blocks
+left to read) are sorted and returned, and the run of that key reads its
+next block. Only about one block per run is held at a time, so when there
+are more than merge_fanin runs, groups of merge_fanin consecutive runs are
+first merged into longer runs, until there are at most merge_fanin runs
+left. When everything fits in the budget, nothing is written to disk.
+
+Rows are ordered by RIC (rows without RIC last), Timestamp (from the
+Timestamp column, or the Date and Time columns) and Seq. No. (when there is
+one), and rows with the same key keep the order in which they were added.
+Without by_time, rows are only ordered by RIC, in the order they were added
+(as TickFiles.sort_by_ric does), for files without parsed times.
+
+The rows added after mark() can be discarded with rollback(mark), as with
+the other sinks, for the raw files found corrupted after some of their rows
+were added.
+"""
+
+import os
+import pickle
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+import Chunks
+from TickFiles import tick_timestamps
+from Metrics import phase, count
+
+
+# Sort key columns added to the rows while they are sorted, and the number
+# of each row in the order they were added
+_key_cols = ['_ric', '_ts', '_seq', '_row']
+
+# Sorts after all RICs, for the rows without RIC.
+_last_ric = u'\uffff'
+
+# Runs are spilled in blocks of this share of the budget, and at most this
+# many runs are merged at once, so that the merge holds one block of each
+# run within the budget.
+merge_fanin = 16
+
+
+# Adds the key columns to df, whose first row is the row number start of the
+# rows added.
+def _add_keys(df, start, by_time):
+    df = df.copy()
+    df['_ric'] = df['#RIC'].astype(object).where(df['#RIC'].notnull(),
+                                                 _last_ric)
+    row = np.arange(start, start + len(df), dtype=np.int64)
+    if not by_time:
+        df['_ts'] = row
+    else:
+        if 'Timestamp' in df.columns:
+            ts = df['Timestamp']
+        else:
+            ts = tick_timestamps(df)
+        df['_ts'] = np.asarray(ts, dtype='M8[ns]').view(np.int64)
+    if by_time and 'Seq. No.' in df.columns:
+        df['_seq'] = df['Seq. No.'].fillna(-1).astype(np.int64)
+    else:
+        df['_seq'] = 0
+    df['_row'] = row
+    return df
+
+
+def _sort(df):
+    codes = pd.factorize(df['_ric'], sort=True)[0]
+    # lexsort is stable: rows with the same key keep their order.
+    order = np.lexsort((df['_seq'].values, df['_ts'].values, codes))
+    return df.iloc[order]
+
+
+# Number of rows of the sorted df before key (ric, ts, seq).
+def _before(df, key):
+    ric, ts, seq = key
+    r = df['_ric'].values
+    t = df['_ts'].values
+    s = df['_seq'].values
+    return int(((r < ric) |
+                ((r == ric) & ((t < ts) | ((t == ts) & (s < seq))))).sum())
+
+
+def _last_key(df):
+    row = df.iloc[-1]
+    return (row['_ric'], row['_ts'], row['_seq'])
+
+
+def _read_blocks(fn):
+    with open(fn, 'rb') as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                return
+
+
+class ExternalSorter(object):
+
+    # memory is the budget in bytes (the chunk budget of the worker by
+    # default, see Chunks.py) and tmp_dir the directory of the runs (the
+    # system temporary directory by default). Without by_time, rows are
+    # only sorted by RIC.
+    def __init__(self, memory=None, tmp_dir=None, by_time=True):
+        self.memory = memory or Chunks.chunk_memory
+        self.tmp_dir = tmp_dir
+        self.by_time = by_time
+        self.dfs = []
+        self.size = 0
+        # Rows added, and the (first, last + 1) row numbers discarded
+        self.rows = 0
+        self.discarded = []
+        # Temporary files of the runs, and their number of blocks
+        self.runs = []
+        self.run_blocks = []
+        self.readers = []
+        # Run file being written
+        self.partial = None
+        # Empty frame with the columns of the rows
+        self.empty = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def add(self, df):
+        if self.empty is None:
+            self.empty = df.iloc[:0]
+        if len(df) == 0:
+            return
+        df = _add_keys(df, self.rows, self.by_time)
+        self.rows += len(df)
+        self.dfs.append(df)
+        self.size += df.memory_usage(index=True, deep=True).sum()
+        if self.size > self.memory:
+            self._spill()
+
+    # Position to roll back to if the rows added next must be discarded.
+    def mark(self):
+        return self.rows
+
+    # The rows in memory are dropped now, and the rows already spilled as
+    # they are merged.
+    def rollback(self, mark):
+        if mark >= self.rows:
+            return
+        self.discarded.append((mark, self.rows))
+        self.dfs = [df[df['_row'].values < mark] for df in self.dfs]
+        self.size = sum(df.memory_usage(index=True, deep=True).sum()
+                        for df in self.dfs)
+
+    def _kept(self, df):
+        if not self.discarded:
+            return df
+        row = df['_row'].values
+        keep = np.ones(len(df), dtype=bool)
+        for first, end in self.discarded:
+            keep &= (row < first) | (row >= end)
+        return df if keep.all() else df[keep]
+
+    def _buffer(self):
+        df = pd.concat(self.dfs) if self.dfs else None
+        self.dfs = []
+        self.size = 0
+        return df
+
+    # Writes the rows in memory as a sorted run.
+    def _spill(self):
+        df = self._buffer()
+        if df is None or len(df) == 0:
+            return
+        with phase('sort_run', df):
+            df = _sort(df)
+        fn, blocks = self._write_run([df])
+        self.runs.append(fn)
+        self.run_blocks.append(blocks)
+
+    # Writes the sorted dataframes dfs (the rows of one run, in order) to a
+    # new run file, in blocks. Returns the file and its number of blocks.
+    def _write_run(self, dfs):
+        fd, fn = tempfile.mkstemp(suffix='.run', dir=self.tmp_dir)
+        blocks = 0
+        # The file is removed by close() if the run is not finished.
+        self.partial = fn
+        with os.fdopen(fd, 'wb') as f:
+            for df in dfs:
+                with phase('spill', df):
+                    rows = Chunks.chunk_rows(df, self.memory // merge_fanin)
+                    for start in range(0, len(df), rows):
+                        pickle.dump(df.iloc[start:start + rows], f,
+                                    pickle.HIGHEST_PROTOCOL)
+                        blocks += 1
+        self.partial = None
+        count('spilled_bytes', os.path.getsize(fn))
+        return fn, blocks
+
+    # Merges groups of merge_fanin consecutive runs into one run, until
+    # there are at most merge_fanin runs. Runs stay in the order they were
+    # added, so rows with the same key keep their order.
+    def _merge_runs(self):
+        while len(self.runs) > merge_fanin:
+            old_runs, old_blocks = self.runs, self.run_blocks
+            runs = []
+            run_blocks = []
+            for start in range(0, len(old_runs), merge_fanin):
+                end = start + merge_fanin
+                if len(old_runs[start:end]) > 1:
+                    fn, n = self._write_run(self._merge(old_runs[start:end],
+                                                        old_blocks[start:end]))
+                    self._close_readers()
+                    for old_fn in old_runs[start:end]:
+                        os.remove(old_fn)
+                    runs.append(fn)
+                    run_blocks.append(n)
+                else:
+                    runs.append(old_runs[start])
+                    run_blocks.append(old_blocks[start])
+                # Files on disk, for close()
+                self.runs = runs + old_runs[end:]
+                self.run_blocks = run_blocks + old_blocks[end:]
+
+    # Iterates over the rows added, sorted, by chunk (one empty chunk if no
+    # rows were added).
+    def sorted_chunks(self):
+        if not self.runs:
+            df = self._buffer()
+            if df is None:
+                yield (self.empty if self.empty is not None
+                       else pd.DataFrame())
+                return
+            with phase('sort_run', df):
+                df = _sort(df)
+            yield df.drop(_key_cols, axis=1)
+            return
+
+        self._spill()
+        self._merge_runs()
+        for df in self._merge(self.runs, self.run_blocks):
+            df = self._kept(df)
+            if len(df) > 0:
+                yield df.drop(_key_cols, axis=1)
+
+    # Merges the runs (files and numbers of blocks), by sorted chunk with
+    # the key columns.
+    def _merge(self, runs, run_blocks):
+        readers = [_read_blocks(fn) for fn in runs]
+        self.readers.extend(readers)
+        blocks = [next(r) for r in readers]
+        left = [n - 1 for n in run_blocks]
+        while blocks:
+            # Rows with the same key as the bound are kept until the bound
+            # is past them, so the rows of all the runs with the same key
+            # are sorted together.
+            bounds = [(_last_key(b), i) for i, b in enumerate(blocks)
+                      if left[i] > 0]
+            parts = []
+            with phase('merge') as p:
+                if bounds:
+                    bound, k = min(bounds)
+                    for i, b in enumerate(blocks):
+                        n = _before(b, bound)
+                        parts.append(b.iloc[:n])
+                        blocks[i] = b.iloc[n:]
+                    blocks[k] = pd.concat([blocks[k], next(readers[k])])
+                    left[k] -= 1
+                else:
+                    # All the blocks are read.
+                    parts = blocks
+                    blocks = []
+                # Runs are concatenated in the order they were added.
+                df = _sort(pd.concat(parts))
+                p.done(df)
+            if len(df) > 0:
+                yield df
+
+    def _close_readers(self):
+        for reader in self.readers:
+            reader.close()
+        self.readers = []
+
+    def close(self):
+        self.dfs = []
+        self._close_readers()
+        for fn in self.runs + [self.partial]:
+            if fn is not None and os.path.isfile(fn):
+                os.remove(fn)
+        self.partial = None
+        self.runs = []
+        self.run_blocks = []
@@ -0,0 +1,99 @@
+"""
+Code for "How Is Earnings News Transmitted to Stock Prices?" by
+Vincent Grégoire and Charles Martineau.
+
+Python 2 and 3
+
+Counts of values in bins (left-closed, as pd.cut with right=False) for
+several fields, kept per key (for instance RIC, date and sample). Counts are
+added chunk by chunk and event by event with np.digitize and np.bincount, so
+the rows are not kept, and the counts of several workers can be merged. The
+final table has the share of the observations in each bin and the number of
+observations per key.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+class Histograms(object):
+
+    # bins is the list of (field, bin edges).
+    def __init__(self, bins):
+        self.bins = [(field, np.asarray(edges, dtype=np.float64))
+                     for field, edges in bins]
+        self.keys = {}
+        self.order = []
+        self.counts = [np.zeros((0, len(edges) - 1), dtype=np.int64)
+                       for field, edges in self.bins]
+        self.totals = np.zeros(0, dtype=np.int64)
+
+    def _rows(self, keys):
+        rows = np.empty(len(keys), dtype=np.int64)
+        for i, key in enumerate(keys):
+            row = self.keys.get(key)
+            if row is None:
+                row = len(self.order)
+                self.keys[key] = row
+                self.order.append(key)
+            rows[i] = row
+        n = len(self.order)
+        if n > len(self.totals):
+            grow = n - len(self.totals)
+            self.counts = [np.vstack([c, np.zeros((grow, c.shape[1]),
+                                                  dtype=np.int64)])
+                           for c in self.counts]
+            self.totals = np.concatenate([self.totals,
+                                          np.zeros(grow, dtype=np.int64)])
+        return rows
+
+    # Adds the rows of df under key, a tuple. With by, the rows are also
+    # split on the values of that column, which extend the key.
+    def add(self, df, key=(), by=None):
+        if len(df) == 0:
+            return
+        if by is None:
+            codes = np.zeros(len(df), dtype=np.int64)
+            keys = [tuple(key)]
+        else:
+            codes, uniques = pd.factorize(df[by], sort=True)
+            keys = [tuple(key) + (u,) for u in uniques]
+        rows = self._rows(keys)[codes]
+        n = len(self.order)
+        self.totals += np.bincount(rows, minlength=n)
+        for j, (field, edges) in enumerate(self.bins):
+            nbins = len(edges) - 1
+            b = np.digitize(np.asarray(df[field], dtype=np.float64),
+                            edges) - 1
+            # Values outside the bins (and missing values) are not counted
+            ok = (b >= 0) & (b < nbins)
+            self.counts[j] += np.bincount(rows[ok] * nbins + b[ok],
+                                          minlength=n * nbins
+                                          ).reshape(n, nbins)
+
+    # Adds the counts of other, with the same bins.
+    def merge(self, other):
+        rows = self._rows(other.order)
+        for j in range(len(self.counts)):
+            np.add.at(self.counts[j], rows, other.counts[j])
+        np.add.at(self.totals, rows, other.totals)
+        return self
+
+    # Share of the observations of each key in each bin, in the columns
+    # field + ' ' + bin (named as pd.cut names them), and the number of
+    # observations in count_col. names are the names of the key levels. Keys
+    # without a counted value for one of the fields are left out.
+    def table(self, names, count_col='Count'):
+        index = pd.MultiIndex.from_tuples(self.order, names=names)
+        out = pd.DataFrame(index=index)
+        keep = np.ones(len(self.order), dtype=bool)
+        for (field, edges), counts in zip(self.bins, self.counts):
+            total = counts.sum(axis=1)
+            keep &= total > 0
+            shares = counts / np.maximum(total, 1)[:, None].astype(np.float64)
+            for k in range(len(edges) - 1):
+                label = str(pd.Interval(edges[k], edges[k + 1],
+                                        closed='left'))
+                out[field + ' ' + label] = shares[:, k]
+        out[count_col] = self.totals
+        return out[keep]
@@ -0,0 +1,400 @@
+"""
+Code for "How Is Earnings News Transmitted to Stock Prices?" by
+Vincent Grégoire and Charles Martineau.
+
+Python 2 and 3
+
+Opt-in instrumentation of the processing stages. When the TRTH_METRICS
+environment variable names a log file (enable(fn) sets it, so the workers
+started afterwards inherit it), each task writes one JSON record to the file
+when it ends:
+
+    {"stage": "ClassifyTrades.process_classify", "task": "NAQ 2012-01-03",
+     "pid": 1234, "start": 1325600000.0, "wall": 12.1, "cpu": 11.8,
+     "ok": true, "start_rss": 310000000, "peak_rss": 812000000,
+     "counters": {"compressed_bytes": 52000000, ...},
+     "phases": {"trade_times": {"calls": 3, "wall": 2.1, "cpu": 2.0,
+                                "self_wall": 2.1, "self_cpu": 2.0,
+                                "rows_in": 2500000, "rows_out": 2500000},
+                ...}}
+
+Tasks run by Scheduler.run_tasks are recorded, and the processing functions
+mark their phases (reading, parsing of the times, qualifiers, writing...).
+Phases nest: wall and cpu include the phases inside, self_wall and self_cpu
+do not. A task started inside another one (a day of a monthly task) writes
+its own record, and its phases are not counted in the outer one. Each record
+is appended in one write, so the workers of a run can share the log file.
+Bench/SummarizeMetrics.py ranks the phases and tasks of a log.
+
+start_rss is the memory of the process when the task starts and peak_rss the
+peak memory of the process during the task. The peak is reset at the start
+of each task on Linux (/proc/self/clear_refs), or sampled every
+sample_interval seconds with psutil. Without either, the record has
+worker_peak_rss instead: the peak of the worker since it started, which
+includes the tasks it ran before.
+
+When the log is not enabled, tasks and phases do nothing.
+"""
+
+import os
+import sys
+import json
+import time
+import functools
+import threading
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+env_var = 'TRTH_METRICS'
+
+# Seconds between samples of the memory of a task, when it is sampled.
+sample_interval = 0.2
+
+# Task in progress in this process, if the log is enabled.
+_task = None
+
+
+def enable(fname):
+    os.environ[env_var] = os.path.abspath(fname)
+
+
+def disable():
+    os.environ.pop(env_var, None)
+
+
+def log_file():
+    return os.environ.get(env_var) or None
+
+
+def _cpu():
+    t = os.times()
+    return t[0] + t[1]
+
+
+# Peak memory of this process in bytes, or None if it cannot be measured.
+def peak_rss():
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Bytes on macOS, kilobytes elsewhere
+        return peak if sys.platform == 'darwin' else peak * 1024
+    if psutil is not None:
+        info = psutil.Process().memory_info()
+        return getattr(info, 'peak_wset', info.rss)
+    return None
+
+
+# Name of the stage of a function: its module file and name. Wrappers with
+# a func attribute (functools.partial, the pipeline tasks) are named after
+# the function they call.
+def stage_name(func):
+    while hasattr(func, 'func'):
+        func = func.func
+    module = sys.modules.get(func.__module__)
+    fn = getattr(module, '__file__', None)
+    name = (os.path.splitext(os.path.basename(fn))[0] if fn
+            else func.__module__)
+    return name + '.' + func.__name__
+
+
+# Field of /proc/self/status in bytes, or None if it cannot be read.
+def _proc_status(field):
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError, ValueError):
+        pass
+    return None
+
+
+# Memory of this process in bytes, or None if it cannot be measured.
+def current_rss():
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    return _proc_status('VmRSS')
+
+
+# Resets the peak memory of this process (Linux only). Returns whether it
+# was reset.
+def _reset_peak():
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except (IOError, OSError):
+        return False
+    return _proc_status('VmHWM') is not None
+
+
+# Peak memory of a task from samples taken on a thread, with psutil.
+class _Sampler(object):
+
+    def __init__(self):
+        self.peak = current_rss()
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _run(self):
+        while not self.stop.wait(sample_interval):
+            self.peak = max(self.peak, current_rss())
+
+    def close(self):
+        self.stop.set()
+        self.thread.join()
+        return max(self.peak, current_rss())
+
+
+def _rows(rows):
+    if rows is None:
+        return None
+    if hasattr(rows, '__len__'):
+        return len(rows)
+    return int(rows)
+
+
+class _Null(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        return False
+
+    def done(self, rows):
+        pass
+
+    def failed(self):
+        pass
+
+
+_null = _Null()
+
+
+class _Task(object):
+
+    def __init__(self, stage, name, fname):
+        self.stage = stage
+        self.name = name
+        self.fname = fname
+        self.phases = {}
+        self.counters = {}
+        self.stack = []
+        self.ok = True
+        # Peak memory before and during the nested tasks, which reset the
+        # peak.
+        self.child_peak = None
+
+    def __enter__(self):
+        global _task
+        self.parent = _task
+        _task = self
+        self.start_rss = current_rss()
+        self.sampler = None
+        if self.parent is not None and self.parent.peak_reset:
+            # The peak of the outer task so far, before it is reset.
+            self.parent.child_peak = max(self.parent.child_peak or 0,
+                                         _proc_status('VmHWM'))
+        self.peak_reset = _reset_peak()
+        if not self.peak_reset and psutil is not None:
+            self.sampler = _Sampler()
+        self.start = time.time()
+        self.cpu = _cpu()
+        return self
+
+    # Memory fields of the record.
+    def _memory(self):
+        if self.peak_reset:
+            peak = max(_proc_status('VmHWM'), self.child_peak or 0)
+        elif self.sampler is not None:
+            peak = self.sampler.close()
+        else:
+            return {'start_rss': self.start_rss,
+                    'worker_peak_rss': peak_rss()}
+        if self.parent is not None:
+            self.parent.child_peak = max(self.parent.child_peak or 0, peak)
+        return {'start_rss': self.start_rss, 'peak_rss': peak}
+
+    def __exit__(self, exc_type, exc_value, tb):
+        global _task
+        _task = self.parent
+        record = {'stage': self.stage, 'task': self.name,
+                  'pid': os.getpid(), 'start': self.start,
+                  'wall': time.time() - self.start,
+                  'cpu': _cpu() - self.cpu,
+                  'ok': self.ok and exc_type is None}
+        record.update(self._memory())
+        record.update({'counters': self.counters, 'phases': self.phases})
+        if self.parent is not None:
+            record['parent'] = self.parent.name
+            # The outer phases in progress do not count this task.
+            for p in self.parent.stack:
+                p.child_wall += record['wall']
+                p.child_cpu += record['cpu']
+        with open(self.fname, 'a') as f:
+            f.write(json.dumps(record, default=str) + '\n')
+        return False
+
+    def done(self, rows):
+        pass
+
+    def failed(self):
+        self.ok = False
+
+
+class _Phase(object):
+
+    def __init__(self, task, name, rows):
+        self.task = task
+        self.name = name
+        self.rows_in = _rows(rows)
+        self.rows_out = None
+        self.child_wall = 0.0
+        self.child_cpu = 0.0
+
+    def __enter__(self):
+        self.task.stack.append(self)
+        self.start = time.time()
+        self.cpu = _cpu()
+        return self
+
+    # Rows (a number or anything with a length) output by the phase.
+    def done(self, rows):
+        self.rows_out = _rows(rows)
+
+    def __exit__(self, exc_type, exc_value, tb):
+        wall = time.time() - self.start
+        cpu = _cpu() - self.cpu
+        self.task.stack.pop()
+        if self.task.stack:
+            self.task.stack[-1].child_wall += wall
+            self.task.stack[-1].child_cpu += cpu
+        stats = self.task.phases.setdefault(
+            self.name, {'calls': 0, 'wall': 0.0, 'cpu': 0.0,
+                        'self_wall': 0.0, 'self_cpu': 0.0,
+                        'rows_in': 0, 'rows_out': 0})
+        stats['calls'] += 1
+        stats['wall'] += wall
+        stats['cpu'] += cpu
+        stats['self_wall'] += wall - self.child_wall
+        stats['self_cpu'] += cpu - self.child_cpu
+        stats['rows_in'] += self.rows_in or 0
+        stats['rows_out'] += (self.rows_out if self.rows_out is not None
+                              else self.rows_in or 0)
+        return False
+
+
+# Context manager recording a task named name of stage (see stage_name) to
+# the log, if it is enabled. Its failed() method marks the task as failed
+# (it is also marked as failed if an exception leaves it).
+def task(stage, name):
+    fname = log_file()
+    if fname is None:
+        return _null
+    return _Task(stage, name, fname)
+
+
+# Decorator recording each call of a function as a task (see task), for the
+# functions that are not run by the scheduler (the resampling of a list of
+# events). The task is named by the number of items of the first argument.
+def recorded(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        name = ('%d items' % len(args[0])
+                if args and hasattr(args[0], '__len__') else '')
+        with task(stage_name(func), name):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+# Context manager timing the phase name of the task in progress, with rows
+# input rows (a number or anything with a length). Its done(rows) method
+# sets the rows output (the rows input by default).
+def phase(name, rows=None):
+    if _task is None:
+        return _null
+    return _Phase(_task, name, rows)
+
+
+# Adds n to the counter name of the task in progress.
+def count(name, n):
+    if _task is not None:
+        _task.counters[name] = _task.counters.get(name, 0) + int(n)
+
+
+# Iterates over iterable, timing the production of each item (not the
+# processing of the items) as the phase name, with the rows of the items as
+# output rows.
+def timed_iter(iterable, name):
+    if _task is None:
+        for item in iterable:
+            yield item
+        return
+    it = iter(iterable)
+    while True:
+        with phase(name) as p:
+            try:
+                item = next(it)
+            except StopIteration:
+                return
+            p.done(item)
+        yield item
+
+
+# Binary file object over stream that times its reads as the phase name and
+# counts the bytes read in the counter bytes_name.
+class TimedStream(object):
+
+    def __init__(self, stream, name, bytes_name):
+        self.stream = stream
+        self.name = name
+        self.bytes_name = bytes_name
+
+    def read(self, size=-1):
+        with phase(self.name):
+            data = self.stream.read(size)
+        count(self.bytes_name, len(data))
+        return data
+
+    def read1(self, size=-1):
+        with phase(self.name):
+            data = self.stream.read1(size)
+        count(self.bytes_name, len(data))
+        return data
+
+    def readline(self, size=-1):
+        with phase(self.name):
+            data = self.stream.readline(size)
+        count(self.bytes_name, len(data))
+        return data
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        line = self.readline()
+        if not line:
+            raise StopIteration
+        return line
+
+    next = __next__
+
+    def close(self):
+        self.stream.close()
+
+    def __getattr__(self, name):
+        value = getattr(self.stream, name)
+        if name == 'mode' and isinstance(value, int):
+            # Readers expect the mode of GzipFile objects as a string.
+            return 'rb'
+        return value
@@ -0,0 +1,223 @@
+"""
+Code for "How Is Earnings News Transmitted to Stock Prices?" by
+Vincent Grégoire and Charles Martineau.
+
+Python 2 and 3
+
+Incremental runner for the processing stages. A stage is a task grid (see
+Scheduler.py) with, for each task, the files it reads and the files it
+writes. The stages are run in dependency order, and a task is only run again
+if the content of its input files or the code of its stage changed since its
+last run, or if one of its outputs was changed or removed. Since the inputs
+are listed per file, reprocessing one day also reruns the tasks of other days
+that read it (such as AlignDates for the day before).
+
+Each task is recorded in a state file as soon as it finishes, so a run that
+is interrupted resumes with the tasks that were not done. The content hashes
+of the files are kept in a manifest (see RawFiles.py), so each file is only
+hashed once after it is written. Raw files use the hash of their .md5sum file.
+"""
+
+import os
+import re
+import json
+import hashlib
+
+from RawFiles import Manifest, read_md5sum, block_size
+from TickFiles import find_ticks, index_ext
+from Scheduler import run_tasks, task_name
+
+
+# One stage of the pipeline. grid() returns the (args, size) tasks of the
+# stage, func(*args) runs a task, and files(*args) returns the lists of the
+# input and output file names of a task, as the scripts write them. code is
+# the list of source files of the stage.
+class Stage(object):
+
+    def __init__(self, name, func, grid, files, code):
+        self.name = name
+        self.func = func
+        self.grid = grid
+        self.files = files
+        self.code = code
+
+
+_common_dir = os.path.dirname(os.path.abspath(__file__))
+_import_re = re.compile(r'^\s*(?:from\s+(\w+)\s+import|import\s+(\w+))', re.M)
+
+
+# Source file of a script module and of the modules of this directory that
+# it uses, directly or not, except the modules that only run the tasks.
+def code_files(module):
+    fname = os.path.abspath(module.__file__)
+    if fname.endswith('.pyc'):
+        fname = fname[:-1]
+    files = [fname]
+    i = 0
+    while i < len(files):
+        with open(files[i], 'r') as f:
+            src = f.read()
+        for m in _import_re.finditer(src):
+            name = m.group(1) or m.group(2)
+            dep = os.path.join(_common_dir, name + '.py')
+            if (name not in ['Scheduler', 'Pipeline'] and
+                    os.path.isfile(dep) and dep not in files):
+                files.append(dep)
+        i += 1
+    return files
+
+
+def file_md5(fname):
+    h = hashlib.md5()
+    with open(fname, 'rb') as f:
+        while True:
+            data = f.read(block_size)
+            if not data:
+                break
+            h.update(data)
+    return h.hexdigest()
+
+
+# Files found on disk for a file name as written by the scripts: the file
+# itself, or its compressed or parquet version and its RIC index.
+def resolve(fname):
+    found = fname if os.path.isfile(fname) else find_ticks(fname)
+    if found is None:
+        return []
+    files = [found]
+    if os.path.isfile(found + index_ext):
+        files.append(found + index_ext)
+    return files
+
+
+def content_md5(fname, manifest):
+    if os.path.isfile(fname + '.md5sum'):
+        return read_md5sum(fname)
+    md5 = manifest.md5(fname)
+    if md5 is None:
+        md5 = file_md5(fname)
+        manifest.add(fname, md5)
+    return md5
+
+
+def code_md5(files):
+    h = hashlib.md5()
+    for fname in sorted(files):
+        h.update(file_md5(fname).encode('ascii'))
+    return h.hexdigest()
+
+
+# Hash of the code of the stage and of the content of the inputs of a task.
+# Missing inputs are part of the hash, so the task runs again if they appear.
+def signature(code, inputs, manifest):
+    h = hashlib.md5(code.encode('ascii'))
+    for fname in inputs:
+        files = resolve(fname)
+        if not files:
+            h.update(('missing:' + fname + '\n').encode('utf-8'))
+        for f in files:
+            h.update((f + ':' + content_md5(f, manifest) + '\n')
+                     .encode('utf-8'))
+    return h.hexdigest()
+
+
+# Tasks done, stored as one json line per task. The last line of a task wins.
+class State(object):
+
+    def __init__(self, fname):
+        self.fname = fname
+        self.tasks = {}
+        # A line cut by a crash is skipped, and the next line is started
+        # after it.
+        self.cut = False
+        if os.path.isfile(fname):
+            with open(fname, 'r') as f:
+                for line in f:
+                    self.cut = not line.endswith('\n')
+                    try:
+                        rec = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.tasks[(rec['stage'], rec['task'])] = rec
+
+    def get(self, stage, task):
+        return self.tasks.get((stage, task))
+
+    def add(self, stage, task, sig, outputs):
+        rec = {'stage': stage, 'task': task, 'signature': sig,
+               'outputs': outputs}
+        self.tasks[(stage, task)] = rec
+        with open(self.fname, 'a') as f:
+            if self.cut:
+                f.write('\n')
+                self.cut = False
+            f.write(json.dumps(rec) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+
+# Outputs are current if the same files are found on disk, with the content
+# they had after the task.
+def _outputs_current(recorded, outputs, manifest):
+    found = [f for fname in outputs for f in resolve(fname)]
+    return (sorted(found) == sorted(recorded) and
+            all(manifest.md5(f) == md5 for f, md5 in recorded.items()))
+
+
+# Runs a task in the worker and hashes its outputs. Returns the dict of the
+# output files and their hash.
+class _StageTask(object):
+
+    def __init__(self, func, files, manifest_fn):
+        self.func = func
+        self.files = files
+        self.manifest_fn = manifest_fn
+
+    def __call__(self, args, sig):
+        self.func(*args)
+        manifest = Manifest(self.manifest_fn)
+        outputs = {}
+        for fname in self.files(*args)[1]:
+            for f in resolve(fname):
+                outputs[f] = content_md5(f, manifest)
+        return outputs
+
+
+# Runs the stages in order, only running the tasks that are not current.
+# state_fn is the file of the tasks done and manifest_fn the manifest of the
+# file hashes. The tasks of the stages named in force are all run. Other
+# arguments are passed to run_tasks. Returns the
+# (stage name, args, traceback) of the tasks that failed.
+def run_pipeline(stages, state_fn, manifest_fn, force=(), **kwargs):
+    state = State(state_fn)
+    failed = []
+    for stage in stages:
+        manifest = Manifest(manifest_fn)
+        code = code_md5(stage.code)
+
+        tasks = stage.grid()
+        todo = []
+        for args, size in tasks:
+            inputs, outputs = stage.files(*args)
+            sig = signature(code, inputs, manifest)
+            rec = state.get(stage.name, task_name(args))
+            if (stage.name not in force and rec is not None and
+                    rec['signature'] == sig and
+                    _outputs_current(rec['outputs'], outputs, manifest)):
+                continue
+            todo.append(((args, sig), size))
+
+        print('%s: %d of %d tasks to run' % (stage.name, len(todo),
+                                            len(tasks)))
+
+        def on_done(task, outputs, stage=stage):
+            state.add(stage.name, task_name(task[0]), task[1], outputs)
+
+        def describe(task, stage=stage):
+            return stage.name + ' ' + task_name(task[0])
+
+        func = _StageTask(stage.func, stage.files, manifest_fn)
+        done, stage_failed = run_tasks(func, todo, on_done=on_done,
+                                       describe=describe, **kwargs)
+        failed.extend((stage.name, task[0], tb) for task, tb in stage_failed)
+    return failed
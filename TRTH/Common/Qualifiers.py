@@ -0,0 +1,151 @@
+"""
+Code for "How Is Earnings News Transmitted to Stock Prices?" by
+Vincent Grégoire and Charles Martineau.
+
+Python 2 and 3
+
+Table-driven decoding of TRTH trade and quote qualifiers. Each distinct
+qualifier string is tokenized once and turned into a packed integer bitmask
+holding all the flags. Decoded strings are cached for the life of the process,
+so the (small and stable) set of qualifier strings is only decoded once per
+worker across chunks and days.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+# Sale condition codes found in the '[LSTSALCOND]' and '..._TEXT]' qualifiers.
+# Each character of the code is one condition.
+trade_condition_codes = [('FormT', 'T'),
+                         ('Opening', 'O'),
+                         ('Closing', '6'),
+                         ('Cross', 'X'),
+                         ('Sweep', 'F'),
+                         ('NextDay', 'N'),
+                         ('Bunched', 'B'),
+                         ('PriorRefPrice', 'P'),
+                         # Extended trading hours (Sold Out of Sequence)
+                         ('ExtendedHoursSOoS', 'U'),
+                         ('DerivativelyPriced', '4'),
+                         ('AverageTradePrice', 'W'),
+                         ('CashSale', 'C'),
+                         ('SoldOutOfSequence', 'Z')]
+
+# Qualifiers that set a flag when they match exactly.
+trade_exact_tokens = {'ODT[IRGCOND]': 'OddLot',
+                      'ODD[IRGCOND]': 'OddLot',
+                      'O [CTS_QUAL]': 'Opening'}
+
+# Price qualifier codes found in '[PRC_QL_CD]' and '[PRC_QL3]' qualifiers.
+quote_condition_codes = [('Regular', 'R'),
+                         ('Opening', 'OQ'),
+                         ('Closing', 'CQ'),
+                         ('NoQuote', 'NQ')]
+
+
+class QualifierDecoder(object):
+    """Decodes qualifier strings into bitmasks, one bit per flag.
+
+    `flags` is the ordered list of flag labels (bit i is flags[i]).
+    `suffixes` is a list of (suffix, cut, strip) tuples: a token ending with
+    the suffix carries a code made of the token minus its last `cut`
+    characters (stripped if `strip`).
+    `code_bits` maps codes to bitmasks, and `per_char` tells whether each
+    character of the code is matched separately (sale conditions) or the
+    whole code is matched (price qualifiers).
+    `exact_bits` maps full tokens to bitmasks.
+    """
+
+    def __init__(self, flags, suffixes, code_bits, per_char, exact_bits,
+                 max_cache=1000000):
+        self.flags = list(flags)
+        self.suffixes = suffixes
+        self.code_bits = code_bits
+        self.per_char = per_char
+        self.exact_bits = exact_bits
+        self.max_cache = max_cache
+        self.cache = {'': 0}
+
+    def bit(self, label):
+        return 1 << self.flags.index(label)
+
+    def decode(self, x):
+        bits = self.cache.get(x)
+        if bits is not None:
+            return bits
+
+        bits = 0
+        for c in x.split(';'):
+            c = c.strip()
+            for suffix, cut, strip in self.suffixes:
+                if c.endswith(suffix):
+                    code = c[:-cut]
+                    if strip:
+                        code = code.strip()
+                    if self.per_char:
+                        for ch in code:
+                            bits |= self.code_bits.get(ch, 0)
+                    else:
+                        bits |= self.code_bits.get(code, 0)
+                    break
+            else:
+                bits |= self.exact_bits.get(c, 0)
+
+        if len(self.cache) >= self.max_cache:
+            self.cache = {'': 0}
+        self.cache[x] = bits
+        return bits
+
+    # Returns the bitmask of every row in the series. Only the distinct
+    # strings go through Python, and those already seen are cache hits.
+    # Missing qualifiers decode as ''.
+    def decode_series(self, s):
+        codes, uniques = pd.factorize(s)
+        masks = np.empty(len(uniques) + 1, dtype=np.int64)
+        for i, x in enumerate(uniques):
+            masks[i] = self.decode(x)
+        # Missing values are coded as -1, which picks the last entry.
+        masks[-1] = 0
+        return masks[codes]
+
+    # Adds one 0/1 column per flag to the dataframe.
+    def unpack(self, bits, df):
+        for i, label in enumerate(self.flags):
+            df[label] = (bits >> i) & 1
+        return df
+
+    # Packs the 0/1 flag columns of the dataframe back into bitmasks.
+    # Missing flag columns are read as zeros.
+    def pack(self, df):
+        bits = np.zeros(len(df), dtype=np.int64)
+        for i, label in enumerate(self.flags):
+            if label in df.columns:
+                flag = np.asarray(df[label].fillna(0), dtype=np.int64)
+                bits |= (flag != 0).astype(np.int64) << i
+        return bits
+
+
+def _make_trade_decoder():
+    flags = [x[0] for x in trade_condition_codes] + ['OddLot']
+    code_bits = {}
+    for label, ch in trade_condition_codes:
+        code_bits[ch] = code_bits.get(ch, 0) | (1 << flags.index(label))
+    exact_bits = dict((tok, 1 << flags.index(label))
+                      for tok, label in trade_exact_tokens.items())
+    # Order matters: '_TEXT]' tokens are checked first, as in '[GV3_TEXT]'.
+    suffixes = [('_TEXT]', 10, False), ('[LSTSALCOND]', 12, False)]
+    return QualifierDecoder(flags, suffixes, code_bits, True, exact_bits)
+
+
+def _make_quote_decoder():
+    flags = [x[0] for x in quote_condition_codes]
+    code_bits = dict((code, 1 << flags.index(label))
+                     for label, code in quote_condition_codes)
+    suffixes = [('[PRC_QL_CD]', 11, True), ('[PRC_QL3]', 9, True)]
+    return QualifierDecoder(flags, suffixes, code_bits, False, {})
+
+
+# Process-wide decoders (and caches).
+trade_qualifiers = _make_trade_decoder()
+quote_qualifiers = _make_quote_decoder()
@@ -0,0 +1,113 @@
+"""
+Code for "How Is Earnings News Transmitted to Stock Prices?" by
+Vincent Grégoire and Charles Martineau.
+
+Python 2 and 3
+
+Run-length compaction of quote files. Most NBBO updates in the after-hours
+market repeat the previous book state (same prices, sizes and qualifiers)
+with a new timestamp. The quotes of each RIC are sorted by time (ties in
+file order), and each run of consecutive updates with the same values in
+all the columns other than the times is kept as its first update, with the
+number of updates of the run in Count and the time of its last update in
+LastTimestamp.
+
+The last update at or before (or strictly before) any time is the first
+update of the run it belongs to with the same values, so as-of sampling of
+the quotes of one RIC gives the same results on compacted files. Runs do not
+cross days, nor the 4:00 and 20:00 bounds of the extended trading hours
+outside of which the readers drop the quotes, and quotes without timestamp
+are kept as they are. Compacting files that are already compacted adds the
+counts of the runs merged together.
+"""
+
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+from TickFiles import tick_timestamps
+from TimeParsing import (quote_times, quote_timestamps, floor_day,
+                         time_of_day, to_datetime64, NAT)
+
+
+session_start = timedelta(hours=4)
+session_end = timedelta(hours=20)
+
+count_col = 'Count'
+last_col = 'LastTimestamp'
+
+# Time columns of the raw quote files and of the classified quote files,
+# which are not part of the book state.
+raw_time_cols = ['Date[G]', 'Time[G]', 'GMT Offset', 'Quote Time']
+event_time_cols = ['Date', 'Time', 'Timestamp']
+
+
+# Codes of the day and trading period (before 4:00, extended trading hours,
+# after 20:00) of each timestamp, in ns.
+def _periods(ts):
+    tod = time_of_day(ts)
+    period = ((tod > pd.Timedelta(session_start).value).astype(np.int64) +
+              (tod > pd.Timedelta(session_end).value))
+    return floor_day(ts) + period
+
+
+# Compacts the quotes of df, given their timestamps ts (int64 ns, NAT when
+# missing). time_cols are the columns that are not compared. The rows are
+# returned grouped by RIC (in order of appearance) and sorted by time.
+def compact_quotes(df, ts, time_cols):
+    ts = np.asarray(ts, dtype=np.int64)
+    if count_col in df.columns:
+        # Rows from files that were not compacted count for one quote.
+        counts = np.asarray(df[count_col].fillna(1), dtype=np.int64)
+        last = np.asarray(pd.to_datetime(df[last_col]),
+                          dtype='M8[ns]').view(np.int64)
+        last = np.where(last == NAT, ts, last)
+    else:
+        counts = np.ones(len(df), dtype=np.int64)
+        last = ts
+    groups = pd.factorize(df['#RIC'])[0]
+    order = np.lexsort((ts, groups))
+    df = df.iloc[order]
+    ts = ts[order]
+    groups = groups[order]
+
+    new = np.ones(len(df), dtype=bool)
+    if len(df) > 1:
+        same = ((groups[1:] == groups[:-1]) & (ts[1:] != NAT) &
+                (ts[:-1] != NAT))
+        periods = _periods(ts)
+        same &= periods[1:] == periods[:-1]
+        skip = set(time_cols) | set([count_col, last_col])
+        for c in df.columns:
+            if c not in skip:
+                # Missing values are equal to each other.
+                codes = pd.factorize(df[c])[0]
+                same &= codes[1:] == codes[:-1]
+        new[1:] = ~same
+
+    runs = np.cumsum(new) - 1
+    ends = np.flatnonzero(np.append(new[1:], len(df) > 0))
+    out = df[new].copy()
+    out[count_col] = np.bincount(runs, weights=counts[order]).astype(np.int64)
+    out[last_col] = to_datetime64(last[order][ends])
+    return out
+
+
+# Compacts the quotes of a raw quote file (as written by ExtractQuotes.py).
+def compact_raw_quotes(df):
+    time_g, date_g, quote_time = quote_times(df['Quote Time'], df['Time[G]'],
+                                             df['Date[G]'], df['GMT Offset'])
+    return compact_quotes(df, quote_timestamps(date_g, quote_time),
+                          raw_time_cols)
+
+
+# Compacts classified quotes (as written by ExtractQuotesAroundEarnings.py),
+# with a Timestamp column or Date and Time columns.
+def compact_event_quotes(df):
+    if 'Timestamp' in df.columns:
+        ts = df['Timestamp']
+    else:
+        ts = tick_timestamps(df)
+    ts = np.asarray(ts, dtype='M8[ns]').view(np.int64)
+    return compact_quotes(df, ts, event_time_cols)
@@ -0,0 +1,219 @@
+"""
+Code for "How Is Earnings News Transmitted to Stock Prices?" by
+Vincent Grégoire and Charles Martineau.
+
+Python 2 and 3
+
+Reading of the raw TRTH files with checksum verification. The md5 hash of a
+raw file is computed on the compressed bytes as they are fed to the
+decompressor and the CSV parser, so each file is read from disk only once.
+Files that pass verification are recorded in a manifest with their size and
+modification time, and are not hashed again on later runs.
+
+When only some RICs are needed, the decompressed lines of other RICs can be
+dropped before they reach the csv parser.
+"""
+
+import os
+import gzip
+import hashlib
+import zlib
+import pandas as pd
+
+from Chunks import read_chunks
+from Metrics import TimedStream, timed_iter, count
+
+
+block_size = 1024 * 1024
+
+
+class ChecksumError(Exception):
+    pass
+
+
+# Reads the expected hash from the .md5sum file next to the raw file.
+def read_md5sum(fname):
+    with open(fname + '.md5sum', 'r') as f_cs:
+        return f_cs.readline()[:32]
+
+
+def _file_key(fname):
+    st = os.stat(fname)
+    return os.path.abspath(fname), str(st.st_size), '%.6f' % st.st_mtime
+
+
+# Persistent list of verified raw files, stored as a csv file with columns
+# path, size, mtime and md5. Lines are only ever appended, so several workers
+# can share the same manifest.
+class Manifest(object):
+
+    def __init__(self, fname):
+        self.fname = fname
+        self.files = {}
+        if os.path.isfile(fname):
+            with open(fname, 'r') as f:
+                for line in f:
+                    fields = line.rstrip('\n').rsplit(',', 3)
+                    if len(fields) == 4:
+                        self.files[fields[0]] = tuple(fields[1:])
+
+    def is_verified(self, fname):
+        path, size, mtime = _file_key(fname)
+        entry = self.files.get(path)
+        return entry is not None and entry[:2] == (size, mtime)
+
+    # Recorded md5 of the file, or None if the file is missing or changed
+    # since it was recorded.
+    def md5(self, fname):
+        try:
+            path, size, mtime = _file_key(fname)
+        except OSError:
+            return None
+        entry = self.files.get(path)
+        if entry is None or entry[:2] != (size, mtime):
+            return None
+        return entry[2]
+
+    def add(self, fname, md5):
+        path, size, mtime = _file_key(fname)
+        self.files[path] = (size, mtime, md5)
+        with open(self.fname, 'a') as f:
+            f.write(','.join([path, size, mtime, md5]) + '\n')
+
+
+# File object over a raw file that hashes the bytes as they are read.
+# Bytes are hashed once and in order, even if the reader seeks back.
+class HashingReader(object):
+
+    def __init__(self, fname, hash_md5):
+        self.raw = open(fname, 'rb')
+        self.hash_md5 = hash_md5
+        self.hashed = 0
+
+    def _hash_to(self, pos):
+        if pos > self.hashed:
+            cur = self.raw.tell()
+            self.raw.seek(self.hashed)
+            while self.hashed < pos:
+                data = self.raw.read(min(block_size, pos - self.hashed))
+                if not data:
+                    break
+                self.hash_md5.update(data)
+                self.hashed += len(data)
+            self.raw.seek(cur)
+
+    def read(self, size=-1):
+        pos = self.raw.tell()
+        data = self.raw.read(size)
+        if self.hash_md5 is not None:
+            self._hash_to(pos)
+            end = pos + len(data)
+            if end > self.hashed:
+                self.hash_md5.update(data[self.hashed - pos:])
+                self.hashed = end
+        return data
+
+    def seek(self, offset, whence=0):
+        return self.raw.seek(offset, whence)
+
+    def tell(self):
+        return self.raw.tell()
+
+    # Hashes the rest of the file, in case the reader stopped before the end.
+    def finish(self):
+        if self.hash_md5 is not None:
+            self._hash_to(os.fstat(self.raw.fileno()).st_size)
+            return self.hash_md5.hexdigest()
+
+    def close(self):
+        self.raw.close()
+
+
+# Decompressed stream that only lets through the header line and the lines
+# whose first field (the RIC) is in rics, so the other lines are never parsed.
+# Lines starting with a quote are let through, to be filtered after parsing.
+class RICLineFilter(object):
+
+    def __init__(self, stream, rics):
+        self.stream = stream
+        self.rics = set(r if isinstance(r, bytes) else r.encode('utf-8')
+                        for r in rics)
+        self.header = True
+        self.rest = b''
+        self.out = b''
+        self.eof = False
+
+    def _fill(self, size):
+        rics = self.rics
+        while (size < 0 or len(self.out) < size) and not self.eof:
+            data = self.stream.read(block_size)
+            if data:
+                lines = (self.rest + data).split(b'\n')
+                self.rest = lines.pop()
+            else:
+                self.eof = True
+                lines = [self.rest] if self.rest else []
+            if self.header and lines:
+                self.out += lines.pop(0) + b'\n'
+                self.header = False
+            keep = [l for l in lines
+                    if l[:l.find(b',')] in rics or l[:1] == b'"']
+            if keep:
+                self.out += b'\n'.join(keep) + b'\n'
+
+    def read(self, size=-1):
+        if size is None:
+            size = -1
+        self._fill(size)
+        if size < 0:
+            data, self.out = self.out, b''
+        else:
+            data, self.out = self.out[:size], self.out[size:]
+        return data
+
+
+# Reads a raw gzip-compressed csv file by chunk while verifying its checksum
+# (unless it is in the manifest). If rics is given, lines of other RICs are
+# dropped before parsing (see RICLineFilter); callers should still filter on
+# the RIC. Extra arguments are passed to pd.read_csv, and chunksize='auto'
+# sizes the chunks to the memory budget (see Chunks.py).
+# ChecksumError is raised once the file is read if the checksum does not
+# match, or as soon as a corrupted file cannot be decompressed or parsed.
+# Callers should discard what they produced from the file in that case (see
+# CSVSink.mark and CSVSink.rollback).
+def read_verified_csv(fname, manifest=None, rics=None, **kwargs):
+    md5_check = read_md5sum(fname)
+    verified = manifest is not None and manifest.is_verified(fname)
+
+    reader = HashingReader(fname, None if verified else hashlib.md5())
+    try:
+        try:
+            # Decompression, filtering and parsing are timed separately
+            # when the metrics log is enabled (see Metrics.py).
+            stream = TimedStream(gzip.GzipFile(fileobj=reader, mode='rb'),
+                                 'decompress', 'decompressed_bytes')
+            if rics is not None:
+                stream = TimedStream(RICLineFilter(stream, rics),
+                                     'filter_rics', 'filtered_bytes')
+            for chunk in timed_iter(read_chunks(pd.read_csv, stream,
+                                                compression=None, **kwargs),
+                                    'parse_csv'):
+                yield chunk
+            error = None
+        except (IOError, EOFError, ValueError, zlib.error) as e:
+            # Includes decompression and parsing errors.
+            if verified:
+                raise
+            error = e
+
+        if not verified:
+            md5_f = reader.finish()
+            if md5_f != md5_check:
+                raise ChecksumError('Wrong checksum for ' + fname)
+            if error is not None:
+                raise error
+            if manifest is not None:
+                manifest.add(fname, md5_f)
+    finally:
+        count('compressed_bytes', reader.tell())
+        reader.close()
@@ -0,0 +1,344 @@
+"""
+Code for "How Is Earnings News Transmitted to Stock Prices?" by
+Vincent Grégoire and Charles Martineau.
+
+Python 2 and 3
+
+Runs the task grid of a processing stage on a pool of worker processes.
+The grids are built from the input directories: one task per exchange and
+month of raw TAS files, per exchange and day of daily files, or per event.
+Each task is sized by its input files, and tasks are started largest first
+so that the long days do not straggle at the end of the run. A task is only
+started if the estimated memory of the tasks in progress stays within a
+budget. Failed tasks are retried at the end of the run, and the progress is
+reported as tasks finish. A task whose worker dies (killed when out of
+memory, or crashed) or whose result cannot be sent back is failed and
+retried like the others, instead of being waited for.
+"""
+
+import os
+import sys
+import time
+import traceback
+import multiprocessing as mp
+import multiprocessing.queues
+from datetime import datetime, timedelta
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+from TickFiles import find_ticks, index_ext
+from Chunks import set_worker_memory
+from Metrics import task, stage_name
+
+
+# Parsed dataframes take roughly this multiple of the size of the compressed
+# files they are read from.
+expansion = 10
+
+# Share of the physical memory used by the tasks in progress when no budget
+# is given (requires psutil, otherwise there is no budget).
+memory_fraction = 0.75
+
+# Queue written without a feeder thread, so what a worker puts in it is sent
+# even if the worker dies right after.
+SimpleQueue = getattr(mp, 'SimpleQueue', None) or mp.queues.SimpleQueue
+
+
+def _dirs(path):
+    if not os.path.isdir(path):
+        return []
+    return sorted(x for x in os.listdir(path)
+                  if os.path.isdir(os.path.join(path, x)))
+
+
+# One (exch, y, m) task per monthly directory of raw TAS files
+# (raw_dir/exch/TAS/yyyy/mm), sized by the daily files of the month.
+def month_tasks(raw_dir, exchanges=None, years=None, expansion=expansion):
+    tasks = []
+    for exch in exchanges or _dirs(raw_dir):
+        tas_dir = os.path.join(raw_dir, exch, 'TAS')
+        for y in _dirs(tas_dir):
+            if not y.isdigit() or (years is not None and int(y) not in years):
+                continue
+            for m in _dirs(os.path.join(tas_dir, y)):
+                if not m.isdigit():
+                    continue
+                mdir = os.path.join(tas_dir, y, m)
+                size = sum(os.path.getsize(os.path.join(mdir, fn))
+                           for fn in os.listdir(mdir)
+                           if fn[15:23] == 'TAS-Data' and fn.endswith('.gz'))
+                if size > 0:
+                    tasks.append(((exch, int(y), int(m)), size * expansion))
+    return tasks
+
+
+# One (exch, date) task per daily file (indir/exch/yyyy/exch-kind-date.*),
+# whatever its format and compression, sized by the file.
+def day_tasks(indir, kind, exchanges=None, years=None, expansion=expansion):
+    tasks = []
+    for exch in exchanges or _dirs(indir):
+        prefix = exch + '-' + kind + '-'
+        for y in _dirs(os.path.join(indir, exch)):
+            if not y.isdigit() or (years is not None and int(y) not in years):
+                continue
+            ydir = os.path.join(indir, exch, y)
+            sizes = {}
+            for fn in os.listdir(ydir):
+                rest = fn[len(prefix) + 10:]
+                if (not fn.startswith(prefix) or not rest.startswith('.') or
+                        fn.endswith(index_ext)):
+                    continue
+                try:
+                    date = datetime.strptime(fn[len(prefix):len(prefix) + 10],
+                                             '%Y-%m-%d')
+                except ValueError:
+                    continue
+                sizes[date] = (sizes.get(date, 0) +
+                               os.path.getsize(os.path.join(ydir, fn)))
+            for date in sorted(sizes):
+                tasks.append(((exch, date), sizes[date] * expansion))
+    return tasks
+
+
+# One task per event. If fn is given, fn(*event) is the input file of the
+# event, which sizes the task (events without a file are skipped), otherwise
+# all events have the same size. With packed, the event is passed as a single
+# tuple argument, as in ExtractQuotesAroundEarnings.process_task.
+def event_tasks(events, fn=None, packed=False, expansion=expansion):
+    tasks = []
+    for event in events:
+        event = tuple(event)
+        size = 1
+        if fn is not None:
+            found = find_ticks(fn(*event))
+            if found is None:
+                continue
+            size = os.path.getsize(found) * expansion
+        tasks.append(((event,) if packed else event, size))
+    return tasks
+
+
+def default_memory():
+    if psutil is None:
+        return None
+    return int(psutil.virtual_memory().total * memory_fraction)
+
+
+def task_name(args):
+    return ' '.join(task_name(x) if isinstance(x, tuple)
+                    else x.strftime('%Y-%m-%d') if hasattr(x, 'strftime')
+                    else str(x) for x in args)
+
+
+def _format_duration(seconds):
+    return str(timedelta(seconds=int(seconds)))
+
+
+# Queue of the (task id, process id) of the tasks started in the workers,
+# set in each worker of the pool.
+_started = None
+
+
+def _init_worker(worker_memory, started):
+    global _started
+    _started = started
+    set_worker_memory(worker_memory)
+
+
+# Runs in the worker: exceptions are returned with their traceback, so the
+# scheduler can retry the task. The task is recorded in the metrics log, if
+# it is enabled (see Metrics.py), under the given name. The start of task
+# tid is reported, so the scheduler knows which tasks a dead worker held.
+def _call(func, args, name, tid=None):
+    if _started is not None:
+        _started.put((tid, os.getpid()))
+    with task(stage_name(func), name) as t:
+        try:
+            return True, func(*args)
+        except Exception:
+            t.failed()
+            return False, traceback.format_exc()
+
+
+# Index of the largest pending task that fits in the memory left. If no task
+# is running, the largest task is started even if it does not fit.
+def _next_task(pending, room, alone):
+    for k, (args, size, attempt) in enumerate(pending):
+        if room is None or size <= room:
+            return k
+    return 0 if alone else None
+
+
+class Progress(object):
+
+    def __init__(self, count, total, out=sys.stderr, describe=task_name):
+        self.count = count
+        self.total = total
+        self.describe = describe
+        self.done = 0
+        self.done_size = 0
+        self.start = time.time()
+        self.out = out
+
+    def write(self, msg):
+        self.out.write(msg + '\n')
+        self.out.flush()
+
+    def finished(self, args, size, seconds, status='done'):
+        self.done += 1
+        self.done_size += size
+        elapsed = time.time() - self.start
+        share = (float(self.done_size) / self.total if self.total > 0
+                 else float(self.done) / max(self.count, 1))
+        left = elapsed / share - elapsed if share > 0 else 0
+        self.write('[%d/%d] %s %s in %.1fs, %.1f%% of the work, '
+                   '%s elapsed, %s left' %
+                   (self.done, self.count, self.describe(args), status,
+                    seconds,
+                    100 * share, _format_duration(elapsed),
+                    _format_duration(left)))
+
+
+# Runs func(*args) for each (args, size) task on a pool of processes (or in
+# this process if processes is 1). memory is the budget of the sum of the
+# sizes of the tasks in progress (see default_memory), and a task that fails
+# is run again up to retries times. Workers are replaced after
+# maxtasksperchild tasks, to give back the memory they hold. on_done(args,
+# result) is called in this process as each task succeeds, and describe(args)
+# names the tasks in the progress reports. Returns the list of (args, result)
+# of the tasks done and the list of (args, traceback) of the tasks that
+# failed. worker_memory is the memory of each worker (by default, its share
+# of memory), which sets the size of the chunks read with chunksize='auto'
+# (see Chunks.py).
+def run_tasks(func, tasks, processes=None, memory=None, retries=2,
+              maxtasksperchild=None, out=sys.stderr, on_done=None,
+              describe=task_name, worker_memory=None):
+    tasks = list(tasks)
+    processes = processes or mp.cpu_count()
+    if memory is None:
+        memory = default_memory()
+    if worker_memory is None and memory is not None:
+        worker_memory = memory // processes
+
+    # Largest first, in grid order for tasks of the same size.
+    order = sorted(range(len(tasks)), key=lambda i: -tasks[i][1])
+    pending = [(tasks[i][0], tasks[i][1], 0) for i in order]
+    progress = Progress(len(tasks), sum(x[1] for x in tasks), out, describe)
+
+    done = queue.Queue()
+    pool = None
+    started = None
+    if processes > 1:
+        started = SimpleQueue()
+        pool = mp.Pool(processes, initializer=_init_worker,
+                       initargs=(worker_memory, started),
+                       maxtasksperchild=maxtasksperchild)
+    else:
+        set_worker_memory(worker_memory)
+
+    def submit(tid, args):
+        if pool is None:
+            done.put((tid, _call(func, args, describe(args))))
+            return
+        kwargs = {}
+        if sys.version_info[0] >= 3:
+            # Errors raised outside of func, such as a result that cannot
+            # be pickled.
+            kwargs['error_callback'] = lambda e: done.put(
+                (tid, (False, ''.join(traceback.format_exception_only(
+                    type(e), e)))))
+        pool.apply_async(_call, (func, args, describe(args), tid),
+                         callback=lambda r: done.put((tid, r)), **kwargs)
+
+    # Process of each task started. A task is lost if its process is no
+    # longer a live worker of the pool and it is still not done one poll
+    # later (its result may be on its way when the worker exits).
+    task_pids = {}
+    gone = set()
+    lost_any = []
+
+    def lost_tasks():
+        while not started.empty():
+            k, pid = started.get()
+            task_pids[k] = pid
+        lost = [k for k in gone if k in running]
+        alive = set(p.pid for p in list(pool._pool) if p.exitcode is None)
+        gone.clear()
+        gone.update(k for k, pid in task_pids.items() if pid not in alive)
+        lost_any.extend(lost)
+        return lost
+
+    results = []
+    failed = []
+    running = {}
+    used = 0
+    tid = 0
+    try:
+        while pending or running:
+            while pending and len(running) < processes:
+                k = _next_task(pending, None if memory is None
+                               else memory - used, not running)
+                if k is None:
+                    break
+                args, size, attempt = pending.pop(k)
+                running[tid] = (args, size, attempt, time.time())
+                used += size
+                submit(tid, args)
+                tid += 1
+
+            k = None
+            while k is None:
+                try:
+                    k, (ok, value) = done.get(timeout=1)
+                except queue.Empty:
+                    if pool is not None:
+                        for k in lost_tasks():
+                            done.put((k, (False, 'Worker of the task exited '
+                                          'before it was done (killed or '
+                                          'crashed).\n')))
+                        k = None
+                    continue
+                # Results of lost tasks that arrive late are skipped.
+                if k not in running:
+                    k = None
+            task_pids.pop(k, None)
+            args, size, attempt, start = running.pop(k)
+            used -= size
+
+            if ok:
+                results.append((args, value))
+                if on_done is not None:
+                    on_done(args, value)
+                progress.finished(args, size, time.time() - start)
+            elif attempt < retries:
+                progress.write('Retrying ' + describe(args) + ':\n' +
+                               value.rstrip())
+                pending.append((args, size, attempt + 1))
+            else:
+                progress.write('Failed ' + describe(args) + ':\n' +
+                               value.rstrip())
+                failed.append((args, value))
+                progress.finished(args, size, time.time() - start, 'failed')
+        if pool is not None:
+            # The pool still waits for the lost tasks, so it is stopped.
+            if lost_any:
+                pool.terminate()
+            else:
+                pool.close()
+    except BaseException:
+        if pool is not None:
+            pool.terminate()
+        raise
+    finally:
+        if pool is not None:
+            pool.join()
+
+    return results, failed
@@ -0,0 +1,622 @@
+"""
+Code for "How Is Earnings News Transmitted to Stock Prices?" by
+Vincent Grégoire and Charles Martineau.
+
+Python 2 and 3
+
+Columnar (parquet) storage of the parsed trade and quote files (TradesParsed,
+TradesFinal, Quotes and the AroundEvent files), as an alternative to the
+compressed csv files. Parquet files hold typed columns: the Date and Time
+columns are stored as one int64 Timestamp, RIC and venue codes are
+dictionary-encoded, qualifier flags are packed into one QualBits integer and
+the raw TRTH date and time columns are stored parsed. The pyarrow package is
+only required for parquet files.
+
+read_ticks reads a file in either format and returns only the requested
+columns, so readers do not depend on the format chosen by the stage that
+wrote the file. For csv files, a requested Timestamp is computed from the
+Date and Time columns.
+
+Daily files can also be written sorted by RIC, with a sidecar index giving
+the location of each RIC in the file: the byte range of its own compressed
+block in csv files, or its row range in parquet files (whose row groups hold
+whole RICs). Reading the ticks of one RIC is then a seek and a bounded read
+instead of a scan of the whole file.
+"""
+
+import os
+import io
+
+import numpy as np
+import pandas as pd
+
+from CompressedCSV import CSVSink, find_csv, read_csv, file_codec, get_codec
+from Chunks import chunk_rows, first_rows
+from Metrics import phase, count, timed_iter
+from TimeParsing import parse_date_ns, parse_time_ns, NAT
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+
+parquet_ext = '.parquet'
+
+# Extension of the RIC index, added to the name of the data file
+index_ext = '.idx'
+
+# Target number of rows per row group in RIC-sorted parquet files. Row groups
+# hold whole RICs, so RICs with more rows have their own larger row group.
+group_rows = 100000
+
+# Columns stored dictionary-encoded
+dictionary_cols = ['#RIC', 'Ex/Cntrb.ID', 'Buyer ID', 'Seller ID',
+                   'Qualifiers']
+
+# Raw TRTH date and time columns, stored parsed
+raw_date_cols = ['Date[G]', 'Trd/Qte Date']
+raw_time_cols = ['Time[G]', 'Exch Time', 'Quote Time']
+
+# Schema metadata key listing the flags packed in QualBits (bit i is the
+# i-th flag).
+_flags_key = b'qualifier_flags'
+
+
+def _require_pyarrow():
+    if pq is None:
+        raise ImportError('The pyarrow package is required for parquet files.')
+
+
+# Timestamps of the rows, from the Date and Time columns (parsed, or as
+# written in csv files).
+def tick_timestamps(df):
+    date = df['Date']
+    if date.dtype.kind != 'M':
+        date = pd.to_datetime(date, format='%Y-%m-%d')
+    time = df['Time']
+    if time.dtype.kind != 'm':
+        if pd.api.types.infer_dtype(time, skipna=True) == 'time':
+            time = time.astype(str).where(time.notnull())
+        time = pd.to_timedelta(time)
+    return (date + time).astype('datetime64[ns]')
+
+
+def _ns_array(ns, arrow_type):
+    ns = np.asarray(ns, dtype=np.int64)
+    return pa.array(ns, type=pa.int64(), mask=(ns == NAT)).cast(arrow_type)
+
+
+def _string_array(s):
+    if s.dtype.kind != 'O':
+        s = s.astype(str).where(s.notnull(), None)
+    return pa.array(s, type=pa.string(), from_pandas=True)
+
+
+def _column_array(name, s):
+    if name == 'Timestamp' or s.dtype.kind == 'M':
+        return _ns_array(np.asarray(s, dtype='M8[ns]').view(np.int64),
+                         pa.timestamp('ns'))
+    if s.dtype.kind == 'm':
+        return _ns_array(np.asarray(s, dtype='m8[ns]').view(np.int64),
+                         pa.duration('ns'))
+    if name in raw_date_cols:
+        return _ns_array(parse_date_ns(s), pa.timestamp('ns'))
+    if name in raw_time_cols:
+        return _ns_array(parse_time_ns(s), pa.duration('ns'))
+    if name in dictionary_cols:
+        return _string_array(s).dictionary_encode()
+    if s.dtype.kind in 'biuf':
+        return pa.array(np.asarray(s, dtype=np.float64), type=pa.float64(),
+                        from_pandas=True)
+    return _string_array(s)
+
+
+# Converts a dataframe in the csv layout to an arrow table. Date and Time
+# are replaced by Timestamp (unless it is already a column), and the flags
+# of the qualifiers decoder are packed into QualBits.
+def to_arrow(df, qualifiers=None):
+    _require_pyarrow()
+    flags = qualifiers.flags if qualifiers is not None else []
+    has_time = 'Date' in df.columns and 'Time' in df.columns
+    names = []
+    arrays = []
+    for c in df.columns:
+        if has_time and c in ('Date', 'Time'):
+            if c == 'Date' and 'Timestamp' not in df.columns:
+                names.append('Timestamp')
+                arrays.append(_column_array('Timestamp', tick_timestamps(df)))
+        elif c in flags:
+            if 'QualBits' not in names:
+                names.append('QualBits')
+                arrays.append(pa.array(qualifiers.pack(df).astype(np.int32),
+                                       type=pa.int32()))
+        else:
+            names.append(c)
+            arrays.append(_column_array(c, df[c]))
+    table = pa.Table.from_arrays(arrays, names=names)
+    if flags:
+        table = table.replace_schema_metadata(
+            {_flags_key: ','.join(flags).encode('utf-8')})
+    return table
+
+
+# Writes dataframes (in the csv layout) to a parquet file, one row group per
+# dataframe. fname is the name of the csv file; the parquet extension is
+# added to it. codec is the parquet compression ('gzip', 'zstd' or 'lz4').
+class ParquetSink(object):
+
+    def __init__(self, fname, codec='gzip', qualifiers=None):
+        _require_pyarrow()
+        self.fname = fname + parquet_ext
+        self.codec = codec
+        self.qualifiers = qualifiers
+        self.writer = None
+        self.rows = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    # The index is not stored.
+    def append(self, df, index=False):
+        with phase('to_arrow', df):
+            table = to_arrow(df, self.qualifiers)
+        self._write(table)
+
+    def _write(self, table):
+        if self.writer is None:
+            self.writer = pq.ParquetWriter(self.fname, table.schema,
+                                           compression=self.codec)
+        if table.num_rows > 0:
+            with phase('write_parquet', table.num_rows):
+                self.writer.write_table(table,
+                                        row_group_size=table.num_rows)
+            self.rows += table.num_rows
+
+    # Position to roll back to if what is written next must be discarded.
+    def mark(self):
+        return None if self.writer is None else self.rows
+
+    # A parquet file cannot be truncated, so the rows kept are written again
+    # to a new file. This only happens for corrupted raw files.
+    def rollback(self, mark):
+        if self.writer is None:
+            return
+        self.writer.close()
+        self.writer = None
+        if mark is None:
+            os.remove(self.fname)
+            self.rows = 0
+            return
+        table = pq.read_table(self.fname).slice(0, mark)
+        os.remove(self.fname)
+        self.rows = 0
+        self._write(table)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+
+# Sink that writes the dataframes sorted by RIC (keeping the order of the
+# rows of each RIC), with the RIC index, when it is closed. The rows are
+# sorted with an external sort within memory bytes (the chunk budget of the
+# worker by default, see ExternalSort.py), so the file is not held in memory.
+# Nothing is written if nothing was appended. prepare, if given, is applied
+# to the rows of each RIC (the rows of several whole RICs at once) before
+# they are written.
+class RICSortedSink(object):
+
+    def __init__(self, fname, fmt='csv', codec='gzip', threads=1,
+                 qualifiers=None, prepare=None, memory=None, tmp_dir=None):
+        # Imported here, since ExternalSort.py imports this module.
+        from ExternalSort import ExternalSorter
+        self.args = (fname, fmt, codec, threads, qualifiers)
+        self.prepare = prepare
+        self.sorter = ExternalSorter(memory, tmp_dir, by_time=False)
+        self.appended = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    # The index is not stored.
+    def append(self, df, index=False):
+        self.appended = True
+        self.sorter.add(df)
+
+    def mark(self):
+        return self.sorter.mark()
+
+    def rollback(self, mark):
+        self.sorter.rollback(mark)
+        if mark == 0:
+            self.appended = False
+
+    def close(self):
+        if self.sorter is None:
+            return
+        try:
+            if self.appended:
+                with RICIndexWriter(*self.args) as writer:
+                    self._write(writer)
+        finally:
+            self.sorter.close()
+            self.sorter = None
+
+    def _write(self, writer):
+        if self.prepare is None:
+            for df in self.sorter.sorted_chunks():
+                writer.append(df)
+            return
+        # The rows of the last RIC of a chunk are kept until the RIC ends.
+        pending = None
+        for df in self.sorter.sorted_chunks():
+            if pending is not None:
+                df = pd.concat([pending, df])
+            ric = df['#RIC']
+            last = (ric.isnull() if len(df) == 0 or pd.isnull(ric.iloc[-1])
+                    else ric == ric.iloc[-1])
+            n = len(df) - int(last.sum())
+            if n > 0:
+                writer.append(self.prepare(df.iloc[:n]))
+            pending = df.iloc[n:]
+        if pending is not None:
+            writer.append(self.prepare(pending) if len(pending) > 0
+                          else pending)
+
+
+# Opens a sink for the output file fname (without extension) in the given
+# format. For parquet files, codec is the parquet compression and the flags
+# of the qualifiers decoder are packed. With ric_sorted, the file is written
+# sorted by RIC with its index when the sink is closed (see RICSortedSink),
+# and prepare (if given) is applied to the rows of each RIC first.
+def open_sink(fname, fmt='csv', codec='gzip', threads=1, qualifiers=None,
+              ric_sorted=False, prepare=None):
+    if ric_sorted:
+        return RICSortedSink(fname, fmt, codec, threads, qualifiers, prepare)
+    if fmt == 'csv':
+        sink = CSVSink(fname, codec, threads)
+    elif fmt == 'parquet':
+        sink = ParquetSink(fname, codec, qualifiers)
+    else:
+        raise ValueError('Unknown format: ' + str(fmt))
+    # The index of a previous version of the file is no longer valid.
+    if os.path.isfile(sink.fname + index_ext):
+        os.remove(sink.fname + index_ext)
+    return sink
+
+
+# Writes one dataframe to a file in the given format.
+def write_ticks(df, fname, fmt='csv', codec='gzip', threads=1, qualifiers=None,
+                index=False):
+    with open_sink(fname, fmt, codec, threads, qualifiers) as sink:
+        sink.append(df, index=index)
+
+
+# Sorts the rows by RIC, keeping the order of the rows of each RIC. Rows with
+# a missing RIC are last. Returns the sorted dataframe and the list of
+# (RIC, first row, last row + 1) of each RIC.
+def sort_by_ric(df):
+    codes, uniques = pd.factorize(df['#RIC'], sort=True)
+    codes = np.where(codes < 0, len(uniques), codes)
+    order = np.argsort(codes, kind='mergesort')
+    bounds = np.searchsorted(codes[order], np.arange(len(uniques) + 1))
+    runs = [(uniques[i], bounds[i], bounds[i + 1])
+            for i in range(len(uniques)) if bounds[i + 1] > bounds[i]]
+    return df.iloc[order], runs
+
+
+# Writes rows sorted by RIC (rows without RIC last), appended in one or more
+# dataframes, with the RIC index of the file. The rows of a RIC can be split
+# across dataframes. In csv files, the header and each RIC are separate
+# compressed blocks (gzip members or zstd/lz4 frames), and the index holds
+# the byte range of each RIC. In parquet files, the index holds the row range
+# of each RIC, and the rows of the row group in progress are kept until it
+# ends, since row groups hold whole RICs.
+class RICIndexWriter(object):
+
+    def __init__(self, fname, fmt='csv', codec='gzip', threads=1,
+                 qualifiers=None):
+        self.fmt = fmt
+        self.sink = open_sink(fname, fmt, codec, threads, qualifiers)
+        self.index = []
+        self.started = False
+        # RIC in progress, and its first byte (csv) or row (parquet)
+        self.ric = None
+        self.start = 0
+        self.rows = 0
+        # First row and rows of the row group in progress (parquet)
+        self.group_start = 0
+        self.pending = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def append(self, df):
+        if not self.started:
+            # The header (or schema) is written first.
+            self.sink.append(df.iloc[:0])
+            if self.fmt == 'csv':
+                self.start = self.sink.mark()[0]
+            self.started = True
+        if len(df) == 0:
+            return
+        # Runs of rows of the same RIC
+        codes = pd.factorize(df['#RIC'])[0]
+        bounds = np.append(np.flatnonzero(np.diff(codes)) + 1, len(df))
+        first = 0
+        for last in bounds:
+            rows = df.iloc[first:last]
+            ric = df['#RIC'].iloc[first]
+            if codes[first] < 0:
+                # Rows without RIC, which are not in the index
+                self._end_ric()
+            elif ric != self.ric:
+                self._end_ric()
+                self.ric = ric
+                if self.fmt != 'csv':
+                    self.start = self.rows
+            if self.fmt == 'csv':
+                self.sink.append(rows)
+            else:
+                self.pending.append(rows)
+            self.rows += len(rows)
+            first = last
+
+    def _end_ric(self):
+        if self.ric is None:
+            return
+        if self.fmt == 'csv':
+            end = self.sink.mark()[0]
+            self.index.append((self.ric, self.start, end))
+            self.start = end
+        else:
+            end = self.rows
+            if (end - self.group_start > group_rows and
+                    self.start > self.group_start):
+                df = pd.concat(self.pending)
+                split = self.start - self.group_start
+                self.sink.append(df.iloc[:split])
+                self.pending = [df.iloc[split:]]
+                self.group_start = self.start
+            self.index.append((self.ric, self.start, end))
+        self.ric = None
+
+    def close(self):
+        if self.sink is None:
+            return
+        self._end_ric()
+        if self.pending and self.rows > self.group_start:
+            self.sink.append(pd.concat(self.pending))
+        self.pending = []
+        self.sink.close()
+        if self.started:
+            pd.DataFrame(self.index, columns=['#RIC', 'start', 'end']).to_csv(
+                self.sink.fname + index_ext, index=False)
+        self.sink = None
+
+
+# Writes one dataframe sorted by RIC (keeping the order of the rows of each
+# RIC), with the RIC index of the file (see RICIndexWriter).
+def write_sorted_ticks(df, fname, fmt='csv', codec='gzip', threads=1,
+                       qualifiers=None):
+    with phase('sort_ric', df):
+        df = sort_by_ric(df)[0]
+    with RICIndexWriter(fname, fmt, codec, threads, qualifiers) as writer:
+        writer.append(df)
+
+
+# Reads the RIC index of a data file, as a dict of RIC: (start, end).
+def read_ric_index(fn):
+    index = pd.read_csv(fn + index_ext, keep_default_na=False,
+                        dtype={'#RIC': object})
+    return dict(zip(index['#RIC'],
+                    zip(index['start'].tolist(), index['end'].tolist())))
+
+
+# Returns the parquet or compressed csv file for fname (the name of the csv
+# file, or of the file itself), or None if there is none.
+def find_ticks(fname):
+    if os.path.isfile(fname):
+        return fname
+    if os.path.isfile(fname + parquet_ext):
+        return fname + parquet_ext
+    return find_csv(fname)
+
+
+# Converts an arrow table read from a parquet file back to a dataframe with
+# the requested columns (all columns, in the csv layout, if columns is None).
+# Dictionary-encoded columns are decoded to strings. Date and Time are
+# derived from Timestamp, as a datetime and a timedelta.
+def _from_arrow(table, columns, flags):
+    for i, field in enumerate(table.schema):
+        if pa.types.is_dictionary(field.type):
+            table = table.set_column(i, field.name,
+                                     table.column(i).cast(pa.string()))
+    df = table.to_pandas()
+
+    if columns is None:
+        columns = []
+        for c in df.columns:
+            if c == 'Timestamp':
+                columns += ['Date', 'Time']
+            elif c == 'QualBits':
+                columns += flags
+            else:
+                columns.append(c)
+
+    if 'QualBits' in df.columns:
+        bits = np.asarray(df['QualBits'], dtype=np.int64)
+        for i, label in enumerate(flags):
+            if label in columns:
+                df[label] = (bits >> i) & 1
+    if 'Timestamp' in df.columns and ('Date' in columns or 'Time' in columns):
+        df['Date'] = df['Timestamp'].dt.normalize()
+        df['Time'] = df['Timestamp'] - df['Date']
+    return df[columns]
+
+
+def _parquet_columns(pf, columns, flags):
+    if columns is None:
+        return None
+    names = pf.schema_arrow.names
+    phys = []
+    for c in columns:
+        if c in flags:
+            c = 'QualBits'
+        elif c in ('Date', 'Time') and c not in names:
+            c = 'Timestamp'
+        if c not in phys:
+            phys.append(c)
+    return phys
+
+
+def _parquet_flags(pf):
+    meta = pf.schema_arrow.metadata or {}
+    flags = meta.get(_flags_key)
+    return flags.decode('utf-8').split(',') if flags else []
+
+
+def _csv_columns(columns):
+    if columns is None:
+        return None
+    usecols = [c for c in columns if c != 'Timestamp']
+    if 'Timestamp' in columns:
+        usecols += [c for c in ['Date', 'Time'] if c not in usecols]
+    return usecols
+
+
+def _ric_list(ric):
+    if ric is None or isinstance(ric, (list, tuple, set)):
+        return ric
+    return [ric]
+
+
+def _from_csv(df, columns, rics):
+    if rics is not None:
+        df = df[df['#RIC'].isin(rics)].copy()
+    if columns is None:
+        return df
+    if 'Timestamp' in columns:
+        df['Timestamp'] = tick_timestamps(df)
+    return df[columns]
+
+
+# Reads the rows of the given RICs using the RIC index of the file. The
+# blocks of the RICs are read in file order.
+def _read_indexed(fn, columns, rics):
+    index = read_ric_index(fn)
+    entries = sorted(index[ric] for ric in set(rics) if ric in index)
+
+    if fn.endswith(parquet_ext):
+        _require_pyarrow()
+        pf = pq.ParquetFile(fn)
+        flags = _parquet_flags(pf)
+        phys = _parquet_columns(pf, columns, flags)
+        # Only the row groups holding the RICs are read.
+        groups = []
+        rows = []
+        row = 0
+        pos = 0
+        for i in range(pf.num_row_groups):
+            n = pf.metadata.row_group(i).num_rows
+            sel = [np.arange(max(start, row), min(end, row + n)) - row + pos
+                   for start, end in entries if start < row + n and end > row]
+            if sel:
+                groups.append(i)
+                rows += sel
+                pos += n
+            row += n
+        if groups:
+            table = pf.read_row_groups(groups, columns=phys)
+            table = table.take(pa.array(np.concatenate(rows)))
+        else:
+            table = pf.schema_arrow.empty_table()
+            if phys is not None:
+                table = table.select(phys)
+        return _from_arrow(table, columns, flags)
+
+    usecols = _csv_columns(columns)
+    if not entries:
+        return _from_csv(read_csv(fn, usecols=usecols, nrows=0), columns, None)
+    # The header block, followed by the blocks of the RICs.
+    with open(fn, 'rb') as f:
+        data = [f.read(min(s for s, e in index.values()))]
+        for start, end in entries:
+            f.seek(start)
+            data.append(f.read(end - start))
+    stream = get_codec(file_codec(fn)).open(io.BytesIO(b''.join(data)))
+    df = pd.read_csv(stream, compression=None, usecols=usecols)
+    return _from_csv(df, columns, None)
+
+
+def _iter_ticks(fn, columns, chunksize, rics):
+    if rics is not None and os.path.isfile(fn + index_ext):
+        yield _read_indexed(fn, columns, rics)
+        return
+    if fn.endswith(parquet_ext):
+        _require_pyarrow()
+        pf = pq.ParquetFile(fn)
+        flags = _parquet_flags(pf)
+        phys = _parquet_columns(pf, columns, flags)
+        if chunksize is None or rics is not None:
+            # Only the row groups and rows of the RICs are read.
+            filters = None if rics is None else [('#RIC', 'in', list(rics))]
+            table = pq.read_table(fn, columns=phys, filters=filters)
+            yield _from_arrow(table, columns, flags)
+            return
+        if chunksize == 'auto':
+            # Batches sized from the parsed rows of the start of the file
+            first = next(pf.iter_batches(batch_size=first_rows,
+                                         columns=phys), None)
+            if first is None:
+                return
+            chunksize = chunk_rows(_from_arrow(pa.Table.from_batches([first]),
+                                               columns, flags))
+        for batch in pf.iter_batches(batch_size=chunksize, columns=phys):
+            yield _from_arrow(pa.Table.from_batches([batch]), columns, flags)
+        return
+
+    usecols = _csv_columns(columns)
+    if rics is not None and usecols is not None and '#RIC' not in usecols:
+        usecols.append('#RIC')
+    if chunksize is None:
+        yield _from_csv(read_csv(fn, usecols=usecols), columns, rics)
+        return
+    for chunk in read_csv(fn, chunksize=chunksize, usecols=usecols):
+        yield _from_csv(chunk, columns, rics)
+
+
+# Reads a parquet or compressed csv file, given the name of the csv file.
+# Only the requested columns are read (Timestamp, flags and the Date and
+# Time columns are available in both formats). If ric is given (one RIC or
+# a list of RICs), only their rows are kept, and they are returned in one
+# chunk if the file has a RIC index (only the rows of the RICs are read) or
+# is a parquet file (the other rows are skipped while reading). With
+# chunksize (a number of rows, or 'auto' for chunks sized to the memory
+# budget, see Chunks.py), returns an iterator over chunks of the file.
+def read_ticks(fname, columns=None, chunksize=None, ric=None):
+    fn = find_ticks(fname)
+    if fn is None:
+        raise IOError('Missing file: ' + fname)
+    if ric is None and fn.endswith(parquet_ext):
+        # csv files are counted by read_csv. Only part of the file is read
+        # for given RICs.
+        count('input_bytes', os.path.getsize(fn))
+    chunks = timed_iter(_iter_ticks(fn, columns, chunksize, _ric_list(ric)),
+                        'read_ticks')
+    if chunksize is not None:
+        return chunks
+    return next(chunks)
@@ -0,0 +1,160 @@
+"""
+Code for "How Is Earnings News Transmitted to Stock Prices?" by
+Vincent Grégoire and Charles Martineau.
+
+Python 2 and 3
+
+Vectorized parsing of the fixed-width TRTH time ('HH:MM:SS.mmm') and date
+('DD-Mon-YYYY') columns. Strings are converted to fixed-width byte arrays and
+the digits are read at fixed offsets, so no Python object is created per row.
+All results are int64 nanoseconds (since midnight for times, since the epoch
+for dates and timestamps), with NAT for missing or malformed values.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+NAT = np.iinfo(np.int64).min
+
+NS_SECOND = 1000000000
+NS_HOUR = 3600 * NS_SECOND
+NS_DAY = 24 * NS_HOUR
+
+_months = ['jan', 'feb', 'mar', 'apr', 'may', 'jun',
+           'jul', 'aug', 'sep', 'oct', 'nov', 'dec']
+_month_keys = np.array([(ord(m[0]) << 16) | (ord(m[1]) << 8) | ord(m[2])
+                        for m in _months], dtype=np.int64)
+_month_order = np.argsort(_month_keys)
+_month_keys_sorted = _month_keys[_month_order]
+
+
+# Returns the strings of the series as a (rows x width) matrix of bytes,
+# padded with zeros, and the mask of missing values.
+def _as_bytes(s, width):
+    missing = np.asarray(pd.isnull(s))
+    values = np.asarray(s, dtype=object).copy()
+    values[missing] = ''
+    b = values.astype('S' + str(width))
+    return b.view(np.uint8).reshape(len(b), width).astype(np.int64), missing
+
+
+# Columns that are already parsed (as read from parquet files) are returned
+# as they are, in nanoseconds.
+def _parsed_ns(s, kind):
+    if getattr(s, 'dtype', None) is None or s.dtype.kind != kind:
+        return None
+    unit = 'M8[ns]' if kind == 'M' else 'm8[ns]'
+    return np.asarray(s, dtype=unit).view(np.int64)
+
+
+# Parses 'HH:MM:SS.mmm' into nanoseconds since midnight.
+def parse_time_ns(s):
+    ns = _parsed_ns(s, 'm')
+    if ns is not None:
+        return ns
+    b, missing = _as_bytes(s, 12)
+    # Missing milliseconds digits are read as zeros
+    b[:, 9:12] = np.where(b[:, 9:12] == 0, 48, b[:, 9:12])
+    d = b - 48
+    valid = (~missing & (b[:, 2] == 58) & (b[:, 5] == 58) &
+             ((d[:, [0, 1, 3, 4, 6, 7]] >= 0) &
+              (d[:, [0, 1, 3, 4, 6, 7]] <= 9)).all(axis=1))
+    ns = (((d[:, 0] * 10 + d[:, 1]) * 3600 +
+           (d[:, 3] * 10 + d[:, 4]) * 60 +
+           (d[:, 6] * 10 + d[:, 7])) * NS_SECOND +
+          (d[:, 9] * 100 + d[:, 10] * 10 + d[:, 11]) * 1000000)
+    return np.where(valid, ns, NAT)
+
+
+# Number of days since 1970-01-01 (proleptic Gregorian calendar).
+def days_from_civil(y, m, d):
+    y = y - (m <= 2)
+    era = y // 400
+    yoe = y - era * 400
+    doy = (153 * np.where(m > 2, m - 3, m + 9) + 2) // 5 + d - 1
+    doe = yoe * 365 + yoe // 4 - yoe // 100 + doy
+    return era * 146097 + doe - 719468
+
+
+# Parses 'DD-Mon-YYYY' into nanoseconds since the epoch.
+def parse_date_ns(s):
+    ns = _parsed_ns(s, 'M')
+    if ns is not None:
+        return ns
+    b, missing = _as_bytes(s, 11)
+    d = b - 48
+    # Month names are matched case-insensitively
+    key = (((b[:, 3] | 32) << 16) | ((b[:, 4] | 32) << 8) | (b[:, 5] | 32))
+    pos = np.searchsorted(_month_keys_sorted, key).clip(0, 11)
+    month = _month_order[pos] + 1
+    day = d[:, 0] * 10 + d[:, 1]
+    year = d[:, 7] * 1000 + d[:, 8] * 100 + d[:, 9] * 10 + d[:, 10]
+    valid = (~missing & (_month_keys_sorted[pos] == key) &
+             (day >= 1) & (day <= 31) & (year >= 1000) & (year <= 9999))
+    days = days_from_civil(year, month, day)
+    return np.where(valid, days * NS_DAY, NAT)
+
+
+# Converts a GMT offset in hours to nanoseconds.
+def _offset_ns(gmt_offset):
+    h = np.asarray(gmt_offset, dtype=np.float64)
+    valid = ~np.isnan(h)
+    ns = np.round(np.where(valid, h, 0.0) * 3600) * NS_SECOND
+    return ns.astype(np.int64), valid
+
+
+# Local trade timestamp: exchange time on the trade date (or the TRTH date if
+# the trade date is missing), shifted by the GMT offset.
+def trade_times(exch_time, trade_date, date_g, gmt_offset):
+    ts = parse_time_ns(exch_time)
+    dt = parse_date_ns(trade_date)
+    dt = np.where(dt == NAT, parse_date_ns(date_g), dt)
+    offset, valid_offset = _offset_ns(gmt_offset)
+    valid = (ts != NAT) & (dt != NAT) & valid_offset
+    return ts, dt, np.where(valid, dt + ts + offset, NAT)
+
+
+# Local quote timestamp. There is only one date field, which corresponds to
+# the TRTH timestamp, so the quote time is the TRTH timestamp minus the
+# difference between the TRTH time and the Quote Time (or the TRTH time if
+# the Quote Time is missing). If the day changes between the two times, the
+# difference is close to +/-24 hours and is wrapped back.
+def quote_times(quote_time, time_g, date_g, gmt_offset):
+    tg = parse_time_ns(time_g)
+    ts = parse_time_ns(quote_time)
+    ts = np.where(ts == NAT, tg, ts)
+    dg = parse_date_ns(date_g)
+    offset, valid_offset = _offset_ns(gmt_offset)
+
+    diff = tg - ts
+    diff = np.where(diff > 23 * NS_HOUR, diff - NS_DAY, diff)
+    diff = np.where(diff < -23 * NS_HOUR, diff + NS_DAY, diff)
+
+    valid = (tg != NAT) & (ts != NAT) & (dg != NAT) & valid_offset
+    return tg, dg, np.where(valid, dg + tg - diff + offset, NAT)
+
+
+# Timestamp of the quotes used after classification: the time of day of the
+# quote time on the TRTH date.
+def quote_timestamps(date_g, quote_time):
+    missing = (date_g == NAT) | (quote_time == NAT)
+    return np.where(missing, NAT, date_g + quote_time % NS_DAY)
+
+
+# Midnight of the day of each timestamp.
+def floor_day(ns):
+    return np.where(ns == NAT, NAT, ns - ns % NS_DAY)
+
+
+# Time since midnight of each timestamp.
+def time_of_day(ns):
+    return np.where(ns == NAT, NAT, ns % NS_DAY)
+
+
+def to_datetime64(ns):
+    return np.asarray(ns, dtype=np.int64).view('M8[ns]')
+
+
+def to_timedelta64(ns):
+    return np.asarray(ns, dtype=np.int64).view('m8[ns]')
@@ -0,0 +1,161 @@
+"""
+Code for "How Is Earnings News Transmitted to Stock Prices?" by
+Vincent Grégoire and Charles Martineau.
+
+Python 2 and 3
+
+Streaming removal of duplicated trades, keyed on RIC, venue and sequence
+number. The same print can be sent twice, in one raw file or in two
+overlapping files of the same date. The trades are checked chunk by chunk,
+in the order they are read, against the trades already seen. Only the
+payload of a trade (payload_cols: price, volume, exchange date and time,
+qualifiers) is compared, not the receipt time (Date[G], Time[G], GMT
+Offset), which can differ between copies:
+
+- A trade with the key and the payload of a version already seen with that
+  key is a duplicate, and is dropped. All the versions of a key are
+  remembered, so a file resending the versions of an amended trade only
+  adds duplicates.
+- A trade with a key already seen but a new payload is an amended trade. It
+  is kept, since the earlier version may already be written, and counted.
+- Trades without sequence number are always kept.
+
+The state is compact: 64-bit hashes of the keys and of the versions (key and
+payload) seen, in sorted blocks that are merged as they grow, so each chunk
+only sorts its own hashes. It is bounded by max_keys, by default a share of
+the chunk budget of the worker (Chunks.chunk_memory): when the current
+blocks are full, they become the previous generation and the older one is
+forgotten, so at least the last max_keys / 2 trades are remembered. Blocks
+are never modified in place, so mark() and rollback() are cheap, for the raw
+files found corrupted after some of their chunks were written.
+"""
+
+import numpy as np
+import pandas as pd
+
+import Chunks
+
+
+key_cols = ['#RIC', 'Ex/Cntrb.ID', 'Seq. No.']
+
+# Columns compared between the versions of a trade
+payload_cols = ['Price', 'Volume', 'Qualifiers', 'Exch Time', 'Trd/Qte Date']
+
+# Share of the chunk budget used by the state, at 16 bytes per trade (the
+# hashes of its key and of its version)
+state_share = 0.5
+
+# Counts of a day, in the order of the summary files
+count_names = ['Trades', 'Duplicates', 'Amended', 'NoSeq']
+
+
+# Hash of each row of df. Numbers are hashed as floats and missing values
+# alike, so the same trade has the same hash whatever the types the columns
+# were parsed with in its chunk. Strings are hashed once per distinct value.
+def _hash(df):
+    h = np.zeros(len(df), dtype=np.uint64)
+    for c in df.columns:
+        s = df[c]
+        if pd.api.types.is_numeric_dtype(s):
+            hc = pd.util.hash_array(s.values.astype(np.float64))
+            hc[s.isnull().values] = 0
+        else:
+            codes, uniques = pd.factorize(s)
+            hu = np.append(pd.util.hash_array(np.asarray(uniques,
+                                                         dtype=object)),
+                           np.uint64(0))
+            # Missing values have code -1, the hash 0 at the end.
+            hc = hu[codes]
+        h = (h * np.uint64(1000003)) ^ hc
+    return h
+
+
+# Sorted unique values of the array h.
+def _unique(h):
+    h = np.sort(h)
+    first = np.ones(len(h), bool)
+    first[1:] = h[1:] != h[:-1]
+    return h[first]
+
+
+# Whether each hash of h is in the sorted blocks or earlier in h. The hashes
+# are looked up in sorted order (stable, so that the first of equal hashes is
+# the earliest), which keeps the searches local.
+def _seen(blocks, h):
+    order = np.argsort(h, kind='mergesort')
+    hs = h[order]
+    found = np.zeros(len(h), bool)
+    found[1:] = hs[1:] == hs[:-1]
+    for block in blocks:
+        pos = np.searchsorted(block, hs)
+        inside = pos < len(block)
+        found[inside] |= block[pos[inside]] == hs[inside]
+    seen = np.empty(len(h), bool)
+    seen[order] = found
+    return seen
+
+
+# Blocks with the sorted unique hashes new added. Blocks are merged while
+# the newest is at least half as large as the one before, so there are few
+# of them and each hash is merged a logarithmic number of times.
+def _add(blocks, new):
+    blocks = blocks + [new]
+    while (len(blocks) > 1 and
+           2 * len(blocks[-1]) >= len(blocks[-2])):
+        blocks = blocks[:-2] + [_unique(np.concatenate(blocks[-2:]))]
+    return blocks
+
+
+class TradeDedup(object):
+
+    def __init__(self, max_keys=None):
+        if max_keys is None:
+            max_keys = int(Chunks.chunk_memory * state_share / 16)
+        self.max_keys = max_keys
+        # Current and previous generations of sorted blocks of the hashes of
+        # the keys and of the versions
+        self.current = ([], [])
+        self.previous = ([], [])
+        self.counts = dict((name, 0) for name in count_names)
+
+    # Returns the rows of df to keep, and updates the counts.
+    def filter(self, df):
+        seq = df['Seq. No.'].notnull().values
+        self.counts['Trades'] += len(df)
+        self.counts['NoSeq'] += int((~seq).sum())
+        if not seq.any():
+            return df
+
+        rows = df[seq]
+        k = _hash(rows[key_cols])
+        p = _hash(rows[[c for c in payload_cols if c in rows.columns]])
+        v = (k * np.uint64(1000003)) ^ p
+
+        # A version is a duplicate if it was seen before, in the state or
+        # earlier in the chunk. A new version of a key seen before is an
+        # amended trade.
+        dup = _seen(self.current[1] + self.previous[1], v)
+        seen = _seen(self.current[0] + self.previous[0], k)
+        self.counts['Duplicates'] += int(dup.sum())
+        self.counts['Amended'] += int((seen & ~dup).sum())
+
+        # The keys and versions of the chunk are remembered.
+        self.current = (_add(self.current[0], _unique(k)),
+                        _add(self.current[1], _unique(v)))
+        if sum(len(b) for b in self.current[1]) > self.max_keys // 2:
+            self.previous = self.current
+            self.current = ([], [])
+
+        if not dup.any():
+            return df
+        keep = np.ones(len(df), bool)
+        keep[np.flatnonzero(seq)[dup]] = False
+        return df[keep]
+
+    # State to roll back to if the rows filtered next must be discarded.
+    def mark(self):
+        return self.current, self.previous, dict(self.counts)
+
+    def rollback(self, mark):
+        self.current, self.previous, counts = mark
+        self.counts = dict(counts)
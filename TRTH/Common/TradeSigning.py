@@ -0,0 +1,151 @@
+"""
+Code for "How Is Earnings News Transmitted to Stock Prices?" by
+Vincent Grégoire and Charles Martineau.
+
+Python 2 and 3
+
+Trade signing and spread measures from trades and the prevailing NBBO
+quotes. The quote prevailing at each trade (the last quote strictly before
+the trade time minus a lag, for the same RIC) is found for all trades in one
+sorted pass (see AsofSampler.grouped_asof). Trades are signed with the
+Lee-Ready algorithm (midpoint test, then tick test at the midpoint) or with
+the tick test alone.
+
+Quotes are handled as recommended for the after-hours market: empty sides
+and NoQuote updates are kept as missing sides instead of being dropped (so
+an older quote is not carried forward), and wide or crossed spreads are
+kept. Measures that need a missing midpoint are missing.
+"""
+
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+from AsofSampler import grouped_asof
+from TickFiles import read_ticks
+
+
+quote_cols = ['Bid Price', 'Bid Size', 'Ask Price', 'Ask Size']
+
+
+# Sets the bid (ask) price to missing when the bid (ask) is empty: zero size
+# or price, or a NoQuote update.
+def mask_empty_quotes(df_quotes):
+    no_quote = (df_quotes['NoQuote'] == 1 if 'NoQuote' in df_quotes.columns
+                else False)
+    no_bid = ((df_quotes['Bid Size'] == 0.0) |
+              (df_quotes['Bid Price'] == 0.0) | no_quote)
+    df_quotes.loc[no_bid, 'Bid Price'] = np.nan
+    no_ask = ((df_quotes['Ask Size'] == 0.0) |
+              (df_quotes['Ask Price'] == 0.0) | no_quote)
+    df_quotes.loc[no_ask, 'Ask Price'] = np.nan
+    return df_quotes
+
+
+# Reads the quotes of one event file within extended trading hours, with
+# missing bid and ask prices for empty sides. columns are read before the
+# quote columns.
+def read_quotes(fn, columns=['Timestamp']):
+    df_quotes = read_ticks(fn, columns=columns + quote_cols + ['NoQuote'])
+    df_quotes = mask_empty_quotes(df_quotes)
+
+    # Quote that have timestamps outside of extended trading hours may get
+    # misclassified, we drop those (strictly after 4:00, as when the time
+    # strings were compared).
+    tod = df_quotes['Timestamp'] - df_quotes['Timestamp'].dt.normalize()
+    sel = ((tod > timedelta(hours=4)) &
+           (tod <= timedelta(hours=20)))
+    return df_quotes[sel]
+
+
+# Codes of the groups (by column) of the trades and quotes, and the order of
+# the quotes by group then time, ties kept in file order.
+def _quote_order(df_trades, df_quotes, by, ts):
+    codes = pd.factorize(pd.concat([df_quotes[by], df_trades[by]],
+                                   ignore_index=True))[0]
+    q_group = codes[:len(df_quotes)]
+    t_group = codes[len(df_quotes):]
+    q_time = np.asarray(df_quotes[ts], dtype='M8[ns]')
+    order = np.lexsort((q_time, q_group))
+    return t_group, q_group[order], q_time[order], order
+
+
+# Columns of the quote prevailing at each trade: the last quote strictly
+# before the trade time minus lag, for the same value of by. Returns a
+# dataframe aligned on the trades (missing values where there is no quote).
+def prevailing_quotes(df_trades, df_quotes, lag=timedelta(0), by='#RIC',
+                      ts='Timestamp', columns=quote_cols):
+    t_group, q_group, q_time, order = _quote_order(df_trades, df_quotes,
+                                                   by, ts)
+    t_time = (np.asarray(df_trades[ts], dtype='M8[ns]') -
+              np.timedelta64(pd.Timedelta(lag)))
+    pos = grouped_asof(q_group, q_time, t_group, t_time, strict=True)
+    found = pos >= 0
+    out = pd.DataFrame(index=df_trades.index)
+    for c in columns:
+        v = np.asarray(df_quotes[c], dtype=np.float64)[order]
+        col = np.full(len(pos), np.nan)
+        col[found] = v[pos[found]]
+        out[c] = col
+    return out
+
+
+# Tick test: +1 if the price is above the last different price of the same
+# group, -1 if below, missing for the first trades of each group until the
+# price changes. Trades must be in time order within each group.
+def tick_test(prices, groups):
+    prices = pd.Series(np.asarray(prices, dtype=np.float64))
+    groups = np.asarray(groups)
+    change = np.sign(prices.groupby(groups).diff())
+    return change.where(change != 0).groupby(groups).ffill().values
+
+
+# Lee-Ready: +1 above the midpoint, -1 below, and the tick test at the
+# midpoint or without a midpoint.
+def lee_ready(prices, mids, ticks):
+    prices = np.asarray(prices, dtype=np.float64)
+    mids = np.asarray(mids, dtype=np.float64)
+    return np.where(prices > mids, 1.0,
+                    np.where(prices < mids, -1.0, ticks))
+
+
+# Signs the trades and computes, per trade, the quoted spread at the trade,
+# the effective spread 2 D (P - M), the realized spread 2 D (P - M') and the
+# price impact 2 D (M' - M), in $ and relative to M, where D is the sign, M
+# the prevailing midpoint and M' the midpoint prevailing horizon after the
+# trade. method is 'lee_ready' or 'tick'. The trades are returned sorted by
+# by then time (ties in file order) with the prevailing bid and ask.
+def trade_spreads(df_trades, df_quotes, lag=timedelta(0),
+                  horizon=timedelta(minutes=5), method='lee_ready',
+                  by='#RIC', ts='Timestamp'):
+    if method not in ('lee_ready', 'tick'):
+        raise ValueError('Unknown signing method: ' + str(method))
+    t_time = np.asarray(df_trades[ts], dtype='M8[ns]')
+    t_group = pd.factorize(df_trades[by])[0]
+    df = df_trades.iloc[np.lexsort((t_time, t_group))].reset_index(drop=True)
+
+    quotes = prevailing_quotes(df, df_quotes, lag, by, ts)
+    later = prevailing_quotes(df, df_quotes, pd.Timedelta(lag) -
+                              pd.Timedelta(horizon), by, ts)
+    df['Bid Price'] = quotes['Bid Price'].values
+    df['Ask Price'] = quotes['Ask Price'].values
+    df['Midpoint'] = (df['Bid Price'] + df['Ask Price']) / 2
+    mid_later = ((later['Bid Price'] + later['Ask Price']) / 2).values
+
+    ticks = tick_test(df['Price'], df[by].values)
+    if method == 'lee_ready':
+        df['Sign'] = lee_ready(df['Price'], df['Midpoint'], ticks)
+    else:
+        df['Sign'] = ticks
+
+    price = df['Price'].values
+    mid = df['Midpoint'].values
+    sign = df['Sign'].values
+    df['QuotedSpread'] = df['Ask Price'] - df['Bid Price']
+    df['EffSpread'] = 2 * sign * (price - mid)
+    df['RealSpread'] = 2 * sign * (price - mid_later)
+    df['PriceImpact'] = 2 * sign * (mid_later - mid)
+    for c in ['QuotedSpread', 'EffSpread', 'RealSpread', 'PriceImpact']:
+        df[c + 'Pct'] = df[c] / mid
+    return df
@@ -0,0 +1,235 @@
+"""
+Code for "How Is Earnings News Transmitted to Stock Prices?" by
+Vincent Grégoire and Charles Martineau.
+
+Python 2 and 3
+
+NYSE trading calendar. The trading days from first_year to last_year are
+computed once, with the open and close of each session (13:00 on early
+close days), from the exchange holidays (which differ from the federal
+holidays: Good Friday is a holiday, Columbus Day and Veterans Day are not)
+and the unscheduled closings. Next and previous trading days, sessions and
+event windows are then looked up in these arrays with searchsorted, for one
+date or for whole arrays of dates.
+
+Functions given a single date return a pd.Timestamp (or a bool), and
+functions given an array of dates return a numpy array.
+"""
+
+from datetime import date, time, timedelta
+
+import numpy as np
+import pandas as pd
+
+
+first_year = 1995
+last_year = 2030
+
+open_time = timedelta(hours=9, minutes=30)
+close_time = timedelta(hours=16)
+early_close_time = timedelta(hours=13)
+
+# Unscheduled closings
+special_closings = [date(2001, 9, 11), date(2001, 9, 12), date(2001, 9, 13),
+                    date(2001, 9, 14),
+                    date(2004, 6, 11),
+                    date(2007, 1, 2),
+                    date(2012, 10, 29), date(2012, 10, 30),
+                    date(2018, 12, 5),
+                    date(2025, 1, 9)]
+
+
+# n-th weekday (0 is Monday) of the month, or the last one if n is -1.
+def _nth_weekday(year, month, weekday, n):
+    if n > 0:
+        d = date(year, month, 1)
+        d += timedelta(days=(weekday - d.weekday()) % 7)
+        return d + timedelta(weeks=n - 1)
+    d = date(year + month // 12, month % 12 + 1, 1) - timedelta(days=1)
+    return d - timedelta(days=(d.weekday() - weekday) % 7)
+
+
+def _easter(year):
+    a = year % 19
+    b, c = divmod(year, 100)
+    d, e = divmod(b, 4)
+    g = (8 * b + 13) // 25
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 19 * l) // 433
+    month = (h + l - 7 * m + 90) // 25
+    return date(year, month, (h + l - 7 * m + 33 * month + 19) % 32)
+
+
+# Holidays falling on a Saturday are observed on the Friday before, and on a
+# Sunday on the Monday after.
+def _observed(d):
+    if d.weekday() == 5:
+        return d - timedelta(days=1)
+    if d.weekday() == 6:
+        return d + timedelta(days=1)
+    return d
+
+
+def holidays(year):
+    days = [_nth_weekday(year, 2, 0, 3),        # Washington's Birthday
+            _easter(year) - timedelta(days=2),  # Good Friday
+            _nth_weekday(year, 5, 0, -1),       # Memorial Day
+            _observed(date(year, 7, 4)),        # Independence Day
+            _nth_weekday(year, 9, 0, 1),        # Labor Day
+            _nth_weekday(year, 11, 3, 4),       # Thanksgiving
+            _observed(date(year, 12, 25))]      # Christmas
+    # New Year's Day is not moved to the Friday before when on a Saturday
+    if date(year, 1, 1).weekday() != 5:
+        days.append(_observed(date(year, 1, 1)))
+    if year >= 1998:
+        days.append(_nth_weekday(year, 1, 0, 3))  # Martin Luther King Day
+    if year >= 2022:
+        days.append(_observed(date(year, 6, 19)))  # Juneteenth
+    return sorted(days)
+
+
+# Sessions closing at 13:00, if they are trading days: the day after
+# Thanksgiving, and July 3 and December 24 when the holiday that follows is
+# on a weekday.
+def _early_closes(year):
+    return [d for d in [_nth_weekday(year, 11, 3, 4) + timedelta(days=1),
+                        date(year, 7, 3), date(year, 12, 24)]
+            if d.weekday() < 4 or d.month == 11]
+
+
+def _sessions():
+    years = range(first_year, last_year + 1)
+    closed = np.array(special_closings +
+                      [d for year in years for d in holidays(year)],
+                      dtype='M8[D]')
+    early = np.array([d for year in years for d in _early_closes(year)],
+                     dtype='M8[D]')
+
+    days = np.arange(np.datetime64(date(first_year, 1, 1), 'D'),
+                     np.datetime64(date(last_year + 1, 1, 1), 'D'))
+    days = days[np.is_busday(days) & ~np.isin(days, closed)]
+    is_early = np.isin(days, early)
+    opens = days.astype('M8[ns]') + np.timedelta64(open_time)
+    closes = days.astype('M8[ns]') + np.where(
+        is_early, np.timedelta64(early_close_time),
+        np.timedelta64(close_time))
+    return days, opens, closes, is_early
+
+
+trading_days, session_opens, session_closes, early_close_days = _sessions()
+_first_day = np.datetime64(date(first_year, 1, 1), 'D')
+_last_day = np.datetime64(date(last_year, 12, 31), 'D')
+
+
+def _days(dates):
+    scalar = np.ndim(dates) == 0
+    days = np.atleast_1d(np.asarray(dates, dtype='M8[D]'))
+    if scalar:
+        outside = days[0] < _first_day or days[0] > _last_day
+    else:
+        outside = len(days) > 0 and (days.min() < _first_day or
+                                     days.max() > _last_day)
+    if outside:
+        raise ValueError('Dates outside of the calendar (%d to %d)' %
+                         (first_year, last_year))
+    return days, scalar
+
+
+def _result(values, scalar):
+    if not scalar:
+        return values
+    if values.dtype == bool:
+        return bool(values[0])
+    return pd.Timestamp(values[0])
+
+
+def _lookup(array, idx, scalar):
+    if len(idx) > 0 and (idx.min() < 0 or idx.max() >= len(array)):
+        raise ValueError('Trading day outside of the calendar (%d to %d)' %
+                         (first_year, last_year))
+    return _result(array[idx].astype('M8[ns]'), scalar)
+
+
+# Position of each date in trading_days, -1 if it is not a trading day.
+def _session_index(days):
+    idx = np.searchsorted(trading_days, days)
+    found = idx < len(trading_days)
+    found[found] = trading_days[idx[found]] == days[found]
+    return np.where(found, idx, -1)
+
+
+def is_trading_day(dates):
+    days, scalar = _days(dates)
+    return _result(_session_index(days) >= 0, scalar)
+
+
+def is_early_close(dates):
+    days, scalar = _days(dates)
+    idx = _session_index(days)
+    return _result((idx >= 0) & early_close_days[idx], scalar)
+
+
+# n-th trading day after each date (as date + n * business day offset).
+def next_trading_day(dates, n=1):
+    days, scalar = _days(dates)
+    return _lookup(trading_days,
+                   np.searchsorted(trading_days, days, side='right') + n - 1,
+                   scalar)
+
+
+# n-th trading day before each date.
+def previous_trading_day(dates, n=1):
+    days, scalar = _days(dates)
+    return _lookup(trading_days, np.searchsorted(trading_days, days) - n,
+                   scalar)
+
+
+# Each date if it is a trading day, otherwise the next trading day.
+def roll_forward(dates):
+    days, scalar = _days(dates)
+    return _lookup(trading_days, np.searchsorted(trading_days, days), scalar)
+
+
+def _session_times(times, dates):
+    days, scalar = _days(dates)
+    idx = _session_index(days)
+    values = np.where(idx >= 0, times[idx], np.datetime64('NaT', 'ns'))
+    return _result(values, scalar)
+
+
+# Open and close of the session of each date (NaT if it is not a trading
+# day).
+def session_open(dates):
+    return _session_times(session_opens, dates)
+
+
+def session_close(dates):
+    return _session_times(session_closes, dates)
+
+
+# Open of the first session after each announcement: the session of the
+# announcement day (or the next one if it is not a trading day) if the
+# announcement is before cutoff, otherwise the session of the next trading
+# day.
+def event_open(dates, ea_ts, cutoff=time(12)):
+    days, scalar = _days(dates)
+    ts = np.atleast_1d(np.asarray(ea_ts, dtype='M8[ns]'))
+    cutoff = timedelta(hours=cutoff.hour, minutes=cutoff.minute,
+                       seconds=cutoff.second)
+    after = (ts - ts.astype('M8[D]')) > np.timedelta64(cutoff)
+    idx = np.where(after, np.searchsorted(trading_days, days, side='right'),
+                   np.searchsorted(trading_days, days))
+    return _lookup(session_opens, idx, scalar)
+
+
+# First and last trading days of the windows of events announced on date1
+# and date2: before trading days before the first of the two dates, to after
+# trading days after the last.
+def event_windows(date1, date2, before=1, after=1):
+    days1, scalar = _days(date1)
+    days2 = _days(date2)[0]
+    start = previous_trading_day(np.minimum(days1, days2), before)
+    end = next_trading_day(np.maximum(days1, days2), after)
+    return _result(start, scalar), _result(end, scalar)
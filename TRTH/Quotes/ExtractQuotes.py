@@ -15,31 +15,61 @@ from os import listdir
 import os
 import pandas as pd
 from datetime import datetime
-import gzip
-import shutil
-import hashlib
 import sys
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', 'Common'))
+from RawFiles import Manifest, ChecksumError, read_verified_csv
+from TickFiles import open_sink
+from QuoteRuns import compact_raw_quotes
+from Scheduler import run_tasks, month_tasks
+from Metrics import task, phase
+
 
 outdir = 'M:\\vgregoire\\TRTH_Quotes\\'
 
-# Checks the md5 has to make sure the raw file is not corrupted
-def md5(fname):
-    hash_md5 = hashlib.md5()
-    with open(fname, "rb") as f:
-        for chunk in iter(lambda: f.read(4096), b""):
-            hash_md5.update(chunk)
-    return hash_md5.hexdigest()
+# Raw files already verified, with their checksum
+manifest_fn = 'M:\\vgregoire\\TRTH_Raw_Manifest.csv'
+
+earnings_fn = '../data/Earnings_Announcements_MergedTRTH_2011_2015.csv'
+
+# Format of the output files ('csv', or 'parquet' for typed columnar files),
+# their compression ('gzip', or 'zstd' and 'lz4' for faster intermediate
+# files) and number of compression threads (csv files only).
+out_format = 'csv'
+out_codec = 'gzip'
+out_threads = 1
+
+# Write the daily files sorted by RIC, with a RIC index for fast extraction
+# of single stocks. The quotes of a day are sorted with an external sort
+# within the memory budget of the worker (see Common/ExternalSort.py).
+ric_sorted = True
+
+# Collapse the consecutive quotes of a RIC with the same book state (prices,
+# sizes, IDs and qualifiers) into one row, with the number of quotes in Count
+# and the time of the last one in LastTimestamp (see Common/QuoteRuns.py).
+# The files are then written sorted by RIC.
+compact = False
+
+
+# RIC list of the sample, loaded once per process.
+_universe = None
+
+
+def load_universe():
+    global _universe
+    if _universe is None:
+        earnings = pd.read_csv(earnings_fn, usecols=['#RIC'])
+        _universe = earnings['#RIC'].unique()
+    return _universe
 
 
 def process_task(exch, y, m):
     
-    # Load RIC list
-    earnings = pd.read_csv('../data/Earnings_Announcements_MergedTRTH_2011_2015.csv',
-                           usecols=['#RIC'])
-    earnings = earnings['#RIC'].unique()
-        
+    earnings = load_universe()
     
+    manifest = Manifest(manifest_fn)
+
     mdir = 'Y:\\' + exch + '\\TAS\\' + str(y) + '\\' + str(m).zfill(2) + '\\'
     
     ls = listdir(mdir)
@@ -54,8 +84,6 @@ def process_task(exch, y, m):
         dates_fn[datetime.strptime(fn[4:14], '%Y-%m-%d')].append(fn)
     
     for date in dates_fn:
-        dt_first = True
-        
         out_fn = (outdir + exch + '\\' + str(y) + '\\' + exch + '-Quotes-' +
                   date.strftime('%Y-%m-%d') + '.csv')
         
@@ -69,36 +97,53 @@ def process_task(exch, y, m):
         str_cols = ['Quote Time']
         dtypes = {x: object for x in str_cols}
     
+        # The output file is only created if there are quotes to write.
+        sink = open_sink(out_fn, out_format, out_codec, out_threads,
+                         ric_sorted=ric_sorted or compact,
+                         prepare=compact_raw_quotes if compact else None)
         
-        for f in fn:
-            # Validate file
-            md5_f = md5(mdir+f)
-            
-            with open(mdir+f+'.md5sum', 'r') as f_cs:
-                md5_check = f_cs.readline()[:32]
-                
-            if md5_f != md5_check:
-                sys.stderr.write('Wrong checksum for ' + f)
-                continue
+        # Each day is recorded in the metrics log, if it is enabled.
+        with task('ExtractQuotes.process_task',
+                  exch + ' ' + date.strftime('%Y-%m-%d')):
+            for f in fn:
+                # The file is validated as it is read. If it is corrupted,
+                # what was written from it is removed.
+                mark = sink.mark()
+                try:
+                    # Lines of RICs outside the sample are dropped before
+                    # parsing.
+                    for chunk in read_verified_csv(mdir + f, manifest,
+                                                   rics=earnings,
+                                                   chunksize='auto',
+                                                   usecols=quote_cols,
+                                                   dtype=dtypes):
+                        with phase('filter_quotes', chunk) as p:
+                            df_quotes = chunk[chunk.Type=='Quote'].copy()
+                            del df_quotes['Type']
+                            sel = df_quotes['#RIC'].isin(earnings)
+                            p.done(sum(sel))
+                        if sum(sel) > 0:
+                            sink.append(df_quotes[sel])
+                except ChecksumError:
+                    sink.rollback(mark)
+                    sys.stderr.write('Wrong checksum for ' + f + '\n')
             
-            for chunk in pd.read_csv(mdir + f, chunksize=1000000, usecols=quote_cols,
-                                     dtype=dtypes):
-                df_quotes = chunk[chunk.Type=='Quote'].copy()
-                del df_quotes['Type']
-                sel = df_quotes['#RIC'].isin(earnings)
-                if sum(sel) > 0:
-                    df_quotes = df_quotes[sel]
-                    if dt_first:
-                        dt_first = False
-                        df_quotes.to_csv(out_fn, header=True,
-                                         index=False, mode='w')
-                    else:
-                        df_quotes.to_csv(out_fn, header=False,
-                                         index=False, mode='a')
-        
-        if os.path.isfile(out_fn):
-            with open(out_fn, 'r') as f_in, gzip.open(out_fn + '.gz', 'wb') as f_out:
-                shutil.copyfileobj(f_in, f_out)
-            os.remove(out_fn)
-    
+            # Compaction, sorting and writing of RIC-sorted files
+            with phase('write_day'):
+                sink.close()
+
+
+# Input and output files of process_task, for the pipeline runner.
+def task_files(exch, y, m):
+    mdir = 'Y:\\' + exch + '\\TAS\\' + str(y) + '\\' + str(m).zfill(2) + '\\'
+    ls = [fn for fn in listdir(mdir)
+          if fn[15:23] == 'TAS-Data' and fn.endswith('.gz')]
+    dates = sorted(set(datetime.strptime(fn[4:14], '%Y-%m-%d') for fn in ls))
+    out_fns = [outdir + exch + '\\' + str(y) + '\\' + exch + '-Quotes-' +
+               date.strftime('%Y-%m-%d') + '.csv' for date in dates]
+    return [mdir + fn for fn in sorted(ls)], out_fns
+
 
+# Runs all the tasks found in the input directory on a pool of processes.
+if __name__ == '__main__':
+    run_tasks(process_task, month_tasks('Y:\\'))
@@ -13,107 +13,79 @@ import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta, time
 import os
+import sys
 
-from pandas.tseries.holiday import USFederalHolidayCalendar
-from pandas.tseries.offsets import CustomBusinessDay
-
-us_bd = CustomBusinessDay(calendar=USFederalHolidayCalendar())
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', 'Common'))
+from TickFiles import find_ticks
+from AsofSampler import sample_asof, sample_panel
+from TradingCalendar import event_open
+from TradeSigning import read_quotes
+from Metrics import recorded, phase
 
 quotes_dir = 'M:\\vgregoire\\TRTH_Quotes_AroundEarnings\\'
 outdir = 'M:\\vgregoire\\TRTH_Quotes_AroundEarnings_Resample\\'
 
+id_cols = ['PERMNO', 'EA_Time', 'EA_Timestamp', '#RIC', 'Exchange']
+quote_cols = ['Bid Price', 'Bid Size', 'Ask Price', 'Ask Size']
 
-def process_task(permno, date, ea_ts, ric, exch):
+# We want to get quote observations for each seconds in the first
+# 5 minutes following the announcement, and for each minute
+# in the 2 hours follwing the announcements, and the same at the opening of
+# markets. Grids are (step, first step, last step) around the announcement
+# (ann) or the open (opn), in the order of the outputs of process_task.
+grid_names = ['ann_1s', 'ann_1m', 'opn_1s', 'opn_1m']
+grid_steps = [(timedelta(seconds=1), -60 * 5, 60 * 5),
+              (timedelta(minutes=1), -5, 60 * 2),
+              (timedelta(seconds=1), -60 * 5, 60 * 5),
+              (timedelta(minutes=1), -5, 60 * 2)]
+
+
+# Reads the quotes of one event within extended trading hours, sorted by
+# time, with missing bid and ask prices for empty sides. Returns None if
+# there is no quote file.
+def read_event_quotes(permno, date, ea_ts, ric, exch):
     
     datestr = date.strftime('%Y-%m-%d')
     fn_quotes = (quotes_dir + exch + '/' + str(date.year) + '/' + exch +
-             '-QuotesAroundEvent-' + datestr + '_' + str(permno) + '.csv.gz')    
+             '-QuotesAroundEvent-' + datestr + '_' + str(permno) + '.csv')
     
-    if not os.path.isfile(fn_quotes):
+    if find_ticks(fn_quotes) is None:
         print('Missing file:' + fn_quotes)
-        return None, None, None, None
-    df_quotes = pd.read_csv(fn_quotes)
- 
-    no_bid = ((df_quotes['Bid Size'] == 0.0) |
-              (df_quotes['Bid Price'] == 0.0) |
-              (df_quotes['NoQuote'] == 1))
-    df_quotes.loc[no_bid, 'Bid Price'] = np.nan
-    no_ask = ((df_quotes['Ask Size'] == 0.0) |
-              (df_quotes['Ask Price'] == 0.0) |
-              (df_quotes['NoQuote'] == 1))
-    df_quotes.loc[no_ask, 'Ask Price'] = np.nan
-    
-    df_quotes['Timestamp'] = pd.to_datetime(df_quotes['Date'] + ' ' +
-                                            df_quotes['Time'])   
-    
-    
-    # Quote that have timestamps outside of extended trading hours may get
-    # misclassified, we drop those.
-    sel = ((df_quotes.Time >= '04:00:00.00000') &
-           (df_quotes.Time <= '20:00:00.00000'))
-    
-    df_quotes = df_quotes[sel]
-    
-    # We want to get quote observations for each seconds in the first
-    # 5 minutes following the announcement, and for each minute
-    # in the 2 hours follwing the announcements.
-    
-    # First, create dataframse to merge on.
-    ts_ann_1s = pd.DataFrame([[ea_ts + x * timedelta(seconds=1)
-                           for x in range(-60 * 5, 60 * 5 + 1)],
-                          range(-60 * 5, 60 * 5 + 1)]).T
-    ts_ann_1s.columns = ['Timestamp', 'SecondsAfter']
-    ts_ann_1s['Timestamp'] = pd.to_datetime(ts_ann_1s['Timestamp'])
-    
-    
-    ts_ann_1m = pd.DataFrame([[ea_ts + x * timedelta(minutes=1)
-                           for x in range(-5, 60 * 2 + 1)],
-                          range(-5, 60 * 2 + 1)]).T
-    ts_ann_1m.columns = ['Timestamp', 'MinutesAfter']
-    ts_ann_1m['Timestamp'] = pd.to_datetime(ts_ann_1m['Timestamp'])
-    
-    
-    
-    # We also want at the opening of markets
-    open_ts = date + timedelta(hours=9, minutes=30)
-    # Shift by one day if necessary
-    if ea_ts.time() > time(12):
-        open_ts = open_ts + us_bd
-    
-    
-    ts_opn_1s = pd.DataFrame([[open_ts + x * timedelta(seconds=1)
-                           for x in range(-60 * 5, 60 * 5 + 1)],
-                          range(-60 * 5, 60 * 5 + 1)]).T
-    ts_opn_1s.columns = ['Timestamp', 'SecondsAfter']
-    ts_opn_1s['Timestamp'] = pd.to_datetime(ts_opn_1s['Timestamp'])
-    
-    
-    ts_opn_1m = pd.DataFrame([[open_ts + x * timedelta(minutes=1)
-                           for x in range(-5, 60 * 2 + 1)],
-                          range(-5, 60 * 2 + 1)]).T
-    ts_opn_1m.columns = ['Timestamp', 'MinutesAfter']
-    ts_opn_1m['Timestamp'] = pd.to_datetime(ts_opn_1m['Timestamp'])
-    
-    
-    # Now merge asof to get the valid quotes at each point in time.
-    df_quotes = df_quotes[['Timestamp', 'Bid Price', 'Bid Size',
-                           'Ask Price', 'Ask Size']]
+        return None
+    df_quotes = read_quotes(fn_quotes)
     
+    return df_quotes.sort_values('Timestamp', kind='mergesort')
+
+
+# Event-time grids of an event: (anchor, step, first step, last step).
+def event_grids(date, ea_ts):
     
-    df_quotes = df_quotes.sort_values('Timestamp')
+    # We also want at the opening of markets (the next day for events after
+    # noon)
+    open_ts = event_open(date, ea_ts)
     
+    anchors = [ea_ts, ea_ts, open_ts, open_ts]
+    return [(anchor,) + steps for anchor, steps in zip(anchors, grid_steps)]
+
+
+def process_task(permno, date, ea_ts, ric, exch):
     
-    merge_ann_1s = pd.merge_asof(ts_ann_1s, df_quotes,
-                                 on='Timestamp')
+    df_quotes = read_event_quotes(permno, date, ea_ts, ric, exch)
+    if df_quotes is None:
+        return None, None, None, None
     
-    merge_ann_1m = pd.merge_asof(ts_ann_1m, df_quotes,
-                                 on='Timestamp')
+    grids = event_grids(date, ea_ts)
     
-    merge_opn_1s = pd.merge_asof(ts_opn_1s, df_quotes,
-                                 on='Timestamp')
+    # Now sample the valid quotes at each point in time of all the grids at
+    # once (as of each time, as with merge_asof).
+    merge_ann_1s, merge_ann_1m, merge_opn_1s, merge_opn_1m = \
+        sample_asof(df_quotes, grids, quote_cols)
     
-    merge_opn_1m = pd.merge_asof(ts_opn_1m, df_quotes,
-                                 on='Timestamp')
+    merge_ann_1s = merge_ann_1s.rename(columns={'Offset': 'SecondsAfter'})
+    merge_ann_1m = merge_ann_1m.rename(columns={'Offset': 'MinutesAfter'})
+    merge_opn_1s = merge_opn_1s.rename(columns={'Offset': 'SecondsAfter'})
+    merge_opn_1m = merge_opn_1m.rename(columns={'Offset': 'MinutesAfter'})
     
     for x in [merge_ann_1s, merge_ann_1m, merge_opn_1s, merge_opn_1m]:
         x['PERMNO'] = permno
@@ -122,12 +94,50 @@ def process_task(permno, date, ea_ts, ric, exch):
         x['#RIC'] = ric
         x['Exchange'] = exch
     
-    id_cols = ['PERMNO', 'EA_Time', 'EA_Timestamp', '#RIC', 'Exchange']
-    quote_cols = ['Bid Price', 'Bid Size', 'Ask Price', 'Ask Size']
-    
     merge_ann_1s = merge_ann_1s[id_cols + ['SecondsAfter'] + quote_cols]
     merge_ann_1m = merge_ann_1m[id_cols + ['MinutesAfter'] + quote_cols]
     merge_opn_1s = merge_opn_1s[id_cols + ['SecondsAfter'] + quote_cols]
     merge_opn_1m = merge_opn_1m[id_cols + ['MinutesAfter'] + quote_cols]
     
     return merge_ann_1s, merge_ann_1m, merge_opn_1s, merge_opn_1m
+
+
+# Same as process_task for a list of events (permno, date, ea_ts, ric, exch),
+# resampled together into one panel per grid. Returns the table of the events
+# with a quote file, and for each grid (in the order of grid_names) the
+# offsets of the panel and the (event x offset x field) array of the quote
+# columns. If fname is given, the arrays are memory-mapped .npy files named
+# fname + '_' + grid name + '.npy'.
+@recorded
+def process_events(events, fname=None):
+    ids = []
+    dfs = []
+    anchors = [[] for x in grid_names]
+    for permno, date, ea_ts, ric, exch in events:
+        df_quotes = read_event_quotes(permno, date, ea_ts, ric, exch)
+        if df_quotes is None:
+            continue
+        df_quotes = df_quotes[['Timestamp'] + quote_cols].copy()
+        df_quotes['Event'] = len(ids)
+        dfs.append(df_quotes)
+        ids.append((permno, date, ea_ts, ric, exch))
+        for i, grid in enumerate(event_grids(date, ea_ts)):
+            anchors[i].append(grid[0])
+
+    ids = pd.DataFrame(ids, columns=id_cols)
+    if len(dfs) > 0:
+        df_quotes = pd.concat(dfs, ignore_index=True)
+    else:
+        df_quotes = pd.DataFrame(dict([('Timestamp', pd.to_datetime([])),
+                                       ('Event', [])] +
+                                      [(c, []) for c in quote_cols]))
+
+    # All events have the same grids, except for their anchor.
+    panels = []
+    with phase('sample', df_quotes):
+        for i, (step, first, last) in enumerate(grid_steps):
+            panels.append(sample_panel(
+                df_quotes, anchors[i], step, first, last, quote_cols,
+                fname=None if fname is None else
+                fname + '_' + grid_names[i] + '.npy'))
+    return ids, panels
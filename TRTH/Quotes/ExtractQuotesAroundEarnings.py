@@ -13,139 +13,73 @@ import os
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
-import gzip
-import shutil
+import sys
 
-from pandas.tseries.holiday import USFederalHolidayCalendar
-from pandas.tseries.offsets import CustomBusinessDay
-
-us_bd = CustomBusinessDay(calendar=USFederalHolidayCalendar())
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', 'Common'))
+from Qualifiers import quote_qualifiers
+from TickFiles import find_ticks, read_ticks, write_ticks, open_sink
+from EventBatch import process_batch
+from TimeParsing import (quote_times, quote_timestamps, to_datetime64,
+                         to_timedelta64)
+from QuoteRuns import compact_event_quotes, count_col, last_col
+from TradingCalendar import event_windows, is_trading_day
+from Metrics import phase
 
 
 basedir = 'M:\\vgregoire\\TRTH_Quotes\\'
 outdir = 'M:\\vgregoire\\TRTH_Quotes_AroundEarnings\\'
 
+# Format of the output files ('csv', or 'parquet' for typed columnar files),
+# their compression ('gzip', or 'zstd' and 'lz4' for faster intermediate
+# files) and number of compression threads (csv files only).
+out_format = 'csv'
+out_codec = 'gzip'
+out_threads = 1
 
-#%% Utility functions for parsing timestamps and dates quickly
-def parse_exch_time(x):
-    if type(x) != str:
-        return x
-    return timedelta(hours=int(x[0:2]),
-                     minutes=int(x[3:5]),
-                     seconds=int(x[6:8]),
-                     milliseconds=int(x[9:13]))
-
-
-def parse_simple_date(d):
-    return datetime.strptime(d, '%d-%b-%Y')
+# Collapse the consecutive quotes with the same book state (prices, sizes
+# and qualifier flags) into one row, with the number of quotes in Count and
+# the time of the last one in LastTimestamp (see Common/QuoteRuns.py). The
+# Count and LastTimestamp of compacted daily files are always kept.
+compact = False
 
 
-def fast_date_parse(df, col, date_parser=parse_simple_date):
-    dt = pd.DataFrame(df[col].unique())
-    dt.columns = [col + '_tmp']
-    dt[col] = dt[col + '_tmp'].apply(date_parser)
-    date_dict = dt.set_index(col + '_tmp').to_dict()
-    df[col] = df[col].map(date_dict[col])
-    return df
-
-
-#%% Functions for parsing quote qualifiers
-    
-def qualif_is_regular_quote(x):
-    for c in [a.strip() for a in x.split(';')]:
-        if c.endswith('[PRC_QL_CD]'):
-            if 'R' == c[:-11].strip():
-                return True
-        elif c.endswith('[PRC_QL3]'):
-            if 'R' == c[:-9].strip():
-                return True
-    return False
-
-def qualif_is_no_quote(x):
-    for c in [a.strip() for a in x.split(';')]:
-        if c.endswith('[PRC_QL_CD]'):
-            if 'NQ' == c[:-11].strip():
-                return True
-        elif c.endswith('[PRC_QL3]'):
-            if 'NQ' == c[:-9].strip():
-                return True
-    return False
-
-def qualif_is_opening_quote(x):
-    for c in [a.strip() for a in x.split(';')]:
-        if c.endswith('[PRC_QL_CD]'):
-            if 'OQ' == c[:-11].strip():
-                return True
-        elif c.endswith('[PRC_QL3]'):
-            if 'OQ' == c[:-9].strip():
-                return True
-    return False
-
-def qualif_is_closing_quote(x):
-    for c in [a.strip() for a in x.split(';')]:
-        if c.endswith('[PRC_QL_CD]'):
-            if 'CQ' == c[:-11].strip():
-                return True
-        elif c.endswith('[PRC_QL3]'):
-            if 'CQ' == c[:-9].strip():
-                return True
-    return False
-
-
-
-# Classifies the quotes in the given dataframe.
-def clean_chunk(df):
-    df['TS'] = df['Quote Time']
-    sel = df['Quote Time'].isnull()
-    df.loc[sel, 'TS'] = df.loc[sel, 'Time[G]']
-    
+# Classifies the quotes in the given dataframe. With timestamp, the output
+# also has the Timestamp column (Date + Time), used by parquet outputs.
+def clean_chunk(df, timestamp=False):
     # As opposed to trades, we have only one "date" field, which corresponds
     # to the TRTH timestamp. We need to make sure we align all those timestamps
-    # cleanly and get the proper date while using the Quote Time.
-    df = fast_date_parse(df, 'TS', date_parser=parse_exch_time)
-    df = fast_date_parse(df, 'Time[G]', date_parser=parse_exch_time)
-    df = fast_date_parse(df, 'Date[G]')
-    
-    df['TimeDiff'] = df['Time[G]'] - df['TS']
-    
-    # In case there is a shift of day at the right instant
-    # (Time[G] would be much larger, close to midnight, while TS would be
-    #  close to 0.)
-    # It is unlikely, but also posisble that the same would occur.
-    sel = df['TimeDiff'] > timedelta(hours=23)
-    df.loc[sel, 'TimeDiff'] = df.loc[sel, 'TimeDiff'] - timedelta(hours=24)
-    sel = df['TimeDiff'] < timedelta(hours=-23)
-    df.loc[sel, 'TimeDiff'] = df.loc[sel, 'TimeDiff'] + timedelta(hours=24)
-    
-    df['QuoteTime'] = (df['Date[G]'] + df['Time[G]'] - df['TimeDiff']  +
-                       df['GMT Offset'] * timedelta(hours=1))
+    # cleanly and get the proper date while using the Quote Time (or the TRTH
+    # time when it is missing), including a shift of day at the right instant.
+    with phase('quote_times', df):
+        time_g, date_g, quote_time = quote_times(df['Quote Time'],
+                                                 df['Time[G]'], df['Date[G]'],
+                                                 df['GMT Offset'])
+        df['Time[G]'] = to_timedelta64(time_g)
+        df['Date[G]'] = to_datetime64(date_g)
+        df['QuoteTime'] = to_datetime64(quote_time)
     
     df.loc[df['Qualifiers'].isnull(), 'Qualifiers'] = ''
     
-    quals = pd.DataFrame(df['Qualifiers'].unique())
-    quals.columns = ['quals']
-    
-    quals_list = [('Regular', qualif_is_regular_quote),
-                  ('Opening', qualif_is_opening_quote),
-                  ('Closing', qualif_is_closing_quote),
-                  ('NoQuote', qualif_is_no_quote)]
-    
-    for label, fct in quals_list:
-        quals[label] = quals['quals'].apply(fct) * 1
-    
-    quals_dict = quals.set_index('quals').to_dict()
-    
-    for label, fct in quals_list:
-        df[label] = df['Qualifiers'].map(quals_dict[label])
+    # Decode all qualifiers at once into a bitmask, then unpack the flags.
+    with phase('qualifiers', df):
+        qual_bits = quote_qualifiers.decode_series(df['Qualifiers'])
+        df = quote_qualifiers.unpack(qual_bits, df)
     
     # Columns we want to keep in output
     outcols = ['#RIC', 'Date', 'Time', u'Ex/Cntrb.ID', u'Price', u'Volume',
-               u'Market VWAP'] + [x[0] for x in quals_list]
+               u'Market VWAP'] + quote_qualifiers.flags
     
 
     # Columns we want to keep in output
     outcols = ['#RIC', 'Date', 'Time', u'Bid Price', u'Bid Size', u'Ask Price',
-               u'Ask Size'] + [x[0] for x in quals_list]
+               u'Ask Size'] + quote_qualifiers.flags
+    if count_col in df.columns:
+        df[last_col] = pd.to_datetime(df[last_col])
+        outcols += [count_col, last_col]
+    if timestamp:
+        outcols.insert(3, 'Timestamp')
+        df['Timestamp'] = to_datetime64(quote_timestamps(date_g, quote_time))
     
     
     if len(df) < 1:
@@ -155,8 +89,9 @@ def clean_chunk(df):
         return df[outcols].copy()
   
     
-    df['Date'] = pd.to_datetime(df['Date[G]'].dt.date)
-    df['Time'] = df['QuoteTime'].dt.time
+    with phase('time_of_day', df):
+        df['Date'] = df['Date[G]']
+        df['Time'] = df['QuoteTime'].dt.time
     
     return df[outcols].copy()
 
@@ -168,37 +103,92 @@ The summary of the procedure is as follow:
     - The output is one file per event. (permno date)
 
 """
-def process_task(task):
-    permno, date1, date2, ric, exch = task
-    
-    date_start = min(date1, date2) - us_bd
-    date_end = max(date1, date2) + 2*us_bd
-    dr = pd.date_range(date_start, date_end)
-    
-    dfs = []
-    for date in dr:
-        y = date.year
-        m = date.month
-        d = date.day
-        datestr = str(y) + '-' + str(m).zfill(2) + '-' + str(d).zfill(2)
-        
-        fn = (basedir + exch + '\\' + str(y) + '\\' + exch +
-              '-Quotes-' + datestr + '.csv.gz')
-        
-        
-        if os.path.isfile(fn):
-            for chunk in pd.read_csv(fn, chunksize=1000000):
-                chunk = chunk[chunk['#RIC'] == ric].copy()
-                chunk = clean_chunk(chunk)
-                dfs.append(chunk)
+# First and last days of the event windows (of one event, or of arrays of
+# events): one day before to two days after, in trading days.
+def window_bounds(date1, date2):
+    return event_windows(date1, date2, 1, 2)
+
+
+# Days of the event window.
+def event_dates(date1, date2):
+    date_start, date_end = window_bounds(date1, date2)
+    return pd.date_range(date_start, date_end)
+
+
+def daily_fn(exch, date):
+    datestr = date.strftime('%Y-%m-%d')
+    return (basedir + exch + '\\' + str(date.year) + '\\' + exch +
+            '-Quotes-' + datestr + '.csv')
+
+
+# Reads the quotes of the given RIC(s) in one daily file by chunk and
+# classifies them. Returns None if there is no file, and logs it if the day
+# is a trading day.
+def read_day(exch, date, ric):
+    fn = daily_fn(exch, date)
+    if find_ticks(fn) is None:
+        # The windows span calendar days: only the missing files of
+        # trading days are reported.
+        if is_trading_day(date):
+            sys.stderr.write('Missing daily file ' + fn + '\n')
+        return None
+    return (clean_chunk(chunk, out_format == 'parquet')
+            for chunk in read_ticks(fn, chunksize='auto', ric=ric))
+
+
+def event_fn(permno, date1, exch):
+    datestr = date1.strftime('%Y-%m-%d')
+    return (outdir + exch + '\\' + str(date1.year) + '\\' + exch +
+            '-QuotesAroundEvent-' + datestr + '_' + str(permno) + '.csv')
+
+
+def write_event(permno, date1, exch, dfs):
     if len(dfs) == 0:
         return
     df = pd.concat(dfs)
-    datestr = date1.strftime('%Y-%m-%d')
-    outfn = (outdir + exch + '\\' + str(date1.year) + '\\' + exch +
-             '-QuotesAroundEvent-' + datestr + '_' + str(permno) + '.csv')
+    if compact:
+        df = compact_event_quotes(df)
+    outfn = event_fn(permno, date1, exch)
+    
+    write_ticks(df, outfn, out_format, out_codec, out_threads,
+                quote_qualifiers)
+
+
+# Without compaction, the quotes are written as they are read, day by day.
+def process_task(task):
+    permno, date1, date2, ric, exch = task
     
-    df.to_csv(outfn, index=False)
-    with open(outfn, 'r') as f_in, gzip.open(outfn + '.gz', 'wb') as f_out:
-        shutil.copyfileobj(f_in, f_out)
-    os.remove(outfn)
+    if compact:
+        dfs = []
+        for date in event_dates(date1, date2):
+            chunks = read_day(exch, date, ric)
+            if chunks is not None:
+                dfs.extend(chunks)
+        write_event(permno, date1, exch, dfs)
+        return
+
+    with open_sink(event_fn(permno, date1, exch), out_format, out_codec,
+                   out_threads, quote_qualifiers) as sink:
+        for date in event_dates(date1, date2):
+            chunks = read_day(exch, date, ric)
+            if chunks is not None:
+                for chunk in chunks:
+                    sink.append(chunk)
+
+
+# Input and output files of process_task, for the pipeline runner.
+def task_files(task):
+    permno, date1, date2, ric, exch = task
+    return ([daily_fn(exch, date) for date in event_dates(date1, date2)],
+            [event_fn(permno, date1, exch)])
+
+
+# Same as process_task for a list of tasks, reading each daily file once for
+# all the events that need it.
+def process_tasks(tasks):
+
+    def write(task, dfs):
+        permno, date1, date2, ric, exch = task
+        write_event(permno, date1, exch, dfs)
+
+    process_batch(tasks, window_bounds, read_day, write)
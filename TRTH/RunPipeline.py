@@ -0,0 +1,97 @@
+"""
+Code for "How Is Earnings News Transmitted to Stock Prices?" by
+Vincent Grégoire and Charles Martineau.
+
+Python 2 and 3
+
+Runs the TRTH processing stages in order, only running again the tasks whose
+input files or code changed since the last run (see Common/Pipeline.py). The
+daily stages are ExtractTrades, ClassifyTrades and AlignDates for trades, and
+ExtractQuotes for quotes. The extraction of trades and quotes around events,
+and the spreads of the trades around events, are added when a list of events
+(permno, date1, date2, ric, exch) is given, from the csv file of events given
+with --events (columns PERMNO, EA_Time, EA_Timestamp, #RIC and Exchange).
+"""
+
+import argparse
+import os
+import sys
+
+import pandas as pd
+
+_root = os.path.dirname(os.path.abspath(__file__))
+for d in ['Common', 'Trades', 'Quotes', 'TAS']:
+    sys.path.append(os.path.join(_root, d))
+
+import ExtractTrades
+import ClassifyTrades
+import AlignDates
+import ExtractTradesAroundEarnings
+import ExtractQuotes
+import ExtractQuotesAroundEarnings
+import ExtractSpreadsAroundEarnings
+from Scheduler import month_tasks, day_tasks, event_tasks
+from Pipeline import Stage, code_files, run_pipeline
+
+
+raw_dir = 'Y:\\'
+
+# Tasks done and content hashes of the files
+state_fn = 'M:\\vgregoire\\TRTH_Pipeline_State.json'
+manifest_fn = 'M:\\vgregoire\\TRTH_Pipeline_Manifest.csv'
+
+
+def make_stages(events=None):
+    stages = [
+        Stage('ExtractTrades', ExtractTrades.process_task,
+              lambda: month_tasks(raw_dir),
+              ExtractTrades.task_files, code_files(ExtractTrades)),
+        Stage('ClassifyTrades', ClassifyTrades.process_classify,
+              lambda: day_tasks(ClassifyTrades.basedir, 'Trades'),
+              ClassifyTrades.task_files, code_files(ClassifyTrades)),
+        Stage('AlignDates', AlignDates.process_align_dates,
+              lambda: day_tasks(AlignDates.basedir, 'TradesParsed'),
+              AlignDates.task_files, code_files(AlignDates)),
+        Stage('ExtractQuotes', ExtractQuotes.process_task,
+              lambda: month_tasks(raw_dir),
+              ExtractQuotes.task_files, code_files(ExtractQuotes))]
+
+    if events is not None:
+        stages += [
+            Stage('ExtractTradesAroundEarnings',
+                  ExtractTradesAroundEarnings.process_event,
+                  lambda: event_tasks(events),
+                  ExtractTradesAroundEarnings.task_files,
+                  code_files(ExtractTradesAroundEarnings)),
+            Stage('ExtractQuotesAroundEarnings',
+                  ExtractQuotesAroundEarnings.process_task,
+                  lambda: event_tasks(events, packed=True),
+                  ExtractQuotesAroundEarnings.task_files,
+                  code_files(ExtractQuotesAroundEarnings)),
+            Stage('ExtractSpreadsAroundEarnings',
+                  ExtractSpreadsAroundEarnings.process_event,
+                  lambda: event_tasks(events),
+                  ExtractSpreadsAroundEarnings.task_files,
+                  code_files(ExtractSpreadsAroundEarnings))]
+    return stages
+
+
+# Events (permno, date1, date2, ric, exch) of a csv file of events.
+def read_events(fname):
+    events = pd.read_csv(fname, parse_dates=['EA_Time', 'EA_Timestamp'])
+    return [(row.PERMNO, row.EA_Time.to_pydatetime(),
+             row.EA_Timestamp.to_pydatetime(), row[3], row.Exchange)
+            for row in events[['PERMNO', 'EA_Time', 'EA_Timestamp', '#RIC',
+                               'Exchange']].itertuples(index=False)]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Runs the TRTH processing '
+                                     'stages that are not up to date.')
+    parser.add_argument('--events',
+                        help='csv file of the events of the event stages')
+    args = parser.parse_args()
+
+    events = read_events(args.events) if args.events else None
+    failed = run_pipeline(make_stages(events), state_fn, manifest_fn)
+    sys.exit(1 if failed else 0)
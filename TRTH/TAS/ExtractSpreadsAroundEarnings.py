@@ -0,0 +1,75 @@
+"""
+Code for "How Is Earnings News Transmitted to Stock Prices?" by
+Vincent Grégoire and Charles Martineau.
+
+Python 2
+
+The main function reads the trades and the quotes extracted around one
+event (by ExtractTradesAroundEarnings.py and ExtractQuotesAroundEarnings.py),
+joins each trade to the NBBO quote prevailing at its time, signs the trades
+and computes their effective and realized spreads and price impact (see
+Common/TradeSigning.py). The output is one file per event.
+"""
+
+from datetime import timedelta
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', 'Common'))
+from TickFiles import find_ticks, read_ticks, write_ticks
+from TradeSigning import read_quotes, trade_spreads
+
+
+trades_dir = 'M:\\vgregoire\\TRTH_Trades_AroundEarnings\\'
+quotes_dir = 'M:\\vgregoire\\TRTH_Quotes_AroundEarnings\\'
+outdir = 'M:\\vgregoire\\TRTH_Spreads_AroundEarnings\\'
+
+# Format of the output files ('csv', or 'parquet' for typed columnar files),
+# their compression ('gzip', or 'zstd' and 'lz4' for faster intermediate
+# files) and number of compression threads (csv files only).
+out_format = 'csv'
+out_codec = 'gzip'
+out_threads = 1
+
+# Trades are matched to the last quote before the trade time minus the lag.
+quote_lag = timedelta(0)
+# Horizon of the realized spread and price impact
+horizon = timedelta(minutes=5)
+# 'lee_ready', or 'tick' for the tick test alone
+sign_method = 'lee_ready'
+
+trade_cols = ['#RIC', 'Timestamp', 'Ex/Cntrb.ID', 'Price', 'Volume',
+              'FormT', 'Sweep', 'OddLot']
+
+outcols = trade_cols + ['Bid Price', 'Ask Price', 'Midpoint', 'Sign',
+                        'QuotedSpread', 'EffSpread', 'RealSpread',
+                        'PriceImpact', 'QuotedSpreadPct', 'EffSpreadPct',
+                        'RealSpreadPct', 'PriceImpactPct']
+
+
+def event_fn(basedir, kind, permno, date1, exch):
+    datestr = date1.strftime('%Y-%m-%d')
+    return (basedir + exch + '\\' + str(date1.year) + '\\' + exch + '-' +
+            kind + 'AroundEvent-' + datestr + '_' + str(permno) + '.csv')
+
+
+def process_event(permno, date1, date2, ric, exch):
+    fn_trades = event_fn(trades_dir, 'Trades', permno, date1, exch)
+    fn_quotes = event_fn(quotes_dir, 'Quotes', permno, date1, exch)
+    if find_ticks(fn_trades) is None or find_ticks(fn_quotes) is None:
+        return None
+
+    df_trades = read_ticks(fn_trades, columns=trade_cols)
+    df_quotes = read_quotes(fn_quotes, ['#RIC', 'Timestamp'])
+
+    df = trade_spreads(df_trades, df_quotes, quote_lag, horizon, sign_method)
+    write_ticks(df[outcols], event_fn(outdir, 'Spreads', permno, date1, exch),
+                out_format, out_codec, out_threads)
+
+
+# Input and output files of process_event, for the pipeline runner.
+def task_files(permno, date1, date2, ric, exch):
+    return ([event_fn(trades_dir, 'Trades', permno, date1, exch),
+             event_fn(quotes_dir, 'Quotes', permno, date1, exch)],
+            [event_fn(outdir, 'Spreads', permno, date1, exch)])
@@ -0,0 +1,203 @@
+"""
+Code for "How Is Earnings News Transmitted to Stock Prices?" by
+Vincent Grégoire and Charles Martineau.
+
+Python 2
+
+The main function takes the TAS (Time and Sales) file for one exchange on one
+month and splits the daily files into trade files and quote files in a single
+pass. It produces the same outputs as ExtractTrades.py and ExtractQuotes.py,
+but each raw file is read from disk once, with its checksum verified as it is
+decompressed and parsed, instead of being read by both scripts. Quotes are
+filtered on RIC codes (TRTH identifiers) to keep only symbols included in the
+sample, and trades can optionally be filtered the same way. Duplicated
+trades are removed and counted as in ExtractTrades.py.
+"""
+
+from os import listdir
+import os
+import pandas as pd
+from datetime import datetime
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', 'Common'))
+from RawFiles import Manifest, ChecksumError, read_verified_csv
+from CompressedCSV import CSVSink, write_csv
+from TickFiles import open_sink
+from QuoteRuns import compact_raw_quotes
+from Scheduler import run_tasks, month_tasks
+from TradeDedup import TradeDedup, count_names
+from Metrics import task, phase, count
+
+
+trades_outdir = 'M:\\vgregoire\\TRTH_Trades\\'
+quotes_outdir = 'M:\\vgregoire\\TRTH_Quotes\\'
+
+# Raw files already verified, with their checksum
+manifest_fn = 'M:\\vgregoire\\TRTH_Raw_Manifest.csv'
+
+# Compression of the output files ('gzip', or 'zstd' and 'lz4' for faster
+# intermediate files) and number of compression threads (csv files only).
+# Quote files can also be written as parquet files (typed columnar files).
+quotes_format = 'csv'
+out_codec = 'gzip'
+out_threads = 1
+
+# Write the daily quote files sorted by RIC, with a RIC index for fast
+# extraction of single stocks. The quotes of a day are sorted with an
+# external sort within the memory budget of the worker (see
+# Common/ExternalSort.py).
+ric_sorted = True
+
+# Collapse the consecutive quotes of a RIC with the same book state into one
+# row, as in ExtractQuotes.py.
+compact = False
+
+# Remove the duplicated trades of each date, as in ExtractTrades.py (see
+# Common/TradeDedup.py).
+dedup = True
+
+earnings_fn = '../data/Earnings_Announcements_MergedTRTH_2011_2015.csv'
+
+# Chunks of the input files sized to the memory of the worker (see
+# Common/Chunks.py), or a number of rows.
+chunk_size = 'auto'
+
+# Columns kept in each output (same as ExtractTrades.py and ExtractQuotes.py)
+trade_cols = ['#RIC', 'Date[G]', 'Time[G]', 'GMT Offset',
+              'Ex/Cntrb.ID', 'Price', 'Volume', 'Market VWAP',
+              'Qualifiers', 'Seq. No.', 'Exch Time',
+              'Trd/Qte Date']
+
+quote_cols = ['#RIC', 'Date[G]', 'Time[G]', 'GMT Offset',
+              'Buyer ID', 'Bid Price', 'Bid Size',
+              'Seller ID', 'Ask Price', 'Ask Size',
+              'Qualifiers', 'Quote Time']
+
+tas_cols = ['Type'] + trade_cols + [c for c in quote_cols
+                                    if c not in trade_cols]
+
+str_cols = ['Ex/Cntrb.ID', 'Exch Time', 'Trd/Qte Date', 'Quote Time']
+dtypes = {x: object for x in str_cols}
+
+
+# RIC list of the sample, loaded once per process.
+_universe = None
+
+
+def load_universe():
+    global _universe
+    if _universe is None:
+        earnings = pd.read_csv(earnings_fn, usecols=['#RIC'])
+        _universe = earnings['#RIC'].unique()
+    return _universe
+
+
+# This function takes the TAS (Time and Sales) file for one exchange on one
+# month and routes the rows of each daily file to a trade file and a quote
+# file, according to their Type.
+def process_task(exch, y, m, filter_trades=False):
+
+    earnings = load_universe()
+    manifest = Manifest(manifest_fn)
+
+    mdir = 'Y:\\' + exch + '\\TAS\\' + str(y) + '\\' + str(m).zfill(2) + '\\'
+
+    # List dates in the monthly directory
+    ls = listdir(mdir)
+
+    ls = [fn for fn in ls if fn[15:23] == 'TAS-Data' and fn.endswith('.gz')]
+
+    # Get all files related to each specific date.
+    dates_fn = {datetime.strptime(x[4:14], '%Y-%m-%d'):[] for x in ls}
+    for fn in ls:
+        dates_fn[datetime.strptime(fn[4:14], '%Y-%m-%d')].append(fn)
+
+    # Counts of the duplicated and amended trades of each date
+    summary = []
+
+    # Process all dates
+    for date in dates_fn:
+        fn = dates_fn[date]
+
+        trades_fn = (trades_outdir + exch + '\\' + str(y) + '\\' + exch +
+                     '-Trades-' + date.strftime('%Y-%m-%d') + '.csv')
+        quotes_fn = (quotes_outdir + exch + '\\' + str(y) + '\\' + exch +
+                     '-Quotes-' + date.strftime('%Y-%m-%d') + '.csv')
+
+        # The quote file is only created if there are quotes to write.
+        trades_sink = CSVSink(trades_fn, out_codec, out_threads)
+        quotes_sink = open_sink(quotes_fn, quotes_format, out_codec,
+                                out_threads, ric_sorted=ric_sorted or compact,
+                                prepare=compact_raw_quotes if compact else None)
+        deduper = TradeDedup()
+
+        # Each day is recorded in the metrics log, if it is enabled.
+        with task('ExtractTradesAndQuotes.process_task',
+                  exch + ' ' + date.strftime('%Y-%m-%d')):
+            for f in fn:
+                # The file is validated as it is read. If it is corrupted,
+                # what was written from it is removed.
+                marks = (trades_sink.mark(), quotes_sink.mark(),
+                         deduper.mark())
+                try:
+                    # Read the file once by chunk, sending each row to its
+                    # output.
+                    for chunk in read_verified_csv(mdir + f, manifest,
+                                                   chunksize=chunk_size,
+                                                   usecols=tas_cols,
+                                                   dtype=dtypes):
+                        # Keep the columns in file order, as when reading the
+                        # file with usecols in each script.
+                        t_cols = [c for c in chunk.columns if c in trade_cols]
+                        q_cols = [c for c in chunk.columns if c in quote_cols]
+
+                        with phase('split', chunk) as p:
+                            sel_trades = chunk.Type == 'Trade'
+                            if filter_trades:
+                                sel_trades = (sel_trades &
+                                              chunk['#RIC'].isin(earnings))
+                            sel_quotes = ((chunk.Type == 'Quote') &
+                                          chunk['#RIC'].isin(earnings))
+                            p.done(sel_trades.sum() + sel_quotes.sum())
+
+                        # Trades are written with the index, as in
+                        # ExtractTrades.py
+                        df_trades = chunk.loc[sel_trades, t_cols]
+                        if dedup:
+                            with phase('dedup', df_trades) as p:
+                                df_trades = deduper.filter(df_trades)
+                                p.done(df_trades)
+                        trades_sink.append(df_trades, index=True)
+
+                        if sel_quotes.any():
+                            quotes_sink.append(chunk.loc[sel_quotes, q_cols])
+                        del chunk
+                except ChecksumError:
+                    trades_sink.rollback(marks[0])
+                    quotes_sink.rollback(marks[1])
+                    deduper.rollback(marks[2])
+                    sys.stderr.write('Wrong checksum for ' + f + '\n')
+
+            trades_sink.close()
+            # Compaction, sorting and writing of RIC-sorted files
+            with phase('write_day'):
+                quotes_sink.close()
+            count('duplicate_trades', deduper.counts['Duplicates'])
+            count('amended_trades', deduper.counts['Amended'])
+
+        if dedup:
+            summary.append([date.strftime('%Y-%m-%d')] +
+                           [deduper.counts[name] for name in count_names])
+
+    if dedup:
+        write_csv(pd.DataFrame(sorted(summary),
+                               columns=['Date'] + count_names),
+                  trades_outdir + exch + '\\' + str(y) + '\\' + exch +
+                  '-TradesDedup-' + str(y) + '-' + str(m).zfill(2) + '.csv')
+
+
+# Runs all the tasks found in the input directory on a pool of processes.
+if __name__ == '__main__':
+    run_tasks(process_task, month_tasks('Y:\\'))
@@ -8,54 +8,107 @@ The main function creates proper daily trade files. The issue is that TRTH
 uses UTC days as cutoffs for daily files, so the last after-hours trades
 in the US market can appear in the next day file if they are reported late. 
 This code realigns daily files according to ET, which allows us to process 
-daily files in parallel later on.
+daily files in parallel later on. ClassifyTrades.py already routes these
+trades to a small spill file for their ET day, so each day is the parsed
+file of the day and the spill file of the next day file.
+
+The trades of each ET day are written sorted by RIC, trade time and
+sequence number, with the RIC index of the file. They are sorted with an
+external sort within a memory budget (see Common/ExternalSort.py), so a day
+is never held in memory as a whole.
 """
 
 import pandas as pd
 from datetime import datetime, timedelta
 import os
+import sys
 
-import gzip
-import shutil
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', 'Common'))
+from Qualifiers import trade_qualifiers
+from TickFiles import read_ticks, find_ticks, RICIndexWriter
+from ExternalSort import ExternalSorter
+from Scheduler import run_tasks, day_tasks
 
 
 basedir = 'M:\\vgregoire\\\\TRTH_Trades_Parsed\\'
 outdir = 'M:\\vgregoire\\TRTH_Trades_Final\\'
 
 
-chunk_size = 1000000
+# Chunks of the input files sized to the memory of the worker (see
+# Common/Chunks.py), or a number of rows.
+chunk_size = 'auto'
+
+# Format of the output files ('csv', or 'parquet' for typed columnar files),
+# their compression ('gzip', or 'zstd' and 'lz4' for faster intermediate
+# files) and number of compression threads (csv files only).
+out_format = 'csv'
+out_codec = 'gzip'
+out_threads = 1
+
+# Memory of the sort of one day, in bytes (by default, the chunk budget of
+# the worker, see Common/Chunks.py), and directory of its temporary files
+# (by default, the temporary directory of the system).
+sort_memory = None
+tmp_dir = None
 
 # Last date in sample
 last_dt = datetime(2015, 12, 31)
 
-# Creates proper daily files.
-def process_align_dates(exch, date):
-    
-    date_str = date.strftime('%Y-%m-%d')
-    
+
+# Parsed file of the day and spill file of the day in the file of the next
+# day (see ClassifyTrades.py), relative to basedir.
+def day_files(exch, date):
     post_date = date + timedelta(days=1)
-    
     fn1 = (exch + '/' + str(date.year) + '/' +  exch + '-TradesParsed-' +
            date.strftime('%Y-%m-%d') + '.csv')
+    fn2 = (exch + '/' + str(post_date.year) + '/' +  exch + '-TradesSpill-' +
+           post_date.strftime('%Y-%m-%d') + '-' + date.strftime('%Y-%m-%d') +
+           '.csv')
+    return fn1, fn2
+
+
+# Trades of the ET day date_str in the parsed file fn, by chunk.
+def day_chunks(fn, date_str):
+    for chunk in read_ticks(basedir + fn, chunksize=chunk_size):
+        yield chunk[chunk.Date == date_str]
+
+
+# Creates proper daily files.
+def process_align_dates(exch, date):
     
-    fn2 = (exch + '/' + str(post_date.year) + '/' +  exch + '-TradesParsed-' +
-           post_date.strftime('%Y-%m-%d') + '.csv')
-    
-    dfs = []
+    date_str = date.strftime('%Y-%m-%d')
     
-    for chunk in pd.read_csv(basedir + fn1 + '.gz', chunksize=chunk_size):
-        chunk = chunk[chunk.Date == date_str].copy()
-        dfs.append(chunk)
-        del chunk
+    fn1, fn2 = day_files(exch, date)
     
+    with ExternalSorter(sort_memory, tmp_dir) as sorter:
+        for chunk in day_chunks(fn1, date_str):
+            sorter.add(chunk)
+        
+        # The trades of this day reported after midnight UTC, from the file
+        # of the next day (there is no spill file if there are none).
+        if date != last_dt and find_ticks(basedir + fn2) is not None:
+            for chunk in day_chunks(fn2, date_str):
+                sorter.add(chunk)
+        
+        # Written sorted by RIC, with the RIC index of the file, so the
+        # trades of one stock can be read without reading the whole file.
+        with RICIndexWriter(outdir + fn1, out_format, out_codec, out_threads,
+                            trade_qualifiers) as writer:
+            for df in sorter.sorted_chunks():
+                writer.append(df)
+
+
+# Input and output files of process_align_dates, for the pipeline runner.
+# The trades of a day are also read from the spill file of the next day.
+def task_files(exch, date):
+    fn1, fn2 = day_files(exch, date)
+    inputs = [basedir + fn1]
     if date != last_dt:
-        for chunk in pd.read_csv(basedir + fn2 + '.gz', chunksize=chunk_size):
-            chunk = chunk[chunk.Date == date_str].copy()
-            dfs.append(chunk)
-            del chunk
-    df = pd.concat(dfs)
-    df.to_csv(outdir + fn1, index=False)
-    
-    with open(outdir + fn1, 'rb') as f_in, gzip.open(outdir + fn1 + '.gz', 'wb') as f_out:
-        shutil.copyfileobj(f_in, f_out)
-    os.remove(outdir + fn1)
+        inputs.append(basedir + fn2)
+    return inputs, [outdir + fn1]
+
+
+# Runs all the tasks found in the input directory on a pool of processes.
+if __name__ == '__main__':
+    run_tasks(process_align_dates, day_tasks(basedir, 'TradesParsed'))
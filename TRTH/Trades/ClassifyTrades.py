@@ -6,214 +6,62 @@ Python 2
 
 The main function takes the trade file for one exchange on one 
 day and extracts the timestamp and trade qualifiers.
+
+TRTH cuts the daily files at midnight UTC, so a file also holds the late
+after-hours trades of the ET day before. The trades are routed by their ET
+date as they are classified: the trades of the days before the day of the
+file go to small spill files, one per ET date, that AlignDates.py merges
+with the parsed file of that date, and the other trades to the parsed file
+of the day.
 """
 
 import pandas as pd
 from datetime import datetime, timedelta
-import locale
 import os
-import gzip
-import shutil
+import sys
+import glob
 
-locale.setlocale(locale.LC_ALL, 'us')
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', 'Common'))
+from Qualifiers import trade_qualifiers
+from CompressedCSV import read_csv, write_csv, CSVSink
+from TickFiles import open_sink
+from Scheduler import run_tasks, day_tasks
+from TimeParsing import (trade_times, floor_day, time_of_day,
+                         to_datetime64, to_timedelta64)
+from TradingCalendar import is_trading_day, session_open, session_close
+from Metrics import phase
 
-chunk_size = 1000000
+# Chunks of the input files sized to the memory of the worker (see
+# Common/Chunks.py), or a number of rows.
+chunk_size = 'auto'
 
 
 basedir = 'X:\\Data\\AfterHours\\TRTH_Trades\\'
 errordir =  'M:\\vgregoire\\TRTH_Trades_Errors\\'
 base_outdir = 'M:\\vgregoire\\TRTH_Trades_Parsed\\'
 
+# Format of the output files ('csv', or 'parquet' for typed columnar files),
+# their compression ('gzip', or 'zstd' and 'lz4' for faster intermediate
+# files) and number of compression threads (csv files only).
+out_format = 'csv'
+out_codec = 'gzip'
+out_threads = 1
+
+# Columns of the late and early trade files, written as the chunks are
+# classified: the raw fields of the trade and its parsed exchange time.
+error_cols = ['#RIC', 'Ex/Cntrb.ID', 'Date[G]', 'Time[G]', 'GMT Offset',
+              'Exch Time', 'Trd/Qte Date', 'TradeTime', 'Price', 'Volume',
+              'Qualifiers', 'Seq. No.']
+
+# Number of days before the day of the file whose trades are spilled (the
+# trades with other dates stay in the parsed file).
+spill_days = 1
+
+# Keys of the daily summary of the late and early trades
+summary_keys = ['#RIC', 'Ex/Cntrb.ID', 'Anomaly', 'Qualifiers']
 
 
-# Early close dates in the sample
-early_close = [datetime(2010, 11, 26), datetime(2011, 11, 25),
-               datetime(2012, 7, 3), datetime(2012, 11, 23),
-               datetime(2012, 12, 24),
-               datetime(2013, 7, 3), datetime(2013, 11, 29),
-               datetime(2013, 12, 24),
-               datetime(2014, 7, 3), datetime(2014, 11, 28),
-               datetime(2014, 12, 24),
-               datetime(2015, 11, 27),
-               datetime(2015, 12, 24)]
-
-
-#%% Utility functions for parsing timestamps and dates quickly
-def parse_exch_time(x):
-    if type(x) != str:
-        return x
-    return timedelta(hours=int(x[0:2]),
-                     minutes=int(x[3:5]),
-                     seconds=int(x[6:8]),
-                     milliseconds=int(x[9:13]))
-
-
-def parse_simple_date(d):
-    return datetime.strptime(d, '%d-%b-%Y')
-
-
-def fast_date_parse(df, col, date_parser=parse_simple_date):
-    dt = pd.DataFrame(df[col].unique())
-    dt.columns = [col + '_tmp']
-    dt[col] = dt[col + '_tmp'].apply(date_parser)
-    date_dict = dt.set_index(col + '_tmp').to_dict()
-    df[col] = df[col].map(date_dict[col])
-    return df
-
-#%% Functions for parsing trade qualifiers
-
-def qualif_is_form_t(x):
-    for c in [a.strip() for a in x.split(';')]:
-        if c.endswith('_TEXT]'):
-            if 'T' in c[:-10]:
-                return True
-        elif c.endswith('[LSTSALCOND]'):
-            if 'T' in c[:-12]:
-                return True
-    return False
-
-
-def qualif_is_oddlot(x):
-    for c in [a.strip() for a in x.split(';')]:
-        if c == 'ODT[IRGCOND]':
-            return True
-        elif c == 'ODD[IRGCOND]':
-            return True
-    return False
-
-
-def qualif_is_closing(x):
-    for c in [a.strip() for a in x.split(';')]:
-        if c.endswith('_TEXT]'):
-            if '6' in c[:-10]:
-                return True
-        elif c.endswith('[LSTSALCOND]'):
-            if '6' in c[:-12]:
-                return True
-    return False
-           
- 
-def qualif_is_opening(x):
-    for c in [a.strip() for a in x.split(';')]:
-        if c.endswith('_TEXT]'):
-            if 'O' in c[:-10]:
-                return True
-        elif c.endswith('[LSTSALCOND]'):
-            if 'O' in c[:-12]:
-                return True
-        elif c == 'O [CTS_QUAL]':
-            return True
-    return False
-           
- 
-def qualif_is_cross(x):
-    for c in [a.strip() for a in x.split(';')]:
-        if c.endswith('_TEXT]'):
-            if 'X' in c[:-10]:
-                return True
-        elif c.endswith('[LSTSALCOND]'):
-            if 'X' in c[:-12]:
-                return True
-    return False
-    
- 
-def qualif_is_sweep(x):
-    for c in [a.strip() for a in x.split(';')]:
-        if c.endswith('_TEXT]'):
-            if 'F' in c[:-10]:
-                return True
-        elif c.endswith('[LSTSALCOND]'):
-            if 'F' in c[:-12]:
-                return True
-    return False
-    
- 
-def qualif_is_next_day(x):
-    for c in [a.strip() for a in x.split(';')]:
-        if c.endswith('_TEXT]'):
-            if 'N' in c[:-10]:
-                return True
-        elif c.endswith('[LSTSALCOND]'):
-            if 'N' in c[:-12]:
-                return True
-    return False
-    
-    
- 
-def qualif_is_bunched_trade(x):
-    for c in [a.strip() for a in x.split(';')]:
-        if c.endswith('_TEXT]'):
-            if 'B' in c[:-10]:
-                return True
-        elif c.endswith('[LSTSALCOND]'):
-            if 'B' in c[:-12]:
-                return True
-    return False
-    
- 
-def qualif_is_prior_reference_price(x):
-    for c in [a.strip() for a in x.split(';')]:
-        if c.endswith('_TEXT]'):
-            if 'P' in c[:-10]:
-                return True
-        elif c.endswith('[LSTSALCOND]'):
-            if 'P' in c[:-12]:
-                return True
-    return False
-
-# Extended trading hours (Sold Out of Sequence)
-def qualif_is_extended_hours(x):
-    for c in [a.strip() for a in x.split(';')]:
-        if c.endswith('_TEXT]'):
-            if 'U' in c[:-10]:
-                return True
-        elif c.endswith('[LSTSALCOND]'):
-            if 'U' in c[:-12]:
-                return True
-    return False
-
-
-def qualif_is_derivatively_priced(x):
-    for c in [a.strip() for a in x.split(';')]:
-        if c.endswith('_TEXT]'):
-            if '4' in c[:-10]:
-                return True
-        elif c.endswith('[LSTSALCOND]'):
-            if '4' in c[:-12]:
-                return True
-    return False
-
-
-def qualif_is_average_trade_price(x):
-    for c in [a.strip() for a in x.split(';')]:
-        if c.endswith('_TEXT]'):
-            if 'W' in c[:-10]:
-                return True
-        elif c.endswith('[LSTSALCOND]'):
-            if 'W' in c[:-12]:
-                return True
-    return False
-    
-def qualif_is_cash_sale(x):
-    for c in [a.strip() for a in x.split(';')]:
-        if c.endswith('_TEXT]'):
-            if 'C' in c[:-10]:
-                return True
-        elif c.endswith('[LSTSALCOND]'):
-            if 'C' in c[:-12]:
-                return True
-    return False
-    
-def qualif_is_sold_out_of_sequence(x):
-    for c in [a.strip() for a in x.split(';')]:
-        if c.endswith('_TEXT]'):
-            if 'Z' in c[:-10]:
-                return True
-        elif c.endswith('[LSTSALCOND]'):
-            if 'Z' in c[:-12]:
-                return True
-    return False
-    
 
 # Classifies the trades in the given dataframe.
 def process_classify_chunk(exch, date, df):
@@ -222,49 +70,24 @@ def process_classify_chunk(exch, date, df):
     df = df[df.Volume.notnull() & df.Volume != 0.0].copy()
     
     # Get the exchange date and time, if not available use the TRTH timestamp.
-    df['TS'] = df['Exch Time']
-
-    df = fast_date_parse(df, 'TS', date_parser=parse_exch_time)
-
-    df['DT'] = df['Trd/Qte Date']
-    sel = df['DT'].isnull()
-    df.loc[sel, 'DT'] = df.loc[sel, 'Date[G]']
-
-    df = fast_date_parse(df, 'DT')
-
-    df['TradeTime'] = df['TS'] + df['DT'] + df['GMT Offset'] * timedelta(hours=1)
+    with phase('trade_times', df):
+        ts, dt, trade_time = trade_times(df['Exch Time'], df['Trd/Qte Date'],
+                                         df['Date[G]'], df['GMT Offset'])
+        df['TS'] = to_timedelta64(ts)
+        df['DT'] = to_datetime64(dt)
+        df['TradeTime'] = to_datetime64(trade_time)
 
     df.loc[df['Qualifiers'].isnull(), 'Qualifiers'] = ''
-    
-    quals = pd.DataFrame(df['Qualifiers'].unique())
-    quals.columns = ['quals']
-
-    # List of qualifiers and corresponding functions
-    quals_list = [('FormT', qualif_is_form_t), ('Opening', qualif_is_opening),
-                  ('Closing', qualif_is_closing), ('Cross', qualif_is_cross),
-                  ('Sweep', qualif_is_sweep), ('NextDay', qualif_is_next_day),
-                  ('Bunched', qualif_is_bunched_trade),
-                  ('PriorRefPrice', qualif_is_prior_reference_price),
-                  ('ExtendedHoursSOoS', qualif_is_extended_hours),
-                  ('DerivativelyPriced', qualif_is_derivatively_priced),
-                  ('AverageTradePrice', qualif_is_average_trade_price),
-                  ('CashSale', qualif_is_cash_sale),
-                  ('SoldOutOfSequence', qualif_is_sold_out_of_sequence),
-                  ('OddLot', qualif_is_oddlot)]
-                 
-    # Extract qualifiers
-    for label, fct in quals_list:
-        quals[label] = quals['quals'].apply(fct) * 1
-    
-    quals_dict = quals.set_index('quals').to_dict()
-    
-    # Add qualifiers to dataframe
-    for label, fct in quals_list:
-        df[label] = df['Qualifiers'].map(quals_dict[label])
+
+    # Decode all qualifiers at once into a bitmask, then unpack the flags.
+    with phase('qualifiers', df):
+        qual_bits = trade_qualifiers.decode_series(df['Qualifiers'])
+        df = trade_qualifiers.unpack(qual_bits, df)
         
-    # Columns we want to keep in output
+    # Columns we want to keep in output (the sequence number orders the
+    # trades with the same time in AlignDates.py)
     outcols = ['#RIC', 'Date', 'Time', u'Ex/Cntrb.ID', u'Price', u'Volume',
-               u'Market VWAP'] + [x[0] for x in quals_list]
+               u'Market VWAP', 'Seq. No.'] + trade_qualifiers.flags
         
     if len(df) < 1:
         df['Date'] = df['DT']
@@ -273,79 +96,152 @@ def process_classify_chunk(exch, date, df):
         return (df[outcols].copy(), df, df)
         
     
-    df['Date'] = pd.to_datetime(df.TradeTime.dt.date)
-    df['Time'] = df.TradeTime - df.Date
+    with phase('time_of_day', df):
+        df['Date'] = to_datetime64(floor_day(trade_time))
+        df['Time'] = to_timedelta64(time_of_day(trade_time))
 
     # Also output "wrong trades" (ie. not FormT, Close, Open or NextDay but out of hours.)
-    # Keeping track of early close days.
+    # Keeping track of early close days (see TradingCalendar).
     
     open_time = date +  timedelta(hours=9, minutes=29, seconds=30)
     close_time = date +  timedelta(hours=16, seconds=30)
-    if date in early_close:
-        close_time = date +  timedelta(hours=13, seconds=30)
+    if is_trading_day(date):
+        open_time = session_open(date) - timedelta(seconds=30)
+        close_time = session_close(date) + timedelta(seconds=30)
     
     
-    sel_late = (df.TradeTime > close_time) & ~df.FormT & ~df.Closing & ~df.NextDay
-    sel_early = (df.TradeTime < open_time) & ~df.FormT & ~df.Opening
+    with phase('late_early', df) as p:
+        sel_late = (df.TradeTime > close_time) & ~df.FormT & ~df.Closing & ~df.NextDay
+        sel_early = (df.TradeTime < open_time) & ~df.FormT & ~df.Opening
     
-    df_late = df[sel_late]
-    df_early = df[sel_early]
+        df_late = df[sel_late]
+        df_early = df[sel_early]
+        p.done(len(df_late) + len(df_early))
     
 
     return (df[outcols].copy(), df_late, df_early)
 
 
+# Number and volume of the trades of df by RIC, venue and qualifiers, for
+# the anomaly kind. Without qualifiers, the trades are counted by RIC and
+# venue only.
+def anomaly_counts(df, kind, qualifiers=True):
+    keys = pd.DataFrame({'#RIC': df['#RIC'].fillna(''),
+                         'Ex/Cntrb.ID': df['Ex/Cntrb.ID'].fillna(''),
+                         'Anomaly': kind,
+                         'Qualifiers': df['Qualifiers'] if qualifiers else '',
+                         'Trades': 1, 'Volume': df['Volume']},
+                        index=df.index)
+    return keys.groupby(summary_keys, sort=False)[['Trades', 'Volume']].sum()
+
+
+# Adds the counts of a chunk to the summary of the day, which holds one row
+# per key whatever the number of trades.
+def add_counts(summary, counts):
+    if summary is None:
+        return counts
+    return summary.add(counts, fill_value=0)
+
+
+# Parsed file of one day (without extension).
+def parsed_fn(exch, date):
+    return (base_outdir + exch + '/' + str(date.year) + '/' + exch +
+            '-TradesParsed-' + date.strftime('%Y-%m-%d') + '.csv')
+
+
+# Start of the names of the spill files of the file of date.
+def spill_prefix(exch, date):
+    return (base_outdir + exch + '/' + str(date.year) + '/' + exch +
+            '-TradesSpill-' + date.strftime('%Y-%m-%d') + '-')
+
+
+# Spill file of the trades of the ET day target found in the file of date
+# (without extension).
+def spill_fn(exch, date, target):
+    return spill_prefix(exch, date) + target.strftime('%Y-%m-%d') + '.csv'
+
+
+# Files of the late trades, early trades and summary of one day.
+def error_files(exch, date):
+    datestr = date.strftime('%Y-%m-%d')
+    return [errordir + exch + '/' + exch + '-' + kind + '-' + datestr + '.csv'
+            for kind in ['LateTrades', 'EarlyTrades', 'TradeAnomalies']]
+
+
 # Processes trades for one day on one listing exchange.
 def process_classify(exch, date):
     
     
     fn = (basedir + exch + '/' + str(date.year) + '/' + exch + '-Trades-' + 
-          date.strftime('%Y-%m-%d') + '.csv.gz')
-    
-    dfs_late = []
-    dfs_early = []
-
-    first = True
-
-    out_fn = (base_outdir + exch + '/' + str(date.year) + '/' + exch +
-              '-TradesParsed-' + date.strftime('%Y-%m-%d') + '.csv')
-
-    # Read and process by chunk
-    for chunk in pd.read_csv(fn, chunksize=chunk_size):
+          date.strftime('%Y-%m-%d') + '.csv')
+
+    sink = open_sink(parsed_fn(exch, date), out_format, out_codec,
+                     out_threads, trade_qualifiers)
+
+    # Spill files by ET date, opened when a trade of that date is found. The
+    # spill files of a previous run are removed, since the dates may differ.
+    for old_fn in glob.glob(spill_prefix(exch, date) + '*'):
+        os.remove(old_fn)
+    spills = {}
+
+    # Documenting potential errors: the late and early trades are written
+    # as they are found (the files are only created if there are any), and
+    # counted with all the trades by RIC, venue and qualifiers.
+    late_fn, early_fn, summary_fn = error_files(exch, date)
+    late_sink = CSVSink(late_fn)
+    early_sink = CSVSink(early_fn)
+    summary = None
+
+    # Read and process by chunk, compressing the output as it is written
+    for chunk in read_csv(fn, chunksize=chunk_size):
         df, df_late, df_early = process_classify_chunk(exch, date, chunk)
         del chunk
-        dfs_late.append(df_late)
-        dfs_early.append(df_early)
-        
-        if first:
-            df.to_csv(out_fn, mode='w', header=True, index=False)
-            first = False
-        else:
-            df.to_csv(out_fn, mode='a', header=False, index=False)
-        del df
+        cols = [c for c in error_cols if c in df_late.columns]
+        for kind, df_error, error_sink in [('Late', df_late, late_sink),
+                                           ('Early', df_early, early_sink)]:
+            if len(df_error) > 0:
+                error_sink.append(df_error[cols])
+                summary = add_counts(summary, anomaly_counts(df_error, kind))
+        summary = add_counts(summary, anomaly_counts(df, 'All', False))
+        with phase('route_days', df):
+            spilled = ((df['Date'] >= date - timedelta(days=spill_days)) &
+                       (df['Date'] < date))
+            if spilled.any():
+                for target, part in df[spilled].groupby('Date', sort=False):
+                    if target not in spills:
+                        spills[target] = open_sink(
+                            spill_fn(exch, date, target), out_format,
+                            out_codec, out_threads, trade_qualifiers)
+                    spills[target].append(part)
+                df = df[~spilled]
+        sink.append(df)
+        del df, df_late, df_early
             
-    # Compress output
-    with open(out_fn, 'r') as f_in, gzip.open(out_fn + '.gz', 'wb') as f_out:
-        shutil.copyfileobj(f_in, f_out)
-    os.remove(out_fn)
-    
-    # Documenting potential errors
-    df_late = pd.concat(dfs_late)
-    del dfs_late
-    df_early = pd.concat(dfs_early)
-    del dfs_early
-    
-    late_fn = errordir + exch + '/' + exch + '-LateTrades-' + date.strftime('%Y-%m-%d') + '.csv'
-    early_fn = errordir + exch + '/' + exch + '-EarlyTrades-' + date.strftime('%Y-%m-%d') + '.csv'
-    
-    if len(df_late) > 0:
-        df_late.to_csv(late_fn, index=False)
-        with open(late_fn, 'r') as f_in, gzip.open(late_fn + '.gz', 'wb') as f_out:
-            shutil.copyfileobj(f_in, f_out)
-        os.remove(late_fn)
-    if len(df_early) > 0:
-        df_early.to_csv(early_fn, index=False)
-        with open(early_fn, 'r') as f_in, gzip.open(early_fn + '.gz', 'wb') as f_out:
-            shutil.copyfileobj(f_in, f_out)
-        os.remove(early_fn)
-    
\ No newline at end of file
+    sink.close()
+    for spill in spills.values():
+        spill.close()
+    late_sink.close()
+    early_sink.close()
+
+    if summary is not None:
+        summary = summary.reset_index()
+        summary.insert(0, 'Exchange', exch)
+        summary.insert(1, 'Date', date.strftime('%Y-%m-%d'))
+        summary['Trades'] = summary['Trades'].astype('int64')
+        write_csv(summary, summary_fn)
+
+
+# Input and output files of process_classify, for the pipeline runner. Of
+# the spill files, only the one of the day before is read by AlignDates.py.
+def task_files(exch, date):
+    datestr = date.strftime('%Y-%m-%d')
+    fn = (basedir + exch + '/' + str(date.year) + '/' + exch + '-Trades-' +
+          datestr + '.csv')
+    outputs = [parsed_fn(exch, date),
+               spill_fn(exch, date, date - timedelta(days=1))]
+    return [fn], outputs + error_files(exch, date)
+
+
+# Runs all the tasks found in the input directory on a pool of processes.
+if __name__ == '__main__':
+    run_tasks(process_classify, day_tasks(basedir, 'Trades'))
@@ -6,34 +6,47 @@ Python 2
 
 The main function takes the TAS (Time and Sales) file for one exchange on one 
 month and extracts only the trades from daily files, creating trade files.
+Trades sent twice (same RIC, venue and sequence number) are removed as they
+are read, and the duplicated and amended trades of each day are counted in a
+monthly summary file.
 """
 
 from os import listdir
 import os
 import pandas as pd
 from datetime import datetime
-import gzip
-import shutil
-import hashlib
 import sys
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', 'Common'))
+from RawFiles import Manifest, ChecksumError, read_verified_csv
+from CompressedCSV import CSVSink, write_csv
+from Scheduler import run_tasks, month_tasks
+from TradeDedup import TradeDedup, count_names
+from Metrics import task, phase, count
+
 
 outdir = 'M:\\vgregoire\\TRTH_Trades\\'
 
+# Raw files already verified, with their checksum
+manifest_fn = 'M:\\vgregoire\\TRTH_Raw_Manifest.csv'
+
+# Compression of the output files ('gzip', or 'zstd' and 'lz4' for faster
+# intermediate files) and number of compression threads.
+out_codec = 'gzip'
+out_threads = 1
 
-# Checks the md5 has to make sure the raw file is not corrupted
-def md5(fname):
-    hash_md5 = hashlib.md5()
-    with open(fname, "rb") as f:
-        for chunk in iter(lambda: f.read(4096), b""):
-            hash_md5.update(chunk)
-    return hash_md5.hexdigest()
+# Remove the duplicated trades of each date, across the chunks and files of
+# the date (see Common/TradeDedup.py).
+dedup = True
 
 
 # This function takes the TAS (Time and Sales) file for one exchange on one 
 # month and extracts only the trades from daily files, creating trade files.
 def process_task(exch, y, m):
     
+    manifest = Manifest(manifest_fn)
+
     mdir = 'Y:\\' + exch + '\\TAS\\' + str(y) + '\\' + str(m).zfill(2) + '\\'
     
     # List dates in the monthly directory
@@ -48,6 +61,9 @@ def process_task(exch, y, m):
     for fn in ls:
         dates_fn[datetime.strptime(fn[4:14], '%Y-%m-%d')].append(fn)
     
+    # Counts of the duplicated and amended trades of each date
+    summary = []
+    
     # Process all dates
     for date in dates_fn:
         fn = dates_fn[date]
@@ -60,35 +76,73 @@ def process_task(exch, y, m):
         str_cols = ['Ex/Cntrb.ID', 'Exch Time', 'Trd/Qte Date']
         dtypes = {x: object for x in str_cols}
     
-        dfs = []
-        
-        for f in fn:
-            # Validate file
-            md5_f = md5(mdir+f)
-            
-            with open(mdir+f+'.md5sum', 'r') as f_cs:
-                md5_check = f_cs.readline()[:32]
-                
-            if md5_f != md5_check:
-                sys.stderr.write('Wrong checksum for ' + f)
-                continue
-            
-            # Read the file by chunk to limit memory usage, filtering on trades.
-            for chunk in pd.read_csv(mdir + f, chunksize=10000, usecols=trade_cols,
-                                     dtype=dtypes):
-                df_trades = chunk[chunk.Type=='Trade'].copy()
-                del df_trades['Type']
-                dfs.append(df_trades)
-            
-        df = pd.concat(dfs)
-        
-        # Output
+        # Output, written as the trades are read
         out_fn = (outdir + exch + '\\' + str(y) + '\\' + exch + '-Trades-' +
                   date.strftime('%Y-%m-%d') + '.csv')
+        sink = CSVSink(out_fn, out_codec, out_threads)
+        deduper = TradeDedup()
         
-        df.to_csv(out_fn)
+        # Each day is recorded in the metrics log, if it is enabled.
+        with task('ExtractTrades.process_task',
+                  exch + ' ' + date.strftime('%Y-%m-%d')):
+            for f in fn:
+                # Read the file by chunk (sized to the memory of the worker)
+                # to limit memory usage, filtering on trades. The file is
+                # validated as it is read. If it is corrupted, what was
+                # written from it is removed.
+                marks = (sink.mark(), deduper.mark())
+                try:
+                    for chunk in read_verified_csv(mdir + f, manifest,
+                                                   chunksize='auto',
+                                                   usecols=trade_cols,
+                                                   dtype=dtypes):
+                        with phase('filter_trades', chunk) as p:
+                            df_trades = chunk[chunk.Type=='Trade'].copy()
+                            del df_trades['Type']
+                            p.done(df_trades)
+                        if dedup:
+                            with phase('dedup', df_trades) as p:
+                                df_trades = deduper.filter(df_trades)
+                                p.done(df_trades)
+                        sink.append(df_trades, index=True)
+                except ChecksumError:
+                    sink.rollback(marks[0])
+                    deduper.rollback(marks[1])
+                    sys.stderr.write('Wrong checksum for ' + f + '\n')
+            
+            sink.close()
+            count('duplicate_trades', deduper.counts['Duplicates'])
+            count('amended_trades', deduper.counts['Amended'])
         
-        with open(out_fn, 'r') as f_in, gzip.open(out_fn + '.gz', 'wb') as f_out:
-            shutil.copyfileobj(f_in, f_out)
-        os.remove(out_fn)
+        if dedup:
+            summary.append([date.strftime('%Y-%m-%d')] +
+                           [deduper.counts[name] for name in count_names])
     
+    if dedup:
+        write_csv(pd.DataFrame(sorted(summary),
+                               columns=['Date'] + count_names),
+                  dedup_fn(exch, y, m))
+
+
+# Summary of the duplicated and amended trades of one month.
+def dedup_fn(exch, y, m):
+    return (outdir + exch + '\\' + str(y) + '\\' + exch + '-TradesDedup-' +
+            str(y) + '-' + str(m).zfill(2) + '.csv')
+
+
+# Input and output files of process_task, for the pipeline runner.
+def task_files(exch, y, m):
+    mdir = 'Y:\\' + exch + '\\TAS\\' + str(y) + '\\' + str(m).zfill(2) + '\\'
+    ls = [fn for fn in listdir(mdir)
+          if fn[15:23] == 'TAS-Data' and fn.endswith('.gz')]
+    dates = sorted(set(datetime.strptime(fn[4:14], '%Y-%m-%d') for fn in ls))
+    out_fns = [outdir + exch + '\\' + str(y) + '\\' + exch + '-Trades-' +
+               date.strftime('%Y-%m-%d') + '.csv' for date in dates]
+    if dedup:
+        out_fns.append(dedup_fn(exch, y, m))
+    return [mdir + fn for fn in sorted(ls)], out_fns
+
+
+# Runs all the tasks found in the input directory on a pool of processes.
+if __name__ == '__main__':
+    run_tasks(process_task, month_tasks('Y:\\'))
@@ -15,33 +15,41 @@ import os
 import time as tm
 import multiprocessing as mp
 import logging
+import sys
 
-import gzip
-import shutil
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', 'Common'))
+from TickFiles import find_ticks, read_ticks
+from AsofSampler import sample_panel
+from TradingCalendar import event_open
+from Metrics import recorded, phase
 
-from pandas.tseries.holiday import USFederalHolidayCalendar
-from pandas.tseries.offsets import CustomBusinessDay
 
+trade_dir = 'M:\\vgregoire\\TRTH_Trades_AroundEarnings\\'
 
+# Minutes after the open at the end of the grid
+after_open = 30
 
-us_bd = CustomBusinessDay(calendar=USFederalHolidayCalendar())
-
-
-trade_dir = 'M:\\vgregoire\\TRTH_Trades_AroundEarnings\\'
+id_cols = ['PERMNO', 'EA_Time', 'EA_Timestamp', '#RIC', 'Exchange']
 
 
-def process_task(permno, date, ea_ts, ric, exch):
+# Reads the regular trades of one event within extended trading hours,
+# sorted by time. Returns None if there is no trade file or it is empty.
+def read_event_trades(permno, date, ea_ts, ric, exch):
     datestr = date.strftime('%Y-%m-%d')
 
     fn_trades = (trade_dir + exch + '/' + str(date.year) + '/' + exch +
-                 '-TradesAroundEvent-' + datestr + '_' + str(permno) + '.csv.gz')
+                 '-TradesAroundEvent-' + datestr + '_' + str(permno) + '.csv')
     
-    if not os.path.isfile(fn_trades):
+    # Only the columns used are read.
+    cols = ['#RIC', 'Timestamp', 'Price', 'NextDay', 'PriorRefPrice',
+            'DerivativelyPriced', 'SoldOutOfSequence']
+    if find_ticks(fn_trades) is None:
         #print('Missing file:' + fn_quotes)
         return None
     else:
         try:
-            df_trades = pd.read_csv(fn_trades)
+            df_trades = read_ticks(fn_trades, columns=cols)
         except Exception as e:
             print(e)
             return None
@@ -54,33 +62,42 @@ def process_task(permno, date, ea_ts, ric, exch):
                (df_trades.PriorRefPrice == 0) & 
                (df_trades.DerivativelyPriced == 0 ) &
                (df_trades.SoldOutOfSequence == 0))
-    cols = ['#RIC', 'Date', 'Time', 'Price', 'Volume',]
+    cols = ['#RIC', 'Timestamp', 'Price']
     df_trades = df_trades.loc[reg_sel, cols].copy()
     
     
     df_trades = df_trades[df_trades['#RIC'].notnull()]
- 
-    
-    df_trades['Timestamp'] = pd.to_datetime(df_trades['Date'] + ' ' +
-                                            df_trades['Time'].str[7:])   
 
     # Trades that have timestamps outside of extended trading hours may get
     # misclassified, we drop those.
-    sel = ((df_trades['Timestamp'].dt.time >= time(4)) &
-           (df_trades['Timestamp'].dt.time <= time(20)))
+    tod = df_trades['Timestamp'] - df_trades['Timestamp'].dt.normalize()
+    sel = ((tod >= timedelta(hours=4)) &
+           (tod <= timedelta(hours=20)))
 
     df_trades = df_trades[sel]
 
-    # We also want at the opening of markets
-    open_ts = date + timedelta(hours=9, minutes=30)
-    # Shift by one day if necessary
-    if ea_ts.time() > time(12):
-        open_ts = open_ts + us_bd
+    df_trades = df_trades[['Timestamp', 'Price']]
+    
+    return df_trades.sort_values('Timestamp')
+
+
+# Last minute of the grid of an event: after_open minutes after the open.
+def last_minute(date, ea_ts):
+    # We also want at the opening of markets (the next day for events after
+    # noon)
+    open_ts = event_open(date, ea_ts)
     
     # Figure out how far we need to go
     td = open_ts - ea_ts
-    after_open = 30
-    min_after = int(np.ceil(td.total_seconds()/60)) + after_open
+    return int(np.ceil(td.total_seconds()/60)) + after_open
+
+
+def process_task(permno, date, ea_ts, ric, exch):
+    df_trades = read_event_trades(permno, date, ea_ts, ric, exch)
+    if df_trades is None:
+        return None
+
+    min_after = last_minute(date, ea_ts)
     
     # First, create dataframse to merge on.
     
@@ -92,10 +109,6 @@ def process_task(permno, date, ea_ts, ric, exch):
     ts_ann_1m['MinutesAfterOpen'] = ts_ann_1m['MinutesAfter'] - ts_ann_1m['MinutesAfter'].max() + after_open
 
     # Now merge asof to get the valid quotes at each point in time.
-    df_trades = df_trades[['Timestamp', 'Price']]
-    
-    df_trades = df_trades.sort_values('Timestamp')
-    
     merge_ann_1m = pd.merge_asof(ts_ann_1m, df_trades,
                                  on='Timestamp',
                                  tolerance=timedelta(minutes=1))
@@ -107,10 +120,47 @@ def process_task(permno, date, ea_ts, ric, exch):
         x['#RIC'] = ric
         x['Exchange'] = exch
     
-    id_cols = ['PERMNO', 'EA_Time', 'EA_Timestamp', '#RIC', 'Exchange']
     trade_cols = ['Price']
     
     merge_ann_1m = merge_ann_1m[id_cols + ['MinutesAfter', 'MinutesAfterOpen'] + trade_cols]
     
     return merge_ann_1m
 
+
+# Same as process_task for a list of events (permno, date, ea_ts, ric, exch),
+# resampled together into one panel. Returns the table of the events with a
+# trade file (id columns, the last MinutesAfter of their grid, and the
+# MinutesAfter of the open, so that MinutesAfterOpen = MinutesAfter -
+# OpenMinutesAfter), the MinutesAfter offsets of the panel and the
+# (event x offset x field) array of the trade columns. If fname is given, the
+# array is a memory-mapped .npy file.
+@recorded
+def process_events(events, fname=None):
+    ids = []
+    dfs = []
+    for permno, date, ea_ts, ric, exch in events:
+        df_trades = read_event_trades(permno, date, ea_ts, ric, exch)
+        if df_trades is None:
+            continue
+        df_trades['Event'] = len(ids)
+        dfs.append(df_trades)
+        min_after = last_minute(date, ea_ts)
+        ids.append((permno, date, ea_ts, ric, exch, min_after,
+                    min_after - after_open))
+
+    ids = pd.DataFrame(ids, columns=id_cols + ['LastMinutesAfter',
+                                               'OpenMinutesAfter'])
+    if len(dfs) > 0:
+        df_trades = pd.concat(dfs, ignore_index=True)
+    else:
+        df_trades = pd.DataFrame({'Timestamp': pd.to_datetime([]),
+                                  'Price': [], 'Event': []})
+
+    trade_cols = ['Price']
+    with phase('sample', df_trades):
+        offsets, panel = sample_panel(df_trades, ids['EA_Timestamp'],
+                                      timedelta(minutes=1), -5,
+                                      ids['LastMinutesAfter'], trade_cols,
+                                      tolerance=timedelta(minutes=1),
+                                      fname=fname)
+    return ids, offsets, panel
@@ -7,32 +7,56 @@ Python 2
 The main function processes trades for one event, keeps only
 trades starting at the last trade before the event, and computes returns,
 time difference between two trades and other trade characteristics.
+process_events does the same for a list of events at once, on one table of
+the trades of all events.
 """
 
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta, time
 import os
+import sys
 
-from pandas.tseries.holiday import USFederalHolidayCalendar
-from pandas.tseries.offsets import CustomBusinessDay
-
-us_bd = CustomBusinessDay(calendar=USFederalHolidayCalendar())
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', 'Common'))
+from TickFiles import find_ticks, read_ticks
+from TradingCalendar import event_open
+from Metrics import recorded, phase
 
 trades_dir = 'M:\\vgregoire\\TRTH_Trades_AroundEarnings\\'
-    
-def process_task(permno, date, ea_ts, ric, exch):
-    
-    # Read data
+
+# Listing exchange codes, and venue codes of the primary market
+nasdaq_codes = ['NAQ', 'NMQ', 'NSQ']
+nyse_codes = ['ASQ', 'NYQ', 'PSQ']
+nasdaq_primary = ['NAS', 'THM']
+nyse_primary = ['PSE', 'NYS', 'ASE']
+
+outcols = [u'permno', u'EA_Timestamp', u'#RIC', u'Date', u'Timestamp',
+           u'Ex/Cntrb.ID', u'Price',
+           u'Volume', u'Duration', u'LogRet', u'CumRet', u'LogPrice', 
+           u'LogPrice_1',
+           u'Sweep', u'OddLot', u'TradeID', u'Dark', u'Primary']
+
+
+# Reads the trades of one event. Returns None if there is no trade file.
+def read_event_trades(permno, date, ric, exch):
     datestr = date.strftime('%Y-%m-%d')
     fn_trades = (trades_dir + exch + '/' + str(date.year) + '/' + exch +
-             '-TradesAroundEvent-' + datestr + '_' + str(permno) + '.csv.gz')
-    if not os.path.isfile(fn_trades):
+             '-TradesAroundEvent-' + datestr + '_' + str(permno) + '.csv')
+    if find_ticks(fn_trades) is None:
         return None
-    df_trades = pd.read_csv(fn_trades)
+    return read_ticks(fn_trades,
+                      columns=['#RIC', 'Date', 'Timestamp', 'Ex/Cntrb.ID',
+                               'Price', 'Volume', 'FormT', 'Sweep',
+                               'OddLot'])
+
+
+def process_task(permno, date, ea_ts, ric, exch):
     
-    df_trades['Timestamp'] = pd.to_datetime(df_trades['Date'] + ' ' +
-                                df_trades['Time'].apply(lambda x: x[-18:]))
+    # Read data
+    df_trades = read_event_trades(permno, date, ric, exch)
+    if df_trades is None:
+        return None
     
     # We care about three type of trades: in AH before the event, in AH after
     # the event, in the morning after the event.
@@ -41,12 +65,7 @@ def process_task(permno, date, ea_ts, ric, exch):
     # next day opening
     # For events in the before trading period, we want all FormT before
     # same-day opening
-    if ea_ts.time() > time(12, 0, 0):
-        evt_dt = date
-    else:
-        evt_dt = date - 1*us_bd
-        
-    open_ts = evt_dt + 1*us_bd + timedelta(hours=9, minutes=30)
+    open_ts = event_open(date, ea_ts)
     
     sel = ((df_trades.Timestamp > ea_ts) & (df_trades.Timestamp < open_ts) &
            (df_trades.FormT == 1))
@@ -57,7 +76,7 @@ def process_task(permno, date, ea_ts, ric, exch):
         return None
     
     # Get last trade price before announcement
-    if len(df_trades[df_trades.Timestamp < ea_ts] > 0):
+    if (df_trades.Timestamp < ea_ts).any():
         prev_price = df_trades[df_trades.Timestamp < ea_ts].iloc[-1].Price
     else:
         prev_price = np.nan
@@ -71,13 +90,10 @@ def process_task(permno, date, ea_ts, ric, exch):
     df_trades_after['Dark'] = 1 * (df_trades_after['Ex/Cntrb.ID'] == 'ADF')
     
     # Listing exchange dummy
-    nasdaq_codes = ['NAQ', 'NMQ', 'NSQ']
-    nyse_codes = ['ASQ', 'NYQ', 'PSQ']
-    
     if exch in nasdaq_codes:
-        df_trades_after['Primary'] = 1 * (df_trades_after['Ex/Cntrb.ID'].isin(['NAS', 'THM']))
+        df_trades_after['Primary'] = 1 * (df_trades_after['Ex/Cntrb.ID'].isin(nasdaq_primary))
     elif exch in nyse_codes:
-        df_trades_after['Primary'] = 1 * (df_trades_after['Ex/Cntrb.ID'].isin(['PSE', 'NYS', 'ASE']))
+        df_trades_after['Primary'] = 1 * (df_trades_after['Ex/Cntrb.ID'].isin(nyse_primary))
     else:
         raise Exception('Unknown exchange')
     
@@ -101,11 +117,105 @@ def process_task(permno, date, ea_ts, ric, exch):
     df_trades_after['permno'] = permno
     df_trades_after['EA_Timestamp'] = ea_ts
         
-        
-    outcols = [u'permno', u'EA_Timestamp', u'#RIC', u'Date', u'Timestamp',
-               u'Ex/Cntrb.ID', u'Price',
-               u'Volume', u'Duration', u'LogRet', u'CumRet', u'LogPrice', 
-               u'LogPrice_1',
-               u'Sweep', u'OddLot', u'TradeID', u'Dark', u'Primary']
-        
     return df_trades_after[outcols].copy()
+
+
+def _ns(x, unit):
+    return np.asarray(x, dtype=unit).view(np.int64)
+
+
+# Same as process_task for all events at once. df_trades holds the trades of
+# all events, with the number of the event (its row in events) in the Event
+# column. The trades of an event are contiguous, in file order. events has
+# the permno, EA_Timestamp, Open (see event_open) and Exchange of each event.
+# Returns the concatenated outputs of process_task.
+def after_news_trades(df_trades, events):
+    event = np.asarray(df_trades['Event'], dtype=np.int64)
+    ts = _ns(df_trades['Timestamp'], 'M8[ns]')
+    ea = _ns(events['EA_Timestamp'], 'M8[ns]')
+    price = np.asarray(df_trades['Price'], dtype=np.float64)
+
+    # Last trade price before the announcement of each event
+    pos = np.where(ts < ea[event], np.arange(len(ts)), -1)
+    last_before = np.full(len(events), -1, dtype=np.int64)
+    np.maximum.at(last_before, event, pos)
+    prev_price = np.where(last_before >= 0, price[last_before], np.nan)
+
+    sel = ((ts > ea[event]) &
+           (ts < _ns(events['Open'], 'M8[ns]')[event]) &
+           (np.asarray(df_trades['FormT']) == 1))
+    df = df_trades[sel].reset_index(drop=True)
+    event = event[sel]
+    ts = ts[sel]
+    n = len(df)
+
+    # First trade of each event, and position of the first trade of the
+    # event of each trade
+    first = np.ones(n, dtype=bool)
+    first[1:] = event[1:] != event[:-1]
+    start = np.maximum.accumulate(np.where(first, np.arange(n), 0))
+
+    df['TradeID'] = np.arange(n) - start + 1
+
+    df['Dark'] = 1 * (df['Ex/Cntrb.ID'] == 'ADF')
+
+    # Listing exchange dummy
+    exch = np.asarray(events['Exchange'], dtype=object)[event]
+    nasdaq = np.isin(exch, nasdaq_codes)
+    nyse = np.isin(exch, nyse_codes)
+    if not (nasdaq | nyse).all():
+        raise Exception('Unknown exchange')
+    venue = df['Ex/Cntrb.ID']
+    df['Primary'] = 1 * ((nasdaq & venue.isin(nasdaq_primary)) |
+                         (nyse & venue.isin(nyse_primary)))
+
+    # Returns and interval between trades, from the announcement time and
+    # the pre-announcement price for the first trade of each event.
+    df['LogPrice'] = np.log(df['Price'])
+    ts_1 = np.empty(n, dtype=np.int64)
+    ts_1[1:] = ts[:-1]
+    ts_1[first] = ea[event[first]]
+    logprice_1 = np.empty(n)
+    logprice_1[1:] = df['LogPrice'].values[:-1]
+    logprice_1[first] = np.log(prev_price[event[first]])
+    df['LogPrice_1'] = logprice_1
+
+    df['Duration'] = pd.Series((ts - ts_1).view('m8[ns]')).dt.total_seconds()
+    df['LogRet'] = df['LogPrice'] - df['LogPrice_1']
+    df['CumRet'] = df['LogRet'].groupby(event).cumsum()
+
+    df['permno'] = np.asarray(events['permno'])[event]
+    df['EA_Timestamp'] = events['EA_Timestamp'].values[event]
+
+    return df[outcols]
+
+
+# Same as process_task for a list of events (permno, date, ea_ts, ric, exch).
+# Returns the outputs of all the events, concatenated, or None if there are
+# none.
+@recorded
+def process_events(events):
+    events = [tuple(e) for e in events]
+    if len(events) == 0:
+        return None
+    opens = event_open([e[1] for e in events], [e[2] for e in events])
+
+    dfs = []
+    rows = []
+    for (permno, date, ea_ts, ric, exch), open_ts in zip(events, opens):
+        df_trades = read_event_trades(permno, date, ric, exch)
+        if df_trades is None or len(df_trades) == 0:
+            continue
+        df_trades['Event'] = len(rows)
+        dfs.append(df_trades)
+        rows.append((permno, ea_ts, open_ts, exch))
+    if len(dfs) == 0:
+        return None
+
+    events = pd.DataFrame(rows, columns=['permno', 'EA_Timestamp', 'Open',
+                                         'Exchange'])
+    df_trades = pd.concat(dfs, ignore_index=True)
+    with phase('after_news', df_trades) as p:
+        df = after_news_trades(df_trades, events)
+        p.done(df)
+    return df if len(df) > 0 else None
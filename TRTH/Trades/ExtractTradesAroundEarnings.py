@@ -12,18 +12,25 @@ from os import listdir
 import os
 import pandas as pd
 from datetime import datetime
-import gzip
-import shutil
 import sys
 
-from pandas.tseries.holiday import USFederalHolidayCalendar
-from pandas.tseries.offsets import CustomBusinessDay
-
-us_bd = CustomBusinessDay(calendar=USFederalHolidayCalendar())
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', 'Common'))
+from Qualifiers import trade_qualifiers
+from TickFiles import find_ticks, read_ticks, write_ticks, open_sink
+from EventBatch import process_batch
+from TradingCalendar import event_windows, is_trading_day
 
 basedir = 'M:\\vgregoire\\TRTH_Trades_Final\\'
 outdir = 'M:\\vgregoire\\TRTH_Trades_AroundEarnings\\'
 
+# Format of the output files ('csv', or 'parquet' for typed columnar files),
+# their compression ('gzip', or 'zstd' and 'lz4' for faster intermediate
+# files) and number of compression threads (csv files only).
+out_format = 'csv'
+out_codec = 'gzip'
+out_threads = 1
+
 
 """
 The summary of the procedure is as follow:
@@ -32,36 +39,80 @@ The summary of the procedure is as follow:
         after max(EA,IBES)
     - The output is one file per event. (permno date)
 """
-def process_event(permno, date1, date2, ric, exch):
-    permno, date1, date2, ric, exch = task
-    
-    # One day before to one day after
-    date_start = min(date1, date2) - us_bd
-    date_end = max(date1, date2) + us_bd
-    dr = pd.date_range(date_start, date_end)
-    
-    dfs = []
-    for date in dr:
-        y = date.year
-        m = date.month
-        d = date.day
-        datestr = str(y) + '-' + str(m).zfill(2) + '-' + str(d).zfill(2)
-        
-        fn = (basedir + exch + '\\' + str(y) + '\\' + exch +
-              '-TradesParsed-' + datestr + '.csv.gz')
-        
-        # Keep only trades for the event stock (#RIC)
-        for chunk in pd.read_csv(fn, chunksize=1000000):
-            dfs.append(chunk[chunk['#RIC'] == ric].copy())
-        
+# First and last days of the event windows (of one event, or of arrays of
+# events): one day before to one day after, in trading days.
+def window_bounds(date1, date2):
+    return event_windows(date1, date2, 1, 1)
+
+
+# Days of the event window.
+def event_dates(date1, date2):
+    date_start, date_end = window_bounds(date1, date2)
+    return pd.date_range(date_start, date_end)
+
+
+def daily_fn(exch, date):
+    datestr = date.strftime('%Y-%m-%d')
+    return (basedir + exch + '\\' + str(date.year) + '\\' + exch +
+            '-TradesParsed-' + datestr + '.csv')
+
+
+# Reads the trades of the given RIC(s) in one daily file by chunk. Returns
+# None if there is no file, and logs it if the day is a trading day.
+def read_day(exch, date, ric):
+    fn = daily_fn(exch, date)
+    if find_ticks(fn) is None:
+        # The windows span calendar days: only the missing files of
+        # trading days are reported.
+        if is_trading_day(date):
+            sys.stderr.write('Missing daily file ' + fn + '\n')
+        return None
+    return read_ticks(fn, chunksize='auto', ric=ric)
+
+
+def event_fn(permno, date1, exch):
+    datestr = date1.strftime('%Y-%m-%d')
+    return (outdir + exch + '\\' + str(date1.year) + '\\' + exch +
+            '-TradesAroundEvent-' + datestr + '_' + str(permno) + '.csv')
+
+
+def write_event(permno, date1, exch, dfs):
     # Prepare output
     df = pd.concat(dfs)
-    datestr = date1.strftime('%Y-%m-%d')
-    outfn = (outdir + exch + '\\' + str(date1.year) + '\\' + exch +
-             '-TradesAroundEvent-' + datestr + '_' + str(permno) + '.csv')
+    outfn = event_fn(permno, date1, exch)
     
-    df.to_csv(outfn, index=False)
-    with open(outfn, 'r') as f_in, gzip.open(outfn + '.gz', 'wb') as f_out:
-        shutil.copyfileobj(f_in, f_out)
-    os.remove(outfn)
+    write_ticks(df, outfn, out_format, out_codec, out_threads,
+                trade_qualifiers)
+
+
+# The trades are written as they are read, day by day. Missing daily files
+# are skipped.
+def process_event(permno, date1, date2, ric, exch):
+    with open_sink(event_fn(permno, date1, exch), out_format, out_codec,
+                   out_threads, trade_qualifiers) as sink:
+        for date in event_dates(date1, date2):
+            # Keep only trades for the event stock (#RIC)
+            chunks = read_day(exch, date, ric)
+            if chunks is not None:
+                for chunk in chunks:
+                    sink.append(chunk)
+
+
+# Input and output files of process_event, for the pipeline runner.
+def task_files(permno, date1, date2, ric, exch):
+    return ([daily_fn(exch, date) for date in event_dates(date1, date2)],
+            [event_fn(permno, date1, exch)])
+
+
+# Same as process_event for a list of events (permno, date1, date2, ric,
+# exch), reading each daily file once for all the events that need it.
+# Missing daily files are skipped.
+def process_events(events):
+
+    def write(event, dfs):
+        permno, date1, date2, ric, exch = event
+        if len(dfs) > 0:
+            write_event(permno, date1, exch, dfs)
+
+    process_batch(events, window_bounds, read_day, write)
 
@@ -5,69 +5,51 @@ Vincent Grégoire and Charles Martineau.
 Python 2
 
 The main function creates stats for each event that are used
-for descriptive stats tables.
+for descriptive stats tables. process_events creates them for the whole
+sample, adding the trades of each event file to the bin counts chunk by
+chunk (see Common/Histograms.py), and can split the events over a pool of
+processes.
 """
 
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta, time
-import oss
+import os
+import sys
 
-from pandas.tseries.holiday import USFederalHolidayCalendar
-from pandas.tseries.offsets import CustomBusinessDay
-
-us_bd = CustomBusinessDay(calendar=USFederalHolidayCalendar())
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', 'Common'))
+from TickFiles import find_ticks, read_ticks
+from Histograms import Histograms
+from Scheduler import run_tasks
+from TradingCalendar import next_trading_day, previous_trading_day
 
 
 trades_dir = 'M:\\vgregoire\\TRTH_Trades_AroundEarnings/'
 outdir = 'M:\\vgregoire\\TRTH_Trades_Stats\\'
 
+# Count by size
+vol_bins = [0, 100, 500, 1000, np.inf]
+# Count by $ value
+val_bins = [0, 1000, 5000, 50000, np.inf]
+stat_bins = [('Volume', vol_bins), ('Value', val_bins)]
 
-def compute_sample_stats(sub_df, date, sample, vol_bins, val_bins):
-    sub_df['vol_bin'] = pd.cut(sub_df['Volume'], vol_bins, right=False)
-    sub_df['val_bin'] = pd.cut(sub_df['Value'], val_bins, right=False)
-    
-    vol_count = sub_df.groupby(['#RIC', 'vol_bin'])[['Volume']].count()
-    vol_count = vol_count.unstack(level=1)
-    vol_count = vol_count.fillna(0)
-    # Compute in %
-    
-    vol_sum = vol_count.sum(axis=1)
-    for c in vol_count.columns:
-        vol_count[c] = vol_count[c] / vol_sum
-    
-    val_count = sub_df.groupby(['#RIC', 'val_bin'])[['Value']].count()
-    val_count = val_count.unstack(level=1)
-    val_count = val_count.fillna(0)
-    # Compute in %
-    val_sum = val_count.sum(axis=1)
-    for c in val_count.columns:
-        val_count[c] = val_count[c] / val_sum
-        
-    vol_count.columns = [c[0] + ' ' + str(c[1]) for c in vol_count.columns]
-    val_count.columns = [c[0] + ' ' + str(c[1]) for c in val_count.columns]
-    merged = pd.merge(vol_count, val_count,
-                      left_index=True, right_index=True)
+# Chunks of the event files sized to the memory of the worker (see
+# Common/Chunks.py), or a number of rows.
+chunksize = 'auto'
 
-    
-    merged['Date'] = date
-    merged['Sample'] = sample
-    merged['NumberOfTrades'] = len(sub_df)
-    return merged.reset_index().set_index(['#RIC', 'Date', 'Sample'])
-   
 
-def process_event(permno, date, ea_ts, ric, exch):
+# Adds the regular-hours trades of one event to the bin counts, for the
+# day of the event (pre_all) and the following trading day (post_all), per
+# RIC. The counts are keyed by (permno, announcement time, event RIC, date,
+# sample, RIC). Returns False if there is no trade file.
+def add_event_stats(hist, permno, date, ea_ts, ric, exch):
     datestr = date.strftime('%Y-%m-%d')
 
     fn_trades = (trades_dir + exch + '/' + str(date.year) + '/' + exch +
-             '-TradesAroundEvent-' + datestr + '_' + str(permno) + '.csv.gz')
-    if not os.path.isfile(fn_trades):
-        return None
-    df_trades = pd.read_csv(fn_trades)
-    
-    
-    df_trades['Timestamp'] = pd.to_datetime(df_trades['Date'] + ' ' +
-                                df_trades['Time'].apply(lambda x: x[-18:]))
+             '-TradesAroundEvent-' + datestr + '_' + str(permno) + '.csv')
+    if find_ticks(fn_trades) is None:
+        return False
     
     # We care about three type of trades: in AH before the event, in AH after
     # the event, in the morning after the event.
@@ -80,41 +62,82 @@ def process_event(permno, date, ea_ts, ric, exch):
     if ea_ts.time() > time(12, 0, 0):
         evt_dt = date
     else:
-        evt_dt = date - 1*us_bd
-    
-    df_pre = df_trades[(df_trades.Timestamp.dt.date == evt_dt) &
-                       ((df_trades.FormT == 0))].copy()
-    df_post = df_trades[(df_trades.Timestamp.dt.date == (evt_dt + 1*us_bd)) &
-                       ((df_trades.FormT == 0))].copy()
-    
-    # Count by size
-    vol_bins = [0, 100, 500, 1000, np.inf]
-    # Count by $ value
-    val_bins = [0, 1000, 5000, 50000, np.inf]
-    
-    if len(df_pre) > 0:
-        df_pre = df_pre[['#RIC', 'Ex/Cntrb.ID', 'Price', 'Volume', 'FormT']]
-        df_pre['Value'] = df_pre['Price'] * df_pre['Volume']
-        
-        
-        pre_stats = compute_sample_stats(df_pre, date, 'pre_all', vol_bins, val_bins)
-    else:
-        pre_stats = None
-            
-    if len(df_post) > 0:
-        df_post = df_post[['#RIC', 'Ex/Cntrb.ID', 'Price', 'Volume', 'FormT']]
-        df_post['Value'] = df_post['Price'] * df_post['Volume']
-        
-        
-        post_stats = compute_sample_stats(df_post, date, 'post_all', vol_bins, val_bins)
-    else:
-        post_stats = None
-        
-        if pre_stats is None:
-            return None
+        evt_dt = previous_trading_day(date)
     
-    stats = pd.concat([pre_stats, post_stats])
-    
-    stats['#RIC'] = ric
+    for df_trades in read_ticks(fn_trades,
+                                columns=['#RIC', 'Timestamp', 'Price',
+                                         'Volume', 'FormT'],
+                                chunksize=chunksize):
+        df_trades['Value'] = df_trades['Price'] * df_trades['Volume']
+        day = df_trades.Timestamp.dt.normalize()
+        df_pre = df_trades[(day == evt_dt) & (df_trades.FormT == 0)]
+        df_post = df_trades[(day == next_trading_day(evt_dt)) &
+                            (df_trades.FormT == 0)]
+        hist.add(df_pre, (permno, ea_ts, ric, date, 'pre_all'), by='#RIC')
+        hist.add(df_post, (permno, ea_ts, ric, date, 'post_all'),
+                 by='#RIC')
+    return True
+
 
+# Share of the trades in each size and $ value bin, and number of trades of
+# the sample (all RICs of the event), indexed by RIC, date and sample, with
+# the RIC of the event in the #RIC column. Returns None if there are no
+# trades.
+def stats_table(hist):
+    names = ['permno', 'EA_Timestamp', 'EventRIC', 'Date', 'Sample', '#RIC']
+    stats = hist.table(names, 'NumberOfTrades')
+    if len(stats) == 0:
+        return None
+    totals = pd.Series(hist.totals,
+                       index=pd.MultiIndex.from_tuples(hist.order,
+                                                       names=names))
+    totals = totals.groupby(level=names[:-1], sort=False).sum()
+    stats['NumberOfTrades'] = totals.reindex(
+        stats.index.droplevel('#RIC')).values
+    rics = stats.index.get_level_values('EventRIC')
+    stats = stats.reset_index(['permno', 'EA_Timestamp', 'EventRIC'],
+                              drop=True)
+    stats = stats.reorder_levels(['#RIC', 'Date', 'Sample'])
+    stats['#RIC'] = rics
     return stats
+
+
+def process_event(permno, date, ea_ts, ric, exch):
+    hist = Histograms(stat_bins)
+    if not add_event_stats(hist, permno, date, ea_ts, ric, exch):
+        return None
+    return stats_table(hist)
+
+
+# Bin counts of a list of events (permno, date, ea_ts, ric, exch).
+def event_histograms(events):
+    hist = Histograms(stat_bins)
+    for event in events:
+        add_event_stats(hist, *event)
+    return hist
+
+
+# Same as concatenating the outputs of process_event over the events, without
+# keeping the trades or the per-event tables. With more than one process, the
+# events are split in consecutive groups whose counts are merged in order.
+def process_events(events, processes=1):
+    events = [tuple(e) for e in events]
+    if processes == 1 or not events:
+        return stats_table(event_histograms(events))
+
+    size = -(-len(events) // processes)
+    groups = [events[i:i + size] for i in range(0, len(events), size)]
+
+    def describe(args):
+        k = groups.index(args[0])
+        return 'events %d to %d' % (k * size + 1, k * size + len(args[0]))
+
+    results, failed = run_tasks(event_histograms,
+                                [((g,), len(g)) for g in groups],
+                                processes=processes, describe=describe)
+    if failed:
+        raise Exception('Failed group of events:\n' + failed[0][1])
+    hist = Histograms(stat_bins)
+    for args, h in sorted(results, key=lambda r: groups.index(r[0][0])):
+        hist.merge(h)
+    return stats_table(hist)